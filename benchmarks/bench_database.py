@@ -0,0 +1,102 @@
+"""
+Measure the latency of L{Database.call} for each of the database backends as
+the number of cached calls grows. A I{hit} looks up a call that's already in
+the database, and a I{miss} looks up one that isn't, runs it and caches the
+result.
+"""
+
+import contextlib
+import random
+import tempfile
+import time
+
+import fbuild.context
+import fbuild.functools
+from fbuild.path import Path
+
+from benchutil import result, time_calls
+
+# -----------------------------------------------------------------------------
+
+def _lookup(x):
+    return x
+
+
+def _populate(db, backend, records):
+    """Cache I{records} calls to L{_lookup}. This runs on the database thread
+    and goes straight to the backend so we don't spend forever filling up the
+    larger databases."""
+
+    fun_name, function, args, kwargs = db._find_function_name(_lookup, (0,), {})
+    fun_digest = db._digest_function(function, args, kwargs)
+
+    fun_dirty, fun_id = backend.check_function(fun_name, fun_digest)
+    if fun_dirty:
+        fun_id = backend.save_function(fun_id, fun_name, fun_digest)
+
+    # Save everything in a single transaction if the backend has them.
+    conn = getattr(backend, 'conn', None)
+    with conn if conn is not None else contextlib.ExitStack():
+        for x in range(records):
+            bound = fbuild.functools.bind_args(function, (x,), {})
+            backend.save_call(None, fun_id, bound, x)
+
+
+def _bench_engine(engine, records, options):
+    results = []
+    params = {'engine': engine, 'records': records}
+
+    buildroot = Path(tempfile.mkdtemp(prefix='fbuild-bench-'))
+    try:
+        ctx = fbuild.context.make_default_context([
+            '--buildroot', buildroot,
+            '--database-engine', engine])
+        try:
+            ctx.create_buildroot()
+            ctx.load_configuration()
+
+            db = ctx.db
+            db._rpc.call(_populate, db, db._backend, records)
+
+            # Look up the calls in a random order so we don't favor the
+            # backends that scan from the front.
+            hits = list(range(records))
+            random.Random(0).shuffle(hits)
+            seconds = time_calls(lambda x: db.call(_lookup, x), hits,
+                budget=options.budget)
+            results.append(result('db.call.hit', params,
+                'usec_per_call', seconds * 1e6, 'lower'))
+
+            misses = range(records, records * 2 + 1)
+            seconds = time_calls(lambda x: db.call(_lookup, x), misses,
+                budget=options.budget)
+            results.append(result('db.call.miss', params,
+                'usec_per_call', seconds * 1e6, 'lower'))
+
+            # Saving and loading the database matters for the backends that
+            # write it out all at once.
+            start = time.perf_counter()
+            db.close()
+            results.append(result('db.save', params,
+                'seconds', time.perf_counter() - start, 'lower'))
+
+            start = time.perf_counter()
+            db.connect(ctx.options.state_file)
+            results.append(result('db.load', params,
+                'seconds', time.perf_counter() - start, 'lower'))
+        finally:
+            ctx.shutdown()
+    finally:
+        buildroot.rmtree()
+
+    return results
+
+
+def suite(options):
+    results = []
+
+    for engine in options.engines:
+        for records in options.records:
+            results.extend(_bench_engine(engine, records, options))
+
+    return results
@@ -0,0 +1,61 @@
+"""
+Measure how many trivial tasks per second the scheduler can run. The tasks do
+no work, so this is purely the overhead of handing tasks to the worker threads
+and collecting their results.
+"""
+
+import math
+
+from fbuild.sched import Scheduler
+
+from benchutil import best_of, result
+
+# -----------------------------------------------------------------------------
+
+def _identity(x):
+    return x
+
+
+def _tree_dependencies(x):
+    # Every task depends on its parent in a binary tree.
+    return [x // 2] if x else []
+
+
+def suite(options):
+    results = []
+
+    for jobs in options.jobs:
+        scheduler = Scheduler(jobs)
+        try:
+            tasks = options.tasks
+            params = {'jobs': jobs, 'tasks': tasks}
+
+            # Independent tasks.
+            seconds = best_of(options.repeat,
+                lambda: scheduler.map(_identity, range(tasks)))
+            results.append(result('sched.map', params,
+                'tasks_per_sec', tasks / seconds, 'higher'))
+
+            # Tasks with dependencies, which need to wait on each other.
+            seconds = best_of(options.repeat,
+                lambda: scheduler.map_with_dependencies(
+                    _tree_dependencies, _identity, range(tasks)))
+            results.append(result('sched.map_with_dependencies', params,
+                'tasks_per_sec', tasks / seconds, 'higher'))
+
+            # Maps run from inside of tasks, which have to run other tasks
+            # while they wait.
+            width = int(math.sqrt(tasks))
+            groups = [range(width)] * width
+
+            seconds = best_of(options.repeat,
+                lambda: scheduler.map(
+                    lambda group: scheduler.map(_identity, group),
+                    groups))
+            results.append(result('sched.nested_map',
+                {'jobs': jobs, 'tasks': width * width},
+                'tasks_per_sec', width * width / seconds, 'higher'))
+        finally:
+            scheduler.shutdown()
+
+    return results
@@ -0,0 +1,139 @@
+"""
+Helpers shared by the benchmarks.
+
+Every benchmark produces a list of results. A result is a dictionary with the
+benchmark's I{name}, the I{params} it was run with, the I{metric} that was
+measured, its I{value}, and whether a I{higher} or I{lower} value is better.
+"""
+
+import datetime
+import json
+import platform
+import time
+
+import fbuild
+
+# -----------------------------------------------------------------------------
+
+def result(name, params, metric, value, better):
+    """Make a benchmark result."""
+
+    assert better in ('higher', 'lower'), better
+
+    return {
+        'name': name,
+        'params': params,
+        'metric': metric,
+        'value': value,
+        'better': better,
+    }
+
+
+def key(result):
+    """Return the key that identifies the same benchmark in two reports."""
+    return (result['name'], tuple(sorted(result['params'].items())),
+        result['metric'])
+
+
+def best_of(repeat, function):
+    """Run the function I{repeat} times and return the fastest time in
+    seconds."""
+
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def time_calls(function, args, *, budget):
+    """Call the function on each of the arguments until either we run out or
+    we've spent I{budget} seconds. Returns the mean time per call in
+    seconds."""
+
+    count = 0
+    start = time.perf_counter()
+    for arg in args:
+        function(arg)
+        count += 1
+
+        if time.perf_counter() - start >= budget:
+            break
+
+    return (time.perf_counter() - start) / max(count, 1)
+
+
+def print_result(result):
+    """Print the result on one line."""
+
+    params = ' '.join('%s=%s' % p for p in sorted(result['params'].items()))
+    print('%-28s %-40s %12.2f %s' % (
+        result['name'], params, result['value'], result['metric']))
+
+
+def compare(old_report, results, threshold):
+    """Print how the results changed since the old report. Returns the number
+    of regressions."""
+
+    old_results = {key(r): r for r in old_report['results']}
+    regressions = 0
+
+    for r in results:
+        try:
+            old = old_results[key(r)]
+        except KeyError:
+            continue
+
+        # There's no relative change to something that took no time, such as
+        # the commands of a build that had nothing to do.
+        if not old['value'] or not r['value']:
+            continue
+
+        if r['better'] == 'higher':
+            change = r['value'] / old['value'] - 1
+        else:
+            change = old['value'] / r['value'] - 1
+
+        if change < -threshold:
+            regressions += 1
+            status = 'REGRESSED'
+        else:
+            status = ''
+
+        params = ' '.join('%s=%s' % p for p in sorted(r['params'].items()))
+        print('%-28s %-40s %+7.1f%% %s' % (
+            r['name'], params, change * 100, status))
+
+    return regressions
+
+
+def finish(results, options):
+    """Write out the report and compare it against the old one if the options
+    ask for it. Returns the exit code."""
+
+    report = {
+        'fbuild': fbuild.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': datetime.datetime.now().isoformat(),
+        'results': results,
+    }
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as f:
+            old_report = json.load(f)
+
+        print()
+        if compare(old_report, results, options.threshold):
+            return 1
+
+    return 0
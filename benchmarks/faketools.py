@@ -0,0 +1,498 @@
+#!/usr/bin/env python3.1
+"""
+Fake stand-ins for gcc, ar, ranlib, ocamldep, ocamlc, ocamlopt, javac, jar and
+java. They accept the command lines fbuild's builders generate and write small
+deterministic dummy artifacts instead of compiling anything, so that builds of
+large projects spend their time in fbuild rather than in the compilers.
+
+The tools still do the parts of the job fbuild depends on:
+
+  - gcc writes I{-MMD -MF} dependency files by scanning the C{#include}
+    directives it can find in the source and I{-I} directories.
+  - ocamldep I{-modules} lists the capitalized module paths a file uses.
+  - ocamlc and ocamlopt write a .cmi for every .ml without a .mli, and refuse
+    to compile an implementation whose interface hasn't been compiled yet.
+  - javac I{-verbose} reports a C{[wrote ...]} line for each class it writes.
+
+Every artifact contains a digest of its inputs, so it only changes when they
+do. Linked executables are shell scripts that print C{5}, which is what
+fbuild's configuration checks expect test programs to print.
+
+Run this script with a directory to install the tools there, then put that
+directory at the front of the PATH.
+"""
+
+import hashlib
+import os
+import re
+import sys
+
+# -----------------------------------------------------------------------------
+
+class ToolError(Exception):
+    pass
+
+
+def _digest(paths):
+    """Return a digest of the contents of the files."""
+
+    d = hashlib.md5()
+    for path in paths:
+        d.update(path.encode())
+        try:
+            with open(path, 'rb') as f:
+                d.update(f.read())
+        except IOError:
+            raise ToolError('%s: No such file or directory' % path)
+
+    return d.hexdigest()
+
+
+def _write(path, text, *, executable=False):
+    with open(path, 'w') as f:
+        f.write(text)
+
+    if executable:
+        os.chmod(path, 0o755)
+
+
+def _write_exe(path, inputs):
+    _write(path,
+        '#!/bin/sh\n'
+        '# fake executable %s\n'
+        'printf 5\n' % _digest(inputs),
+        executable=True)
+
+
+def _parse(args, takes_arg):
+    """Split the arguments into a dictionary of flags and a list of inputs.
+    Flags that take an argument map to a list of their values, and the rest map
+    to True."""
+
+    flags = {}
+    inputs = []
+
+    it = iter(args)
+    for arg in it:
+        if arg in takes_arg:
+            try:
+                flags.setdefault(arg, []).append(next(it))
+            except StopIteration:
+                raise ToolError('missing argument to %s' % arg)
+        elif arg.startswith('-') and arg != '-':
+            flags[arg] = True
+        else:
+            inputs.append(arg)
+
+    return flags, inputs
+
+# -----------------------------------------------------------------------------
+
+_include_regex = re.compile(r'^\s*#\s*include\s*([<"])([^>"]+)[>"]', re.M)
+
+def _c_headers(src, includes):
+    """Find the headers the source includes, directly or not, that live in its
+    directory or the include paths. Like gcc -MMD, headers we can't find are
+    treated as system headers and ignored."""
+
+    headers = []
+    seen = set()
+    stack = [src]
+
+    while stack:
+        path = stack.pop()
+        with open(path) as f:
+            text = f.read()
+
+        for kind, name in _include_regex.findall(text):
+            dirs = list(includes)
+            if kind == '"':
+                dirs.insert(0, os.path.dirname(path))
+
+            for d in dirs:
+                header = os.path.join(d, name)
+                if os.path.isfile(header):
+                    if header not in seen:
+                        seen.add(header)
+                        headers.append(header)
+                        stack.append(header)
+                    break
+
+    return headers
+
+
+def gcc(args):
+    """Fake gcc. Supports compiling with -c, preprocessing with -E and linking
+    executables and shared libraries."""
+
+    # Split up the flags with attached values, such as -Iinclude.
+    includes = []
+    libpaths = []
+    libs = []
+    rest = []
+
+    it = iter(args)
+    for arg in it:
+        for prefix, values in ('-I', includes), ('-L', libpaths), ('-l', libs):
+            if arg.startswith(prefix):
+                values.append(arg[2:] if len(arg) > 2 else next(it))
+                break
+        else:
+            rest.append(arg)
+
+    flags, inputs = _parse(rest, {
+        '-o', '-MF', '-MT', '-MQ', '-D', '-U', '-x', '-include', '-isystem',
+        '-iquote', '-arch'})
+    includes = flags.get('-iquote', []) + includes
+
+    if '--version' in flags:
+        print('gcc (fake) 4.2.1')
+        return 0
+
+    if '-dumpversion' in flags:
+        print('4.2.1')
+        return 0
+
+    if not inputs:
+        raise ToolError('no input files')
+
+    for src in inputs:
+        if not os.path.exists(src):
+            raise ToolError('%s: No such file or directory' % src)
+
+    dst = flags.get('-o', [None])[-1]
+
+    if '-E' in flags:
+        text = ''.join(open(src).read() for src in inputs)
+        if dst is None:
+            sys.stdout.write(text)
+        else:
+            _write(dst, text)
+        return 0
+
+    if '-c' in flags or '-S' in flags:
+        if dst is not None and len(inputs) > 1:
+            raise ToolError('cannot specify -o with -c and multiple files')
+
+        for src in inputs:
+            obj = dst or os.path.splitext(os.path.basename(src))[0] + '.o'
+            headers = _c_headers(src, includes)
+
+            _write(obj, 'fake object %s\n' % _digest([src] + headers))
+
+            if '-MMD' in flags or '-MD' in flags:
+                depfile = flags.get('-MF', [os.path.splitext(obj)[0] + '.d'])
+                target = flags.get('-MT', flags.get('-MQ', [obj]))
+                _write(depfile[-1], '%s: %s\n' % (
+                    ' '.join(target),
+                    ' \\\n  '.join([src] + headers)))
+
+        return 0
+
+    # We're linking, so make sure we can find all the libraries. Ones that
+    # aren't in the library paths are assumed to be system libraries.
+    for lib in libs:
+        for libpath in libpaths:
+            for suffix in '.a', '.so', '.dylib':
+                path = os.path.join(libpath, 'lib' + lib + suffix)
+                if os.path.exists(path):
+                    inputs.append(path)
+                    break
+            else:
+                continue
+            break
+
+    _write_exe(dst or 'a.out', inputs)
+
+    return 0
+
+
+def ar(args):
+    """Fake ar, which only supports creating archives."""
+
+    if len(args) < 3:
+        raise ToolError('usage: ar rc archive members...')
+
+    # Skip the operation, which is always to replace the members.
+    dst, members = args[1], args[2:]
+
+    _write(dst, '!<arch>\n' + ''.join('%s %s\n' % (
+        os.path.basename(member), _digest([member])) for member in members))
+
+    return 0
+
+
+def ranlib(args):
+    """Fake ranlib, which leaves the archives alone."""
+
+    for path in args:
+        if not path.startswith('-') and not os.path.exists(path):
+            raise ToolError('%s: No such file or directory' % path)
+
+    return 0
+
+# -----------------------------------------------------------------------------
+
+_ocaml_comment_regex = re.compile(r'\(\*.*?\*\)', re.S)
+_ocaml_string_regex = re.compile(r'"(?:[^"\\]|\\.)*"', re.S)
+_ocaml_module_regex = re.compile(
+    r"\b(?:(?:open|include)\s+([A-Z][\w']*)|([A-Z][\w']*)\s*\.)")
+
+def ocamldep(args):
+    """Fake ocamldep, which only supports -modules."""
+
+    flags, inputs = _parse(args, {'-I', '-pp', '-ppx', '-open'})
+
+    if '-modules' not in flags:
+        raise ToolError('only -modules is supported')
+
+    for src in inputs:
+        try:
+            with open(src) as f:
+                text = f.read()
+        except IOError:
+            raise ToolError('%s: No such file or directory' % src)
+
+        text = _ocaml_comment_regex.sub(' ', text)
+        text = _ocaml_string_regex.sub('""', text)
+
+        modules = set()
+        for opened, used in _ocaml_module_regex.findall(text):
+            modules.add(opened or used)
+
+        print('%s:%s' % (src, ''.join(' ' + m for m in sorted(modules))))
+
+    return 0
+
+
+def _ocaml(args, *, native):
+    flags, inputs = _parse(args, {
+        '-o', '-I', '-pp', '-ppx', '-cc', '-cclib', '-ccopt', '-for-pack',
+        '-open', '-dllib', '-dllpath', '-inline'})
+
+    if '-version' in flags or '-vnum' in flags:
+        print('4.14.0')
+        return 0
+
+    if '-where' in flags:
+        print(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+            'ocaml'))
+        return 0
+
+    if not inputs:
+        raise ToolError('no input files')
+
+    dst = flags.get('-o', [None])[-1]
+    obj_suffix = '.cmx' if native else '.cmo'
+
+    if '-c' in flags:
+        if dst is not None and len(inputs) > 1:
+            raise ToolError('options -c and -o are incompatible when ' \
+                'compiling more than one file')
+
+        for src in inputs:
+            base, ext = os.path.splitext(src)
+            digest = _digest([src])
+
+            if ext == '.mli':
+                _write(dst or base + '.cmi', 'fake cmi %s\n' % digest)
+                continue
+
+            obj = dst or base + obj_suffix
+            cmi = os.path.splitext(obj)[0] + '.cmi'
+
+            if os.path.exists(base + '.mli'):
+                if not os.path.exists(cmi):
+                    raise ToolError('could not find the .cmi file for ' \
+                        'interface %s.mli' % base)
+            else:
+                _write(cmi, 'fake cmi %s\n' % digest)
+
+            _write(obj, 'fake object %s\n' % digest)
+            if native:
+                _write(os.path.splitext(obj)[0] + '.o',
+                    'fake object %s\n' % digest)
+
+        return 0
+
+    if dst is None:
+        raise ToolError('fake %s needs -o when linking' %
+            ('ocamlopt' if native else 'ocamlc'))
+
+    digest = _digest(inputs)
+
+    if '-a' in flags or '-pack' in flags:
+        _write(dst, 'fake library %s\n' % digest)
+        if '-pack' in flags:
+            _write(os.path.splitext(dst)[0] + '.cmi', 'fake cmi %s\n' % digest)
+        if native:
+            suffix = '.o' if '-pack' in flags else '.a'
+            _write(os.path.splitext(dst)[0] + suffix,
+                'fake object %s\n' % digest)
+    else:
+        _write_exe(dst, inputs)
+
+    return 0
+
+
+def ocamlc(args):
+    """Fake ocamlc."""
+    return _ocaml(args, native=False)
+
+
+def ocamlopt(args):
+    """Fake ocamlopt."""
+    return _ocaml(args, native=True)
+
+# -----------------------------------------------------------------------------
+
+_java_comment_regex = re.compile(r'/\*.*?\*/|//[^\n]*', re.S)
+_java_package_regex = re.compile(r'\bpackage\s+([\w.]+)\s*;')
+_java_class_regex = re.compile(
+    r'\b(?:class|interface|enum)\s+([A-Za-z_$][\w$]*)')
+
+def javac(args):
+    """Fake javac. Every class, interface and enum declared in a source file
+    gets its own class file, including nested ones."""
+
+    flags, inputs = _parse(args, {
+        '-d', '-cp', '-classpath', '-sourcepath', '-encoding', '-source',
+        '-target', '-bootclasspath', '-processorpath', '-s'})
+
+    if not inputs:
+        raise ToolError('no source files')
+
+    for src in inputs:
+        try:
+            with open(src) as f:
+                text = f.read()
+        except IOError:
+            raise ToolError('file not found: %s' % src)
+
+        text = _java_comment_regex.sub(' ', text)
+        digest = _digest([src])
+
+        m = _java_package_regex.search(text)
+        if '-d' in flags:
+            dst = flags['-d'][-1]
+            if m:
+                dst = os.path.join(dst, *m.group(1).split('.'))
+                if not os.path.exists(dst):
+                    os.makedirs(dst)
+        else:
+            dst = os.path.dirname(src)
+
+        for name in _java_class_regex.findall(text):
+            path = os.path.join(dst, name + '.class')
+            _write(path, 'fake class %s %s\n' % (name, digest))
+
+            if '-verbose' in flags:
+                print('[wrote %s]' % path, file=sys.stderr)
+
+    return 0
+
+
+def jar(args):
+    """Fake jar, which only supports creating archives with the I{c} command,
+    optionally with a manifest."""
+
+    if not args or 'c' not in args[0]:
+        raise ToolError('only the c command is supported')
+
+    command, args = args[0].lstrip('-'), list(args[1:])
+
+    dst = None
+    members = []
+    for letter in command:
+        if letter == 'f':
+            dst = args.pop(0)
+        elif letter == 'm':
+            members.append(args.pop(0))
+
+    if dst is None:
+        raise ToolError('fake jar needs the f option')
+
+    for arg in args:
+        if os.path.isdir(arg):
+            for root, dirs, files in os.walk(arg):
+                dirs.sort()
+                members.extend(os.path.join(root, f) for f in sorted(files))
+        else:
+            members.append(arg)
+
+    _write(dst, ''.join('%s %s\n' % (m, _digest([m])) for m in members))
+
+    return 0
+
+
+def java(args):
+    """Fake java, which doesn't run anything."""
+    return 0
+
+# -----------------------------------------------------------------------------
+
+tools = {
+    'gcc': gcc,
+    'cc': gcc,
+    'g++': gcc,
+    'c++': gcc,
+    'ar': ar,
+    'ranlib': ranlib,
+    'ocamldep': ocamldep,
+    'ocamldep.opt': ocamldep,
+    'ocamlc': ocamlc,
+    'ocamlc.opt': ocamlc,
+    'ocamlopt': ocamlopt,
+    'ocamlopt.opt': ocamlopt,
+    'javac': javac,
+    'jar': jar,
+    'java': java,
+}
+
+_wrapper = '''\
+#!%(python)s -S
+import sys
+sys.path.insert(0, %(path)r)
+import faketools
+sys.exit(faketools.main(sys.argv))
+'''
+
+def install(dirname):
+    """Write an executable for every tool into the directory. The tools run
+    with the current python interpreter."""
+
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+    text = _wrapper % {
+        'python': sys.executable,
+        'path': os.path.dirname(os.path.abspath(__file__)),
+    }
+
+    for name in tools:
+        _write(os.path.join(dirname, name), text, executable=True)
+
+
+def main(argv):
+    """Run the tool named by the program name."""
+
+    name = os.path.basename(argv[0])
+    try:
+        tool = tools[name]
+    except KeyError:
+        print('unknown tool %r' % name, file=sys.stderr)
+        return 2
+
+    try:
+        return tool(argv[1:])
+    except ToolError as e:
+        print('fake %s: error: %s' % (name, e), file=sys.stderr)
+        return 1
+
+# -----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit('usage: %s DIR' % sys.argv[0])
+
+    install(sys.argv[1])
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3.1
+"""
+Measure the overhead of fbuild's scheduler and database. None of these
+benchmarks need a compiler.
+
+The results are written as a JSON report. Passing an older report with
+--compare prints how each benchmark changed, and exits with an error if any of
+them got worse by more than the --threshold.
+"""
+
+import os
+import sys
+from optparse import OptionParser
+
+sys.path.append(os.path.join(os.path.dirname(sys.argv[0]), '..', 'lib'))
+
+import bench_database
+import bench_scheduler
+import benchutil
+
+# -----------------------------------------------------------------------------
+
+suites = {
+    'scheduler': bench_scheduler,
+    'database': bench_database,
+}
+
+def split_ints(option, opt, value, parser):
+    setattr(parser.values, option.dest, [int(v) for v in value.split(',')])
+
+def split_strs(option, opt, value, parser):
+    setattr(parser.values, option.dest, value.split(','))
+
+def parse_args(argv):
+    parser = OptionParser(usage='%prog [options] [suite...]')
+    parser.add_option('-o', '--output',
+        help='write the JSON report to this file')
+    parser.add_option('--compare',
+        metavar='FILE',
+        help='compare the results against an older JSON report')
+    parser.add_option('--threshold',
+        type='float',
+        default=0.1,
+        help='fail if a benchmark regressed by more than this fraction ' \
+            '(default: %default)')
+    parser.add_option('--repeat',
+        type='int',
+        default=3,
+        help='take the best of this many runs (default: %default)')
+    parser.add_option('--jobs',
+        type='string',
+        action='callback',
+        callback=split_ints,
+        default=[1, 2, 4, 8],
+        help='comma separated thread counts to run the scheduler with')
+    parser.add_option('--tasks',
+        type='int',
+        default=2000,
+        help='number of tasks to schedule (default: %default)')
+    parser.add_option('--engines',
+        type='string',
+        action='callback',
+        callback=split_strs,
+        default=['cache', 'pickle', 'sqlite'],
+        help='comma separated database backends to measure')
+    parser.add_option('--records',
+        type='string',
+        action='callback',
+        callback=split_ints,
+        default=[1000, 10000, 100000],
+        help='comma separated number of calls to fill the database with, ' \
+            'such as 1000,1000000')
+    parser.add_option('--budget',
+        type='float',
+        default=1.0,
+        help='seconds to spend measuring each database latency ' \
+            '(default: %default)')
+
+    options, args = parser.parse_args(argv)
+
+    for name in args:
+        if name not in suites:
+            parser.error('unknown suite %r' % name)
+
+    return options, args or sorted(suites)
+
+# -----------------------------------------------------------------------------
+
+def main(argv=None):
+    options, names = parse_args(sys.argv[1:] if argv is None else argv)
+
+    results = []
+    for name in names:
+        for r in suites[name].suite(options):
+            benchutil.print_result(r)
+            results.append(r)
+
+    return benchutil.finish(results, options)
+
+# -----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3.1
+"""
+Time fbuild building synthetic projects from scratch, doing nothing, and
+rebuilding after a source file or a header changes.
+
+Each build is run with --trace, so along with the wall clock time we report
+how long at least one command was running. With -j greater than 1 the commands
+overlap, so we only count each moment once. The rest of the wall clock time is
+spent with no command running, which is fbuild's own overhead. With
+--fake-toolchain the projects are built with the stand-in compilers from
+faketools, which makes that overhead most of the time.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+sys.path.append(os.path.join(os.path.dirname(sys.argv[0]), '..', 'lib'))
+
+import benchutil
+import faketools
+import synthetic
+
+# -----------------------------------------------------------------------------
+
+fbuild_light = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])),
+    '..', 'fbuild-light')
+
+def split_strs(option, opt, value, parser):
+    setattr(parser.values, option.dest, value.split(','))
+
+def split_ints(option, opt, value, parser):
+    setattr(parser.values, option.dest, [int(v) for v in value.split(',')])
+
+def parse_args(argv):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-o', '--output',
+        help='write the JSON report to this file')
+    parser.add_option('--compare',
+        metavar='FILE',
+        help='compare the results against an older JSON report')
+    parser.add_option('--threshold',
+        type='float',
+        default=0.1,
+        help='fail if a benchmark regressed by more than this fraction ' \
+            '(default: %default)')
+    parser.add_option('--repeat',
+        type='int',
+        default=3,
+        help='take the best of this many runs (default: %default)')
+    parser.add_option('--languages',
+        type='string',
+        action='callback',
+        callback=split_strs,
+        default=['c'],
+        help='comma separated languages to generate projects in, out of ' \
+            'c, ocaml and java (default: c)')
+    parser.add_option('--files',
+        type='string',
+        action='callback',
+        callback=split_ints,
+        default=[100],
+        help='comma separated number of source files (default: 100)')
+    parser.add_option('--fanin',
+        type='int',
+        default=5,
+        help='number of files each file uses (default: %default)')
+    parser.add_option('--libraries',
+        type='int',
+        default=4,
+        help='number of layered libraries (default: %default)')
+    parser.add_option('-j', '--jobs',
+        type='string',
+        action='callback',
+        callback=split_ints,
+        default=[1, 4],
+        help='comma separated thread counts to build with (default: 1,4)')
+    parser.add_option('--fbuild-arg',
+        dest='fbuild_args',
+        action='append',
+        default=[],
+        help='pass an extra argument to fbuild')
+    parser.add_option('--keep',
+        action='store_true',
+        default=False,
+        help='keep the generated projects around')
+    parser.add_option('--fake-toolchain',
+        action='store_true',
+        default=False,
+        help='build with fake compilers that do no real work')
+
+    options, args = parser.parse_args(argv)
+
+    for language in options.languages:
+        if language not in synthetic.generators:
+            parser.error('unknown language %r' % language)
+
+    return options
+
+# -----------------------------------------------------------------------------
+
+def busy_seconds(spans):
+    """Return how many seconds at least one of the (start, duration) spans,
+    given in microseconds, was running.
+
+    >>> busy_seconds([(0, 2e6), (1e6, 2e6), (5e6, 1e6)])
+    4.0
+    """
+
+    busy = 0
+    end = None
+    for start, duration in sorted(spans):
+        if end is None or start > end:
+            busy += duration
+            end = start + duration
+        elif start + duration > end:
+            busy += start + duration - end
+            end = start + duration
+
+    return busy / 1e6
+
+
+def run_fbuild(project, jobs, env, options):
+    """Run fbuild on the project. Returns the wall clock time and how long at
+    least one command was running."""
+
+    trace = os.path.join(project.root, 'trace.json')
+
+    cmd = [sys.executable, fbuild_light, '-j', str(jobs), '--trace', trace]
+    cmd.extend(options.fbuild_args)
+
+    start = time.perf_counter()
+    p = subprocess.run(cmd,
+        cwd=project.root,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT)
+    elapsed = time.perf_counter() - start
+
+    if p.returncode:
+        sys.stdout.write(p.stdout.decode(errors='replace'))
+        raise SystemExit('fbuild failed to build %s' % project.root)
+
+    with open(trace) as f:
+        events = json.load(f)['traceEvents']
+
+    commands = busy_seconds((e['ts'], e['dur']) for e in events
+        if e['ph'] == 'X' and e['cat'] == 'execute')
+
+    return elapsed, commands
+
+
+def touch(path, count):
+    """Change the contents of the file so that it needs to be rebuilt."""
+
+    if path.endswith(('.ml', '.mli')):
+        comment = '(* %d *)\n'
+    else:
+        comment = '/* %d */\n'
+
+    with open(path, 'a') as f:
+        f.write(comment % count)
+
+
+def bench_project(project, jobs, env, options):
+    results = []
+    params = {
+        'language': project.language,
+        'files': project.files,
+        'jobs': jobs,
+        'toolchain': 'fake' if options.fake_toolchain else 'real',
+    }
+
+    scenarios = [('full', None), ('noop', None)]
+    scenarios.append(('touch_source', project.touch_source))
+    if project.touch_header is not None:
+        scenarios.append(('touch_header', project.touch_header))
+
+    timings = {name: [] for name, path in scenarios}
+    buildroot = os.path.join(project.root, 'build')
+
+    for i in range(options.repeat):
+        if os.path.exists(buildroot):
+            shutil.rmtree(buildroot)
+
+        for name, path in scenarios:
+            if path is not None:
+                touch(path, i)
+
+            timings[name].append(run_fbuild(project, jobs, env, options))
+
+    for name, path in scenarios:
+        elapsed, commands = min(timings[name])
+
+        results.append(benchutil.result('e2e.' + name, params,
+            'seconds', elapsed, 'lower'))
+        results.append(benchutil.result('e2e.' + name, params,
+            'command_seconds', commands, 'lower'))
+        results.append(benchutil.result('e2e.' + name, params,
+            'overhead_seconds', elapsed - commands, 'lower'))
+
+    return results
+
+
+def bench_languages(env, options):
+    results = []
+    for language in options.languages:
+        for files in options.files:
+            root = tempfile.mkdtemp(prefix='fbuild-%s-' % language)
+            try:
+                project = synthetic.generate(language, root,
+                    files=files,
+                    fanin=options.fanin,
+                    libraries=options.libraries)
+
+                for jobs in options.jobs:
+                    for r in bench_project(project, jobs, env, options):
+                        benchutil.print_result(r)
+                        results.append(r)
+            finally:
+                if options.keep:
+                    print('kept %s' % root)
+                else:
+                    shutil.rmtree(root)
+
+    return results
+
+
+def main(argv=None):
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+
+    env = dict(os.environ)
+    if options.fake_toolchain:
+        tooldir = tempfile.mkdtemp(prefix='fbuild-faketools-')
+        faketools.install(tooldir)
+        env['PATH'] = tooldir + os.pathsep + env['PATH']
+
+    try:
+        results = bench_languages(env, options)
+    finally:
+        if options.fake_toolchain:
+            shutil.rmtree(tooldir)
+
+    return benchutil.finish(results, options)
+
+# -----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    sys.exit(main())
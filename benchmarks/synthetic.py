@@ -0,0 +1,277 @@
+#!/usr/bin/env python3.1
+"""
+Generate synthetic C, OCaml and Java projects along with the fbuildroots that
+build them.
+
+A project has I{files} source files split between I{libraries} layered
+libraries, where each library is built on top of the ones before it, plus a
+main program that uses the last library. Every source file uses I{fanin} other
+randomly chosen files from the libraries below it or from earlier in its own
+library, so the dependency graph has no cycles.
+"""
+
+import os
+import random
+import sys
+from optparse import OptionParser
+
+# -----------------------------------------------------------------------------
+
+class Project:
+    """A generated project of I{files} source files. I{touch_source} is the
+    source file a single file edit should change, and I{touch_header} is the
+    most widely used header or interface, or None if the language doesn't
+    have them."""
+
+    def __init__(self, language, root, files, *,
+            touch_source,
+            touch_header=None):
+        self.language = language
+        self.root = root
+        self.files = files
+        self.touch_source = touch_source
+        self.touch_header = touch_header
+
+
+def _layout(files, libraries, fanin, seed):
+    """Split the files into libraries and pick each file's dependencies.
+    Returns a list of libraries, where each library is a list of
+    (name, dependencies) pairs."""
+
+    rng = random.Random(seed)
+    libraries = max(1, min(libraries, files))
+
+    layout = []
+    available = []
+    for k in range(libraries):
+        count = files // libraries + (1 if k < files % libraries else 0)
+
+        lib = []
+        for i in range(count):
+            name = 'm%d_%d' % (k, i)
+            deps = sorted(rng.sample(available, min(fanin, len(available))))
+            lib.append((name, deps))
+            available.append(name)
+
+        layout.append(lib)
+
+    return layout
+
+
+def _most_used(layout):
+    """Return the file that the most other files depend on."""
+
+    counts = {}
+    for lib in layout:
+        for name, deps in lib:
+            counts.setdefault(name, 0)
+            for dep in deps:
+                counts[dep] += 1
+
+    return max(sorted(counts), key=lambda name: counts[name])
+
+
+def _write(path, text):
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+    with open(path, 'w') as f:
+        f.write(text)
+
+# -----------------------------------------------------------------------------
+
+_c_fbuildroot = '''\
+import fbuild.builders.c
+from fbuild.path import Path
+
+def build(ctx):
+    static = fbuild.builders.c.guess_static(ctx)
+
+    libs = []
+    for k in range(%(libraries)d):
+        libs = [static.build_lib('lib%%d' %% k, Path.glob('lib%%d/*.c' %% k),
+            includes=['include'],
+            libs=libs)]
+
+    static.build_exe('main', ['main.c'], includes=['include'], libs=libs)
+'''
+
+def generate_c(root, *, files=100, fanin=5, libraries=4, seed=0):
+    """Generate a C project."""
+
+    layout = _layout(files, libraries, fanin, seed)
+
+    for k, lib in enumerate(layout):
+        for name, deps in lib:
+            _write(os.path.join(root, 'include', name + '.h'),
+                '#ifndef %(guard)s\n'
+                '#define %(guard)s\n'
+                'int %(name)s(void);\n'
+                '#endif\n' % {'guard': name.upper() + '_H', 'name': name})
+
+            _write(os.path.join(root, 'lib%d' % k, name + '.c'),
+                ''.join('#include "%s.h"\n' % n for n in [name] + deps) +
+                'int %s(void) { return 1%s; }\n' % (
+                    name, ''.join(' + %s()' % dep for dep in deps)))
+
+    top = [name for name, deps in layout[-1]]
+    _write(os.path.join(root, 'main.c'),
+        '#include <stdio.h>\n' +
+        ''.join('#include "%s.h"\n' % name for name in top) +
+        'int main(void) {\n'
+        '    printf("%%d\\n", 0%s);\n'
+        '    return 0;\n'
+        '}\n' % ''.join(' + %s()' % name for name in top))
+
+    _write(os.path.join(root, 'fbuildroot.py'),
+        _c_fbuildroot % {'libraries': len(layout)})
+
+    return Project('c', root, files,
+        touch_source=os.path.join(root, 'lib0', layout[0][0][0] + '.c'),
+        touch_header=os.path.join(root, 'include', _most_used(layout) + '.h'))
+
+# -----------------------------------------------------------------------------
+
+_ocaml_fbuildroot = '''\
+import fbuild.builders.ocaml
+from fbuild.path import Path
+
+def build(ctx):
+    ocamlc = fbuild.builders.ocaml.Ocamlc(ctx)
+
+    libs = []
+    includes = []
+    for k in range(%(libraries)d):
+        libs.append(ocamlc.build_lib('lib%%d' %% k,
+            Path.glob('lib%%d/*.ml{,i}' %% k),
+            includes=list(includes),
+            libs=list(libs)))
+        includes.extend((Path('lib%%d' %% k), ctx.buildroot / 'lib%%d' %% k))
+
+    ocamlc.build_exe('main', ['main.ml'], includes=includes, libs=libs)
+'''
+
+def generate_ocaml(root, *, files=100, fanin=5, libraries=4, seed=0):
+    """Generate an OCaml project."""
+
+    layout = _layout(files, libraries, fanin, seed)
+
+    for k, lib in enumerate(layout):
+        for name, deps in lib:
+            _write(os.path.join(root, 'lib%d' % k, name + '.mli'),
+                'val f : unit -> int\n')
+
+            _write(os.path.join(root, 'lib%d' % k, name + '.ml'),
+                'let f () = 1%s\n' % ''.join(
+                    ' + %s.f ()' % dep.capitalize() for dep in deps))
+
+    top = [name for name, deps in layout[-1]]
+    _write(os.path.join(root, 'main.ml'),
+        'let () = print_int (0%s)\n' % ''.join(
+            ' + %s.f ()' % name.capitalize() for name in top))
+
+    _write(os.path.join(root, 'fbuildroot.py'),
+        _ocaml_fbuildroot % {'libraries': len(layout)})
+
+    most_used = _most_used(layout)
+    for k, lib in enumerate(layout):
+        if any(name == most_used for name, deps in lib):
+            touch_header = os.path.join(root, 'lib%d' % k, most_used + '.mli')
+
+    return Project('ocaml', root, files,
+        touch_source=os.path.join(root, 'lib0', layout[0][0][0] + '.ml'),
+        touch_header=touch_header)
+
+# -----------------------------------------------------------------------------
+
+_java_fbuildroot = '''\
+import os
+
+import fbuild.builders.java
+from fbuild.path import Path
+
+def build(ctx):
+    java = fbuild.builders.java.Builder(ctx)
+
+    jars = []
+    for k in range(%(libraries)d):
+        jars.append(java.build_lib('lib%%d.jar' %% k,
+            Path.glob('lib%%d/*.java' %% k),
+            classpaths=[os.pathsep.join(jars)] if jars else [],
+            cwd=ctx.buildroot / 'lib%%d' %% k))
+
+    java.build_lib('main.jar', ['Main.java'],
+        classpaths=[os.pathsep.join(jars)])
+'''
+
+def generate_java(root, *, files=100, fanin=5, libraries=4, seed=0):
+    """Generate a Java project. Since each class is compiled on its own, the
+    classes only use classes from the libraries below them."""
+
+    layout = _layout(files, libraries, fanin, seed)
+
+    below = set()
+    for k, lib in enumerate(layout):
+        for name, deps in lib:
+            deps = [dep for dep in deps if dep in below]
+            _write(os.path.join(root, 'lib%d' % k, name.upper() + '.java'),
+                'public class %s {\n'
+                '    public static int f() { return 1%s; }\n'
+                '}\n' % (name.upper(), ''.join(
+                    ' + %s.f()' % dep.upper() for dep in deps)))
+
+        below.update(name for name, deps in lib)
+
+    top = [name for name, deps in layout[-1]]
+    _write(os.path.join(root, 'Main.java'),
+        'public class Main {\n'
+        '    public static void main(String[] args) {\n'
+        '        System.out.println(0%s);\n'
+        '    }\n'
+        '}\n' % ''.join(' + %s.f()' % name.upper() for name in top))
+
+    _write(os.path.join(root, 'fbuildroot.py'),
+        _java_fbuildroot % {'libraries': len(layout)})
+
+    return Project('java', root, files,
+        touch_source=os.path.join(root, 'lib0',
+            layout[0][0][0].upper() + '.java'))
+
+# -----------------------------------------------------------------------------
+
+generators = {
+    'c': generate_c,
+    'ocaml': generate_ocaml,
+    'java': generate_java,
+}
+
+def generate(language, root, **kwargs):
+    """Generate a project in the language."""
+    return generators[language](root, **kwargs)
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] c|ocaml|java DIR')
+    parser.add_option('--files', type='int', default=100,
+        help='number of source files (default: %default)')
+    parser.add_option('--fanin', type='int', default=5,
+        help='number of files each file uses (default: %default)')
+    parser.add_option('--libraries', type='int', default=4,
+        help='number of layered libraries (default: %default)')
+    parser.add_option('--seed', type='int', default=0,
+        help='random seed (default: %default)')
+
+    options, args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    if len(args) != 2 or args[0] not in generators:
+        parser.error('expected a language and a directory')
+
+    generate(args[0], args[1],
+        files=options.files,
+        fanin=options.fanin,
+        libraries=options.libraries,
+        seed=options.seed)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -117,6 +117,11 @@ class Builder(fbuild.builders.AbstractCompilerBuilder):
     @fbuild.db.cachemethod
     def build_objects(self, srcs:fbuild.db.SRCS, **kwargs) -> fbuild.db.DSTS:
         """Compile all of the passed in L{srcs} in parallel."""
+        return self._build_objects(srcs, **kwargs)
+
+    def _build_objects(self, srcs, **kwargs):
+        """Compile the L{srcs} in parallel for the cached call that's building
+        them."""
         # When a object has extra external dependencies, such as .c files
         # depending on .h changes, depending on library changes, we need to add
         # the dependencies in build_objects.  Unfortunately, the db doesn't
@@ -303,6 +303,18 @@ def make_gcc(ctx, exe=None, default_exes=['gcc', 'cc'], **kwargs):
 
 # ------------------------------------------------------------------------------
 
+# The suffixes gcc uses for preprocessed source files.
+_preprocessed_suffixes = {
+    '.c': '.i',
+    '.m': '.mi',
+    '.cc': '.ii',
+    '.cp': '.ii',
+    '.cpp': '.ii',
+    '.cxx': '.ii',
+    '.c++': '.ii',
+    '.C': '.ii',
+}
+
 class Compiler(fbuild.db.PersistentObject):
     def __init__(self, ctx, gcc, flags, *, suffix):
         super().__init__(ctx)
@@ -317,6 +329,7 @@ class Compiler(fbuild.db.PersistentObject):
 
     def __call__(self, src, dst=None, *,
             suffix=None,
+            pch=None,
             buildroot=None,
             **kwargs):
         buildroot = buildroot or self.ctx.buildroot
@@ -326,13 +339,79 @@ class Compiler(fbuild.db.PersistentObject):
         dst = Path(dst or src).addroot(buildroot).replaceext(suffix)
         dst.parent.makedirs()
 
-        stdout, stderr = self.gcc([src], dst,
+        if pch is not None:
+            # The precompiled header only works with this compiler, so it
+            # can't be used remotely.
+            stdout, stderr = self._pch_compile(src, dst, pch, **kwargs)
+        elif self.ctx.remote is not None and \
+                self.ctx.remote.idle() and \
+                src.ext in _preprocessed_suffixes:
+            # Only split the compile in two if a worker can take the second
+            # half, since running both halves locally is slower.
+            stdout, stderr = self._remote_compile(src, dst, **kwargs)
+        else:
+            stdout, stderr = self.gcc([src], dst,
+                pre_flags=list(chain(('-c',), self.flags)),
+                msg1=str(self),
+                color='compile',
+                **kwargs)
+
+        return dst, stdout, stderr
+
+    def precompile(self, src, dst, **kwargs):
+        """Precompile the header I{src} into I{dst}. gcc only finds the
+        precompiled header if I{dst} is the header it's told to include
+        with ".gch" added."""
+        return self.gcc([src], dst,
             pre_flags=list(chain(('-c',), self.flags)),
             msg1=str(self),
             color='compile',
             **kwargs)
 
-        return dst, stdout, stderr
+    def _pch_compile(self, src, dst, pch, *, warnings=(), **kwargs):
+        """Compile the source with the precompiled header I{pch} included
+        before it. gcc warns if the header wasn't precompiled with the same
+        options, and reads the header instead."""
+        return self.gcc([src], dst,
+            pre_flags=list(chain(('-c',), self.flags,
+                ('-include', Path(pch).replaceext('')))),
+            warnings=list(chain(warnings, ('invalid-pch',))),
+            msg1=str(self),
+            color='compile',
+            **kwargs)
+
+    def _remote_compile(self, src, dst, *, flags=(), **kwargs):
+        """Preprocess the source locally, then compile the preprocessed
+        source, which the context can send to a remote worker since it
+        doesn't depend on any other files."""
+        pre = dst.replaceext(_preprocessed_suffixes[src.ext])
+
+        # Any dependency generation flags need to be used while
+        # preprocessing.
+        compile_flags = []
+        it = iter(flags)
+        for flag in it:
+            if flag in ('-MF', '-MT', '-MQ'):
+                next(it, None)
+            elif not flag.startswith('-M'):
+                compile_flags.append(flag)
+
+        self.gcc([src], pre,
+            pre_flags=list(chain(('-E',), self.flags)),
+            flags=flags,
+            **kwargs)
+
+        try:
+            return self.gcc([pre], dst,
+                pre_flags=list(chain(('-c',), self.flags)),
+                flags=compile_flags,
+                msg1=str(self),
+                color='compile',
+                inputs=[pre],
+                outputs=[dst],
+                **kwargs)
+        finally:
+            pre.remove()
 
     def __str__(self):
         return ' '.join(str(s) for s in chain((self.gcc,), self.flags))
@@ -398,17 +477,64 @@ class Builder(fbuild.builders.c.Builder):
     @fbuild.db.cachemethod
     def compile(self, src:fbuild.db.SRC, dst=None, *,
             flags=[],
+            pch:fbuild.db.OPTIONAL_SRC=None,
             **kwargs) -> fbuild.db.DST:
-        """Compile a c file and cache the results."""
-        # Generate the dependencies while we compile the file.
+        """Compile a c file and cache the results. If I{pch} is a header
+        precompiled by L{build_pch}, it's included before the file."""
+        # Generate the dependencies while we compile the file. They don't
+        # list the headers in the precompiled header, but the pch changes
+        # whenever they do.
         with tempfile() as dep:
             obj = self.uncached_compile(src, dst,
+                flags=list(chain(('-MMD', '-MF', dep), flags)),
+                pch=pch,
+                **kwargs)
+
+            self._add_header_dependencies(dep)
+
+        return obj
+
+    @fbuild.db.cachemethod
+    def build_pch(self, src:fbuild.db.SRC, dst=None, *,
+            flags=[],
+            buildroot=None,
+            **kwargs) -> fbuild.db.DST:
+        """Precompile a header and cache the results. The precompiled header
+        can be passed as the I{pch} of L{compile}, which needs to be given
+        the same options as the header."""
+        buildroot = buildroot or self.ctx.buildroot
+        src = Path(src)
+
+        # gcc looks for the precompiled header next to the header it
+        # includes, so we precompile a header in the buildroot that includes
+        # the real one. That way gcc can still fall back on the real header.
+        header = Path(dst or src).addroot(buildroot)
+        if header.abspath() == src.abspath():
+            # Don't overwrite a header that's outside of the buildroot.
+            header = Path(buildroot, 'pch', src.name)
+        header.parent.makedirs()
+
+        text = '#include "%s"\n' % src.abspath()
+        if not header.exists() or open(header).read() != text:
+            with open(header, 'w') as f:
+                f.write(text)
+
+        pch = header + '.gch'
+
+        with tempfile() as dep:
+            self.compiler.precompile(header, pch,
                 flags=list(chain(('-MMD', '-MF', dep), flags)),
                 **kwargs)
 
-            with open(dep, 'rb') as f:
-                # Parse the output and return the module dependencies.
-                stdout = f.read().replace(b'\\\n', b'')
+            self._add_header_dependencies(dep, exclude=[header])
+
+        return pch
+
+    def _add_header_dependencies(self, dep, *, exclude=()):
+        """Add the headers gcc listed in the dependency file I{dep} to the
+        cached call."""
+        with open(dep, 'rb') as f:
+            stdout = f.read().replace(b'\\\n', b'')
 
         # Parse the output and return the module dependencies.
         m = re.match(b'\S+:(?: (.*))?$', stdout)
@@ -417,10 +543,23 @@ class Builder(fbuild.builders.c.Builder):
 
         s = m.group(1)
         if s is not None:
-            deps = s.decode().split()
+            deps = [d for d in s.decode().split() if d not in exclude]
             self.ctx.db.add_external_dependencies_to_call(srcs=deps)
 
-        return obj
+    @fbuild.db.cachemethod
+    def build_objects(self, srcs:fbuild.db.SRCS, *,
+            pch=None,
+            **kwargs) -> fbuild.db.DSTS:
+        """Compile all of the passed in L{srcs} in parallel. If I{pch} is a
+        header, it's precompiled with the same options first, and then
+        included in every src."""
+        if pch is not None:
+            pch, src_deps, dst_deps = self.build_pch.call(pch, **kwargs)
+            self.ctx.db.add_external_dependencies_to_call(
+                srcs=src_deps,
+                dsts=dst_deps)
+
+        return self._build_objects(srcs, pch=pch, **kwargs)
 
     def uncached_compile(self, *args, **kwargs):
         """Compile a c file without caching the results.  This is needed when
@@ -0,0 +1,267 @@
+"""
+Read the parts of a compiled java class that other classes can depend on.
+
+The API of a class is everything javac needs to compile code that uses it: the
+class's name, access flags, superclass and interfaces, and the signatures of
+the members that aren't private, along with the values of any constants since
+javac copies them into the classes that use them. Method bodies and private
+members aren't part of the API, so changing them doesn't change its digest.
+
+We also read the name of the source file the class was compiled from, if the
+compiler recorded it, so we can tell which source a class came from, and a
+digest of just the constants. javac copies a constant into the classes that
+use it without referring to its class, so the classes that use a constant
+can't be found from their references.
+"""
+
+import collections
+import hashlib
+import re
+import struct
+
+import fbuild
+
+# ------------------------------------------------------------------------------
+
+class ClassFormatError(fbuild.Error):
+    pass
+
+ClassFile = collections.namedtuple('ClassFile',
+    'name api references source constants')
+
+# ------------------------------------------------------------------------------
+
+_MAGIC = 0xCAFEBABE
+
+_ACC_PRIVATE = 0x0002
+_ACC_SUPER = 0x0020
+_ACC_SYNTHETIC = 0x1000
+
+# The constant pool tags, and how many bytes follow the tags we skip over.
+_UTF8 = 1
+_INTEGER = 3
+_FLOAT = 4
+_LONG = 5
+_DOUBLE = 6
+_CLASS = 7
+_STRING = 8
+_NAME_AND_TYPE = 12
+
+_constant_sizes = {
+    _INTEGER: 4,
+    _FLOAT: 4,
+    _LONG: 8,
+    _DOUBLE: 8,
+    _CLASS: 2,
+    _STRING: 2,
+    9: 4,       # Fieldref
+    10: 4,      # Methodref
+    11: 4,      # InterfaceMethodref
+    _NAME_AND_TYPE: 4,
+    15: 3,      # MethodHandle
+    16: 2,      # MethodType
+    17: 4,      # Dynamic
+    18: 4,      # InvokeDynamic
+    19: 2,      # Module
+    20: 2,      # Package
+}
+
+# The attributes of a member that change how other classes compile against
+# it.
+_api_attributes = frozenset(('ConstantValue', 'Exceptions', 'Signature'))
+
+# Matches the class names in a descriptor or a signature.
+_descriptor_regex = re.compile(r'L([^;<>]+)[;<]')
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read(self, size):
+        if self.offset + size > len(self.data):
+            raise ClassFormatError('truncated class file')
+
+        data = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return data
+
+    def u1(self):
+        return self.read(1)[0]
+
+    def u2(self):
+        return struct.unpack('>H', self.read(2))[0]
+
+    def u4(self):
+        return struct.unpack('>I', self.read(4))[0]
+
+
+def _read_pool(reader):
+    """Read the constant pool into a list indexed by the constant's index."""
+
+    count = reader.u2()
+    pool = [None] * count
+
+    index = 1
+    while index < count:
+        tag = reader.u1()
+        if tag == _UTF8:
+            pool[index] = (tag, reader.read(reader.u2()).decode('utf-8',
+                errors='replace'))
+        elif tag in (_CLASS, _STRING):
+            pool[index] = (tag, reader.u2())
+        elif tag == _NAME_AND_TYPE:
+            pool[index] = (tag, reader.u2(), reader.u2())
+        elif tag in _constant_sizes:
+            pool[index] = (tag, reader.read(_constant_sizes[tag]))
+        else:
+            raise ClassFormatError('unknown constant pool tag %d' % tag)
+
+        # Longs and doubles take up two slots.
+        index += 2 if tag in (_LONG, _DOUBLE) else 1
+
+    return pool
+
+
+def _resolve(pool, index):
+    """Turn a constant into something we can digest and compare."""
+
+    try:
+        constant = pool[index]
+    except IndexError:
+        raise ClassFormatError('bad constant pool index %d' % index)
+
+    if constant is None:
+        raise ClassFormatError('bad constant pool index %d' % index)
+
+    tag = constant[0]
+    if tag == _UTF8:
+        return constant[1]
+    elif tag in (_CLASS, _STRING):
+        return _resolve(pool, constant[1])
+    elif tag == _NAME_AND_TYPE:
+        return (_resolve(pool, constant[1]), _resolve(pool, constant[2]))
+    else:
+        return constant[1]
+
+
+def _read_attributes(reader, pool, names=_api_attributes):
+    """Read the attributes, and return the ones in I{names}, which defaults to
+    the ones that are part of the API."""
+
+    attributes = []
+    for i in range(reader.u2()):
+        name = _resolve(pool, reader.u2())
+        data = reader.read(reader.u4())
+
+        if name in names:
+            if name == 'Exceptions':
+                count = struct.unpack('>H', data[:2])[0]
+                indexes = struct.unpack('>%dH' % count, data[2:2 + 2 * count])
+                value = sorted(_resolve(pool, i) for i in indexes)
+            else:
+                value = _resolve(pool, struct.unpack('>H', data[:2])[0])
+
+            attributes.append((name, value))
+
+    return sorted(attributes)
+
+
+def _read_members(reader, pool):
+    """Read the fields or the methods, and return the ones other classes can
+    see, along with the descriptors of all of them."""
+
+    members = []
+    descriptors = []
+    for i in range(reader.u2()):
+        access = reader.u2()
+        name = _resolve(pool, reader.u2())
+        descriptor = _resolve(pool, reader.u2())
+        attributes = _read_attributes(reader, pool)
+
+        descriptors.append(descriptor)
+        if not access & (_ACC_PRIVATE | _ACC_SYNTHETIC):
+            members.append((name, descriptor, access, attributes))
+
+    return sorted(members), descriptors
+
+
+def parse(data):
+    """Parse the bytes of a class file."""
+
+    reader = _Reader(data)
+
+    if reader.u4() != _MAGIC:
+        raise ClassFormatError('not a class file')
+
+    # Skip the version.
+    reader.read(4)
+
+    pool = _read_pool(reader)
+
+    access = reader.u2() & ~_ACC_SUPER
+    name = _resolve(pool, reader.u2())
+    super_index = reader.u2()
+    superclass = _resolve(pool, super_index) if super_index else None
+    interfaces = sorted(_resolve(pool, reader.u2())
+        for i in range(reader.u2()))
+
+    fields, field_descriptors = _read_members(reader, pool)
+    methods, method_descriptors = _read_members(reader, pool)
+
+    # The name of the source file isn't part of the API.
+    attributes = _read_attributes(reader, pool,
+        _api_attributes | {'SourceFile'})
+    source = dict(attributes).get('SourceFile')
+    attributes = [a for a in attributes if a[0] != 'SourceFile']
+
+    api = hashlib.md5(repr((
+        name,
+        access,
+        superclass,
+        interfaces,
+        fields,
+        methods,
+        attributes,
+    )).encode()).hexdigest()
+
+    # The fields other classes can see that have constant values, if there
+    # are any.
+    constants = [(field[0], value)
+        for field in fields
+        for attribute, value in field[3] if attribute == 'ConstantValue']
+    if constants:
+        constants = hashlib.md5(repr(constants).encode()).hexdigest()
+    else:
+        constants = None
+
+    # Find every class this class refers to.
+    references = set()
+    descriptors = field_descriptors + method_descriptors
+    for constant in pool:
+        if constant is None:
+            continue
+        elif constant[0] == _CLASS:
+            references.add(_resolve(pool, constant[1]))
+        elif constant[0] == _NAME_AND_TYPE:
+            descriptors.append(_resolve(pool, constant[2]))
+
+    for descriptor in descriptors:
+        references.update(_descriptor_regex.findall(descriptor))
+
+    # Array classes are named by their descriptors.
+    for reference in list(references):
+        if reference.startswith('['):
+            references.discard(reference)
+            references.update(_descriptor_regex.findall(reference))
+
+    references.discard(name)
+
+    return ClassFile(name, api, frozenset(references), source, constants)
+
+
+def read(path):
+    """Parse the class file at I{path}."""
+
+    with open(path, 'rb') as f:
+        return parse(f.read())
@@ -0,0 +1,158 @@
+"""
+Read the external symbols out of the symbol table of an ELF object file.
+
+This matches what C{nm -gP} reports for the file, restricted to the symbol
+types L{fbuild.builders.nm.Nm} looks at: the global symbols a file defines,
+and the global symbols it needs some other file to define. Weak, unique and
+indirect function symbols are left out, just like nm's lowercase and C{W} and
+C{V} types are.
+"""
+
+import struct
+
+import fbuild
+
+# ------------------------------------------------------------------------------
+
+class ElfFormatError(fbuild.Error):
+    pass
+
+# ------------------------------------------------------------------------------
+
+_MAGIC = b'\x7fELF'
+
+_ELFCLASS32 = 1
+_ELFCLASS64 = 2
+
+_ELFDATA2LSB = 1
+_ELFDATA2MSB = 2
+
+_SHT_SYMTAB = 2
+
+_SHN_UNDEF = 0
+
+_STB_GLOBAL = 1
+
+_STT_SECTION = 3
+_STT_FILE = 4
+_STT_GNU_IFUNC = 10
+
+# The layouts of the parts of the file we read, for 32 and 64 bit files. The
+# header layout reads e_shoff, e_shentsize and e_shnum from its offset, and
+# symbol_fields are where st_name, st_info and st_shndx are in a symbol.
+_layouts = {
+    _ELFCLASS32: {
+        'header': ('I10xHH', 0x20),
+        'section': 'IIIIIIIIII',
+        'symbol': 'IIIBBH',
+        'symbol_fields': (0, 3, 5),
+    },
+    _ELFCLASS64: {
+        'header': ('Q10xHH', 0x28),
+        'section': 'IIQQQQIIQQ',
+        'symbol': 'IBBHQQ',
+        'symbol_fields': (0, 1, 3),
+    },
+}
+
+
+def is_elf(data):
+    """Return if I{data} starts like an ELF file."""
+    return data[:4] == _MAGIC
+
+
+def _unpack(fmt, data, offset):
+    try:
+        return struct.unpack_from(fmt, data, offset)
+    except struct.error:
+        raise ElfFormatError('truncated ELF file')
+
+
+def _string(data, offset):
+    end = data.find(b'\0', offset)
+    if end == -1:
+        raise ElfFormatError('unterminated string')
+    return data[offset:end]
+
+
+def symbols(data):
+    """Return the sets of the external symbols the ELF file I{data} defines
+    and the ones it leaves undefined. The symbols are bytes, like nm's
+    output."""
+
+    if not is_elf(data):
+        raise ElfFormatError('not an ELF file')
+
+    if len(data) < 16:
+        raise ElfFormatError('truncated ELF file')
+
+    try:
+        layout = _layouts[data[4]]
+    except KeyError:
+        raise ElfFormatError('unknown ELF class %d' % data[4])
+
+    if data[5] == _ELFDATA2LSB:
+        order = '<'
+    elif data[5] == _ELFDATA2MSB:
+        order = '>'
+    else:
+        raise ElfFormatError('unknown ELF data encoding %d' % data[5])
+
+    fmt, offset = layout['header']
+    shoff, shentsize, shnum = _unpack(order + fmt, data, offset)
+
+    section_fmt = order + layout['section']
+    if shoff == 0:
+        return frozenset(), frozenset()
+    elif shentsize != struct.calcsize(section_fmt):
+        raise ElfFormatError('bad section header size %d' % shentsize)
+
+    # A file with a lot of sections keeps the count in the first section.
+    if shnum == 0:
+        shnum = _unpack(section_fmt, data, shoff)[5]
+
+    sections = [_unpack(section_fmt, data, shoff + i * shentsize)
+        for i in range(shnum)]
+
+    symbol_fmt = order + layout['symbol']
+    symbol_size = struct.calcsize(symbol_fmt)
+    name_field, info_field, shndx_field = layout['symbol_fields']
+
+    defined = set()
+    undefined = set()
+    for section in sections:
+        if section[1] != _SHT_SYMTAB:
+            continue
+
+        offset, size, link = section[4], section[5], section[6]
+        if link >= len(sections):
+            raise ElfFormatError('bad string table index %d' % link)
+        strtab = sections[link][4]
+
+        # The first symbol is always the null symbol.
+        for i in range(symbol_size, size, symbol_size):
+            symbol = _unpack(symbol_fmt, data, offset + i)
+            info = symbol[info_field]
+            bind = info >> 4
+            kind = info & 0xf
+
+            if bind != _STB_GLOBAL or kind in (_STT_SECTION, _STT_FILE):
+                continue
+
+            name = _string(data, strtab + symbol[name_field])
+            if not name:
+                continue
+
+            if symbol[shndx_field] == _SHN_UNDEF:
+                undefined.add(name)
+            elif kind != _STT_GNU_IFUNC:
+                defined.add(name)
+
+    return frozenset(defined), frozenset(undefined)
+
+
+def read(path):
+    """Return the symbols of the ELF file at I{path}."""
+
+    with open(path, 'rb') as f:
+        return symbols(f.read())
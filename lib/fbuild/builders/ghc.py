@@ -1,3 +1,4 @@
+import re
 from functools import partial
 from itertools import chain
 
@@ -76,6 +77,37 @@ class Ghc(fbuild.db.PersistentObject):
 
 # ------------------------------------------------------------------------------
 
+# The parts of a haskell source that say what it's called and what it uses.
+# Block comments are stripped out first, but pragmas are kept since an import
+# can be marked as {-# SOURCE #-}.
+_comment_regex = re.compile(r'\{-(?!#).*?-\}', re.S)
+_module_regex = re.compile(r'^module\s+([A-Z][\w.\']*)', re.M)
+_import_regex = re.compile(
+    r'^import\s+(\{-#\s*SOURCE\s*#-\}\s+)?(?:safe\s+)?(?:qualified\s+)?'
+    r'(?:"[^"]*"\s+)?([A-Z][\w.\']*)', re.M)
+
+# The code in a literate haskell source is either on the lines that start with
+# a bird track, or in LaTeX style code blocks.
+_bird_track_regex = re.compile(r'^> ?(.*\n?)', re.M)
+_code_block_regex = re.compile(
+    r'^\\begin\{code\}[^\n]*\n(.*?)^\\end\{code\}', re.M | re.S)
+
+def _unlit(text):
+    """Return the code in a literate haskell source."""
+
+    lines = _bird_track_regex.findall(text)
+    if lines:
+        return ''.join(lines)
+
+    return ''.join(_code_block_regex.findall(text))
+
+def _is_boot(src):
+    """Return if the L{src} is a boot file, which declares the parts of a
+    module that the modules it imports use through {-# SOURCE #-} imports.
+    Compiling one writes a .hi-boot interface and a .o-boot object."""
+
+    return src.endswith('-boot')
+
 class Builder(fbuild.builders.AbstractExeLinker):
     def __init__(self, ctx, *,
             ghc='ghc',
@@ -89,9 +121,108 @@ class Builder(fbuild.builders.AbstractExeLinker):
     # --------------------------------------------------------------------------
 
     @fbuild.db.cachemethod
-    def compile(self, src:fbuild.db.SRC, *args, **kwargs) -> fbuild.db.DST:
-        """Compile a haskell file and cache the results."""
-        return self.uncached_compile(src, *args, **kwargs)
+    def imports(self, src:fbuild.db.SRC):
+        """Return the name of the module in the L{src} file, the names of the
+        modules it imports, and the names of the modules it imports through
+        their boot files with {-# SOURCE #-}."""
+
+        with open(src, 'rb') as f:
+            code = f.read().decode('utf-8', 'replace')
+
+        if fbuild.path.Path(src).ext in ('.lhs', '.lhs-boot'):
+            code = _unlit(code)
+
+        code = _comment_regex.sub('', code)
+
+        m = _module_regex.search(code)
+        module = m.group(1) if m else 'Main'
+
+        imports = []
+        source_imports = []
+        for source, name in _import_regex.findall(code):
+            if source:
+                source_imports.append(name)
+            else:
+                imports.append(name)
+
+        return module, tuple(imports), tuple(source_imports)
+
+    @fbuild.db.cachemethod
+    def source_dependencies(self, src:fbuild.db.SRC, *,
+            includes=()) -> fbuild.db.DSTS:
+        """Find the source files of the modules the L{src} file imports. The
+        modules are searched for next to the src, and then in the
+        I{includes}. A module imported with {-# SOURCE #-} is found through
+        its boot file instead. Modules that can't be found, such as the ones
+        from packages, are skipped. A module with a boot file also depends on
+        it, since ghc checks the module against it."""
+
+        src = fbuild.path.Path(src)
+        imports, source_imports = self.imports(src)[1:]
+
+        deps = []
+        boot = src + '-boot'
+        if not _is_boot(src) and boot.exists():
+            deps.append(boot)
+
+        for module, suffixes in chain(
+                ((m, ('.hs', '.lhs')) for m in imports),
+                ((m, ('.hs-boot', '.lhs-boot')) for m in source_imports)):
+            path = fbuild.path.Path(*module.split('.'))
+            for include in chain((src.parent,), includes):
+                for suffix in suffixes:
+                    dep = fbuild.path.Path(include, path + suffix)
+                    if dep.exists():
+                        deps.append(dep)
+                        break
+                else:
+                    continue
+                break
+
+        return deps
+
+    def interface(self, src, dst=None, *,
+            hidir=None,
+            buildroot=None,
+            **kwargs):
+        """Return the interface file ghc writes when it compiles the L{src}
+        file."""
+
+        if hidir is None:
+            buildroot = buildroot or self.ctx.buildroot
+            dst = fbuild.path.Path(dst or src).replaceext(self.obj_suffix)
+            hidir = dst.addroot(buildroot).parent
+
+        module = self.imports(src)[0]
+        suffix = '.hi-boot' if _is_boot(src) else '.hi'
+
+        return fbuild.path.Path(hidir, *module.split('.')) + suffix
+
+    # --------------------------------------------------------------------------
+
+    @fbuild.db.cachemethod
+    def compile(self, src:fbuild.db.SRC, *args,
+            includes=(),
+            **kwargs) -> fbuild.db.DST:
+        """Compile a haskell file and cache the results. The file is compiled
+        again whenever the interfaces of the modules it imports change."""
+        dst = self.uncached_compile(src, *args, **kwargs)
+
+        # The dst is only for this src, so don't use it to find the interfaces
+        # of the imported modules.
+        dep_kwargs = {k: v for k, v in kwargs.items() if k != 'dst'}
+
+        srcs = []
+        for dep in self.source_dependencies(src, includes=includes):
+            interface = self.interface(dep, **dep_kwargs)
+            if interface.exists():
+                srcs.append(interface)
+
+        self.ctx.db.add_external_dependencies_to_call(
+            srcs=srcs,
+            dsts=[self.interface(src, *args[:1], **kwargs)])
+
+        return dst
 
     def uncached_compile(self, src, dst=None, *args,
             pre_flags=[],
@@ -104,7 +235,10 @@ class Builder(fbuild.builders.AbstractExeLinker):
         buildroot = buildroot or self.ctx.buildroot
 
         src = fbuild.path.Path(src)
-        dst = fbuild.path.Path(dst or src).replaceext(self.obj_suffix)
+        suffix = self.obj_suffix
+        if _is_boot(src):
+            suffix += '-boot'
+        dst = fbuild.path.Path(dst or src).replaceext(suffix)
         dst = dst.addroot(buildroot)
 
         dst.parent.makedirs()
@@ -141,11 +275,30 @@ class Builder(fbuild.builders.AbstractExeLinker):
     # --------------------------------------------------------------------------
 
     @fbuild.db.cachemethod
-    def build_objects(self, srcs:fbuild.db.SRCS,
+    def build_objects(self, srcs:fbuild.db.SRCS, *,
+            includes=(),
             **kwargs) -> fbuild.db.DSTS:
-        """Compile all the L{srcs} in parallel."""
-
-        return self.ctx.scheduler.map(partial(self.compile, **kwargs), srcs)
+        """Compile all the L{srcs} in parallel. A module is compiled as soon
+        as the modules it imports are, and the objects are returned with
+        the imported modules first. The boot files next to the srcs are
+        compiled too, before the modules that import them with
+        {-# SOURCE #-}, so modules can import each other."""
+
+        boots = []
+        for src in srcs:
+            boot = fbuild.path.Path(src + '-boot')
+            if boot.exists():
+                boots.append(boot)
+
+        self.ctx.db.add_external_dependencies_to_call(srcs=boots)
+
+        objs = self.ctx.scheduler.map_with_dependencies(
+            partial(self.source_dependencies, includes=includes),
+            partial(self.compile, includes=includes, **kwargs),
+            boots + list(srcs))
+
+        # The boot objects aren't linked.
+        return [obj for obj in objs if not _is_boot(obj)]
 
     def build_exe(self, dst, srcs:fbuild.db.SRCS, *args,
             ckwargs={},
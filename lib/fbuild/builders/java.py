@@ -1,22 +1,66 @@
+import abc
+import collections
 import os
-import io
 import re
+import threading
+import zipfile
+import zlib
 from functools import partial
 from itertools import chain
 
 import fbuild
 import fbuild.builders
+import fbuild.builders.classfile
 import fbuild.db
 from fbuild.path import Path
 from fbuild.temp import tempfile
 
 # ------------------------------------------------------------------------------
 
+def _read_api(path):
+    """Read the API of the class file at I{path}. We can't tell what's in a
+    class we can't parse, so its API is the whole file."""
+
+    try:
+        return fbuild.builders.classfile.read(path)
+    except fbuild.builders.classfile.ClassFormatError:
+        return fbuild.builders.classfile.ClassFile(None, Path(path).digest(),
+            frozenset(), None, None)
+
+
+def _write_api(path, api):
+    """Write the I{api} to I{path}, unless it's already there. The classes
+    that depend on a class depend on this file, so leaving it alone keeps
+    them from being recompiled."""
+
+    try:
+        with open(path) as f:
+            if f.read() == api:
+                return
+    except IOError:
+        pass
+
+    # Another compile may be writing the same API at the same time, so
+    # replace the file in one go.
+    tmp = '%s.%d.tmp' % (path, threading.get_ident())
+    with open(tmp, 'w') as f:
+        f.write(api)
+    os.replace(tmp, path)
+
+# ------------------------------------------------------------------------------
+
 class Jar(fbuild.db.PersistentObject):
-    def __init__(self, ctx, exe='jar'):
+    """Create jars. By default the jars are written by fbuild itself, which
+    saves starting up a JVM for each one, but if an I{exe} is given, it's run
+    like the jar tool instead."""
+
+    def __init__(self, ctx, exe=None):
         super().__init__(ctx)
 
-        self.exe = fbuild.builders.find_program(ctx, [exe])
+        if exe is None:
+            self.exe = None
+        else:
+            self.exe = fbuild.builders.find_program(ctx, [exe])
 
     # --------------------------------------------------------------------------
 
@@ -33,6 +77,7 @@ class Jar(fbuild.db.PersistentObject):
             manifest=None,
             cwd=None,
             buildroot=None,
+            quieter=0,
             **kwargs):
         """Collect all the L{srcs} into a jar."""
         # Unfortunately, we need to adjust the current working directory to
@@ -46,30 +91,132 @@ class Jar(fbuild.db.PersistentObject):
         # We need ot make sure jars have sources passed in
         assert srcs, "%s: no sources passed in" % dst
 
-        cmd = [self.exe]
-
-        if manifest is None:
-            cmd.append('cf')
-        else:
-            # Adjust the manifest to the cwd.
-            cmd.extend(('cmf', Path(manifest).relpath(cwd)))
-
-        # Adjust the dst and srcs to the cwd
-        cmd.append(dst.relpath(cwd))
-        cmd.extend(Path(src).relpath(cwd) for src in srcs)
-
         if manifest is None:
             msg2 = '%s -> %s' % (' '.join(srcs), dst)
         else:
             msg2 = '%s %s -> %s' % (manifest, ' '.join(srcs), dst)
 
-        self.ctx.execute(cmd, self, msg2, cwd=cwd, color='link', **kwargs)
+        if self.exe is None:
+            self.ctx.logger.check(str(self), msg2, color='link',
+                verbose=quieter)
+            self._write(dst, srcs, manifest, cwd)
+        else:
+            cmd = [self.exe]
+
+            if manifest is None:
+                cmd.append('cf')
+            else:
+                # Adjust the manifest to the cwd.
+                cmd.extend(('cmf', Path(manifest).relpath(cwd)))
+
+            # Adjust the dst and srcs to the cwd
+            cmd.append(dst.relpath(cwd))
+            cmd.extend(Path(src).relpath(cwd) for src in srcs)
+
+            self.ctx.execute(cmd, self, msg2,
+                cwd=cwd,
+                color='link',
+                quieter=quieter,
+                **kwargs)
+
+        # Record the API of every class in the jar, so that what's compiled
+        # against the jar only needs recompiling when the API changes.
+        apis = []
+        for src in srcs:
+            src = Path(src)
+            if src.ext == '.class':
+                cls = _read_api(src)
+                apis.append('%s %s\n' % (
+                    cls.name or src.relpath(cwd).replaceext(''),
+                    cls.api))
+
+        _write_api(dst + '.api', ''.join(sorted(apis)))
+        self.ctx.db.add_external_dependencies_to_call(dsts=[dst + '.api'])
 
         return dst
 
     # --------------------------------------------------------------------------
 
+    # Every entry gets the same timestamp, so the same files always make the
+    # same jar.
+    _date_time = (1980, 1, 1, 0, 0, 0)
+
+    def _write(self, dst, srcs, manifest, cwd):
+        """Write the jar. If the jar already has exactly these entries it's
+        left alone, so it keeps its timestamp."""
+
+        entries = [('META-INF/', b''),
+            ('META-INF/MANIFEST.MF', self._manifest(manifest))]
+
+        # Name the entries after the srcs' paths relative to the cwd, like
+        # the jar tool does.
+        for src in srcs:
+            src = Path(src)
+            if src.isdir():
+                paths = sorted(src.find(include_dirs=False))
+            else:
+                paths = [src]
+
+            for path in paths:
+                with open(path, 'rb') as f:
+                    entries.append((
+                        path.relpath(cwd).replace(os.sep, '/'),
+                        f.read()))
+
+        try:
+            with zipfile.ZipFile(dst) as old:
+                unchanged = [(i.filename, i.CRC, i.file_size)
+                    for i in old.infolist()] == \
+                    [(name, zlib.crc32(data), len(data))
+                    for name, data in entries]
+        except (IOError, zipfile.BadZipfile):
+            unchanged = False
+
+        if unchanged:
+            return
+
+        dst.parent.makedirs()
+        with zipfile.ZipFile(dst, 'w', zipfile.ZIP_DEFLATED) as jar:
+            for name, data in entries:
+                info = zipfile.ZipInfo(name, self._date_time)
+                if name.endswith('/'):
+                    info.external_attr = 0o40755 << 16
+                else:
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    info.external_attr = 0o644 << 16
+                jar.writestr(info, data)
+
+    def _manifest(self, manifest):
+        """Return the manifest for a jar, based on the I{manifest} file if
+        there is one."""
+
+        lines = []
+        if manifest is not None:
+            with open(manifest, 'rb') as f:
+                lines = f.read().decode('utf-8').splitlines()
+
+        # The main attributes end with the first blank line.
+        main = lines.index('') if '' in lines else len(lines)
+
+        if not any(line.startswith('Created-By:') for line in lines[:main]):
+            lines.insert(0, 'Created-By: fbuild')
+
+        if not any(line.startswith('Manifest-Version:')
+                for line in lines[:main]):
+            lines.insert(0, 'Manifest-Version: 1.0')
+
+        # Drop the trailing blank lines, since the manifest needs to end with
+        # exactly one line break.
+        while lines and not lines[-1]:
+            lines.pop()
+
+        return ''.join(line + '\r\n' for line in lines).encode('utf-8')
+
+    # --------------------------------------------------------------------------
+
     def __str__(self):
+        if self.exe is None:
+            return 'jar'
         return self.exe.name
 
 # ------------------------------------------------------------------------------
@@ -208,7 +355,7 @@ class Javac(AbstractCompiler):
 # ------------------------------------------------------------------------------
 
 class AbstractBuilder(fbuild.builders.AbstractLibLinker):
-    def __init__(self, ctx, *, jar='jar', java='java', **kwargs):
+    def __init__(self, ctx, *, jar=None, java='java', **kwargs):
         super().__init__(ctx, src_suffix='.class')
 
         self.jar = fbuild.builders.java.Jar(ctx, jar)
@@ -218,54 +365,186 @@ class AbstractBuilder(fbuild.builders.AbstractLibLinker):
 
     _dep_regex = re.compile(r'\[wrote (.*)\]')
 
-    def _run(self, builder, src, dst=None, *,
+    # The -verbose output can be huge, but we parse it as it arrives, so we
+    # only need to keep the end of it around for errors.
+    _output_limit = 65536
+
+    def _run(self, builder, src, dst=None, **kwargs):
+        """Compile a java file."""
+
+        return self._run_batch(builder, [src], dst, **kwargs)[src]
+
+    def _run_batch(self, builder, srcs, dst=None, **kwargs):
+        """Compile java files that go in the same directory together. Returns
+        a dictionary of the files generated for each src."""
+
+        srcs = [Path(src) for src in srcs]
+        dst = Path(dst or srcs[0].parent).addroot(
+            kwargs.pop('buildroot', None) or self.ctx.buildroot)
+
+        dsts = self._run_compiler(builder, srcs, dst, **kwargs)
+        if len(srcs) == 1:
+            return {srcs[0]: dsts}
+
+        results = self._attribute(srcs, dsts)
+        if results is None:
+            # We can't tell where some of the files came from, so compile the
+            # srcs one at a time.
+            results = {}
+            for src in srcs:
+                results[src] = self._run_compiler(builder, [src], dst,
+                    **kwargs)
+
+        return results
+
+    def _run_compiler(self, builder, srcs, dst, *,
             flags=[],
             quieter=0,
             stderr_quieter=0,
-            buildroot=None,
             **kwargs):
-        """Compile a java file."""
+        """Run the compiler on the L{srcs}, and return the files it
+        generated."""
 
-        src = Path(src)
-        dst = Path(dst or src.parent).addroot(buildroot or self.ctx.buildroot)
+        # Parse the output to find what files we generated, and hold on to
+        # the lines that aren't verbose messages.
+        dsts = []
+        messages = []
+        def parse(line):
+            line = line.decode(errors='replace')
+            m = self._dep_regex.match(line)
+            if m:
+                dsts.append(Path(m.group(1)))
+            elif not line.startswith('['):
+                messages.append(line)
 
-        # Extract the generated files when we compile the file.
+        # Extract the generated files when we compile the files.
         try:
-            dst, stdout, stderr = builder(dst, [src],
+            dst, stdout, stderr = builder(dst, srcs,
                 flags=list(chain(('-verbose',), flags)),
                 quieter=quieter,
                 stderr_quieter=1 if stderr_quieter == 0 else stderr_quieter,
+                stderr_hook=parse,
+                output_limit=self._output_limit,
                 **kwargs)
-        except fbuild.ExecutionError as e:
+        finally:
             if quieter == 0 and stderr_quieter == 0:
-                # We errored out, but we've hidden the stderr output.
-                for line in io.StringIO(e.stderr.decode()):
-                    if not line.startswith('['):
-                        self.ctx.logger.write(line)
-            raise e
-
-        # Parse the output and find what files we generated.
-        dsts = []
-        for line in io.StringIO(stderr.decode()):
-            m = self._dep_regex.match(line)
-            if m:
-                dsts.append(Path(m.group(1)))
-            elif quieter == 0 and stderr_quieter == 0:
-                if not line.startswith('['):
+                # We've hidden the stderr output, so show the messages.
+                for line in messages:
                     self.ctx.logger.write(line)
 
         # Log all the files we found
-        self.ctx.logger.check(str(builder), '%s -> %s' % (src, ' '.join(dsts)),
+        self.ctx.logger.check(str(builder), '%s -> %s' % (
+            ' '.join(srcs), ' '.join(dsts)),
             color='compile')
 
         return dsts
 
+    def _attribute(self, srcs, dsts):
+        """Work out which of the L{srcs} each of the generated L{dsts} came
+        from, using the name of the source file the compiler records in each
+        class. That's just the file's name, so it only tells the srcs apart
+        if their names are different. Returns None if there's a file we can't
+        place, such as a class compiled without its source file name."""
+
+        names = {}
+        for src in srcs:
+            names[src.name] = None if src.name in names else src
+
+        results = {src: [] for src in srcs}
+        for d in dsts:
+            if d.ext != '.class':
+                return None
+
+            src = names.get(_read_api(d).source)
+            if src is None:
+                return None
+
+            results[src].append(d)
+
+        return results
+
     # --------------------------------------------------------------------------
 
     @fbuild.db.cachemethod
     def compile(self, src:fbuild.db.SRC, *args, **kwargs) -> fbuild.db.DSTS:
         """Compile the L{src} file and cache the results."""
-        return self.uncached_compile(src, *args, **kwargs)
+
+        dsts = self.uncached_compile(src, *args, **kwargs)
+        self._depend_on_apis(dsts, kwargs.get('classpaths', ()))
+
+        return dsts
+
+    def _depend_on_apis(self, dsts, classpaths):
+        """Record the API of each of the generated classes, and make the
+        compile depend on the APIs of the classes they use rather than on the
+        sources of those classes. Changing a class then only recompiles the
+        classes that use it if its API changed."""
+
+        names = set()
+        references = set()
+        dirs = []
+        jars = []
+        apis = []
+        for dst in dsts:
+            if dst.ext != '.class':
+                continue
+
+            cls = _read_api(dst)
+            _write_api(dst + '.api', cls.api)
+            apis.append(dst + '.api')
+
+            if cls.name is not None:
+                names.add(cls.name)
+                references.update(cls.references)
+
+                # Find the directory the class's package is in.
+                rel = os.path.join(*cls.name.split('/')) + '.class'
+                if dst.endswith(rel):
+                    dirs.append(Path(dst[:-len(rel)] or os.curdir))
+
+        self.ctx.db.add_external_dependencies_to_call(dsts=apis)
+
+        # Look for the classes we use next to our classes, and then on the
+        # classpath.
+        own_dirs = set(dirs)
+        for classpath in classpaths:
+            for path in str(classpath).split(os.pathsep):
+                if path.endswith(('.jar', '.zip')):
+                    jars.append(Path(path))
+                elif path:
+                    dirs.append(Path(path))
+
+        references -= names
+        srcs = set()
+        for reference in references:
+            for d in dirs:
+                # The classes next to ours may have been compiled along with
+                # them, and not have had their APIs written yet.
+                path = Path(d, *reference.split('/')) + '.class'
+                if d in own_dirs and path.exists():
+                    _write_api(path + '.api', _read_api(path).api)
+
+                if (path + '.api').exists():
+                    srcs.add(path + '.api')
+                    break
+
+        for jar in jars:
+            try:
+                with open(jar + '.api') as f:
+                    jar_names = {line.split(' ', 1)[0] for line in f}
+            except IOError:
+                continue
+
+            if not references.isdisjoint(jar_names):
+                srcs.add(jar + '.api')
+
+        self.ctx.db.add_external_dependencies_to_call(srcs=srcs)
+
+    @abc.abstractmethod
+    def uncached_compile_batch(self, srcs, *args, **kwargs):
+        """Compile the L{srcs} together. Returns a dictionary of the files
+        generated for each src."""
+        pass
 
     def link_lib(self, *args, **kwargs):
         """Link all the L{srcs} into a library and cache the result."""
@@ -278,14 +557,131 @@ class AbstractBuilder(fbuild.builders.AbstractLibLinker):
     # --------------------------------------------------------------------------
 
     @fbuild.db.cachemethod
-    def build_objects(self, srcs:fbuild.db.SRCS, **kwargs) -> fbuild.db.DSTS:
-        """Compile all the L{srcs} in parallel."""
+    def build_objects(self, srcs:fbuild.db.SRCS, *,
+            batch=False,
+            batch_size=None,
+            **kwargs) -> fbuild.db.DSTS:
+        """Compile all the L{srcs} in parallel. With I{batch}, the srcs that
+        changed are compiled together with as few compiler calls as we can,
+        with at most I{batch_size} srcs in each, but the results are still
+        cached for each src."""
+
+        # Compiling a src can change the API of a class another src uses, so
+        # once the srcs that are out of date are compiled, check the others
+        # again. Each src is only compiled once, so this ends even when srcs
+        # use each other.
+        results = {}
+        remaining = list(srcs)
+        rebuild = False
+        while remaining:
+            dirty = {}
+            for src in remaining:
+                prepared = self.compile.prepare(src, **kwargs)
+                if prepared.dirty or rebuild:
+                    dirty[src] = prepared
+                else:
+                    results[src] = \
+                        prepared.result, prepared.all_srcs, prepared.all_dsts
+
+            if not dirty:
+                break
+
+            old_constants = self._constants(chain.from_iterable(
+                prepared.old_result or () for prepared in dirty.values()))
+
+            if batch:
+                results.update(self._compile_batched(dirty, batch_size,
+                    kwargs))
+            else:
+                results.update(zip(dirty, self.ctx.scheduler.map(
+                    lambda prepared: prepared.run(), dirty.values())))
+
+            # javac copies constants into the classes that use them, which
+            # then don't refer to the constant's class at all. So if one
+            # changed, we can't tell which srcs used it, and all the others
+            # need compiling again.
+            new_constants = self._constants(chain.from_iterable(
+                results[src][0] for src in dirty))
+            if any(new_constants.get(path) != constants
+                    for path, constants in old_constants.items()):
+                rebuild = True
+
+            remaining = [src for src in remaining if src not in dirty]
+
+        # The compiles depend on the APIs of the classes they use, so this
+        # call needs to depend on them too.
         dsts = []
-        for d in self.ctx.scheduler.map(partial(self.compile, **kwargs), srcs):
-            dsts.extend(d)
+        src_deps = []
+        dst_deps = []
+        for o, s, d in (results[src] for src in srcs):
+            dsts.extend(o)
+            src_deps.extend(s)
+            dst_deps.extend(d)
+
+        self.ctx.db.add_external_dependencies_to_call(
+            srcs=src_deps,
+            dsts=dst_deps)
 
         return dsts
 
+    def _constants(self, dsts):
+        """Return the digest of the constants of each of the classes in
+        L{dsts} that has any."""
+
+        constants = {}
+        for dst in dsts:
+            dst = Path(dst)
+            if dst.ext == '.class' and dst.exists():
+                c = _read_api(dst).constants
+                if c is not None:
+                    constants[dst] = c
+
+        return constants
+
+    def _compile_batched(self, calls, batch_size, kwargs):
+        """Compile the srcs of the out of date prepared L{calls} in batches,
+        and return the files generated for each src, along with the src and
+        dst dependencies of its call."""
+
+        def run(dirty):
+            # Classes of srcs in different directories go in different
+            # places, so they can only be compiled together if there's a dst.
+            groups = {}
+            for src in dirty:
+                groups.setdefault(kwargs.get('dst') or Path(src).parent,
+                    []).append(src)
+
+            # A class only records the name of its src, so srcs with the same
+            # name go in different batches.
+            batches = []
+            for group in groups.values():
+                rounds = []
+                seen = collections.Counter()
+                for src in group:
+                    name = Path(src).name
+                    if seen[name] == len(rounds):
+                        rounds.append([])
+                    rounds[seen[name]].append(src)
+                    seen[name] += 1
+
+                for r in rounds:
+                    size = batch_size or len(r)
+                    batches.extend(r[i:i + size]
+                        for i in range(0, len(r), size))
+
+            results = {}
+            for batch_dsts in self.ctx.scheduler.map(
+                    partial(self.uncached_compile_batch, **kwargs), batches):
+                results.update(batch_dsts)
+
+            return results
+
+        def complete(src, dsts):
+            self._depend_on_apis(dsts, kwargs.get('classpaths', ()))
+            return dsts
+
+        return fbuild.db.run_batched(calls, run, complete)
+
     def build_lib(self, dst, srcs, *args,
             cwd=None,
             ckwargs={},
@@ -316,10 +712,13 @@ class AbstractBuilder(fbuild.builders.AbstractLibLinker):
 # ------------------------------------------------------------------------------
 
 class Builder(AbstractBuilder):
-    def __init__(self, ctx, *, jar='jar', java='java', javac='javac', **kwargs):
+    def __init__(self, ctx, *, jar=None, java='java', javac='javac', **kwargs):
         super().__init__(ctx, jar=jar, java=java, src_suffix='.java')
 
         self.javac = fbuild.builders.java.Javac(ctx, javac, **kwargs)
 
     def uncached_compile(self, *args, **kwargs):
         return self._run(self.javac, *args, **kwargs)
+
+    def uncached_compile_batch(self, *args, **kwargs):
+        return self._run_batch(self.javac, *args, **kwargs)
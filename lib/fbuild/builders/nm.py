@@ -5,32 +5,43 @@ from itertools import chain
 import fbuild
 import fbuild.path
 import fbuild.builders
+import fbuild.builders.elf
 import fbuild.db
 
 # ------------------------------------------------------------------------------
 
 class Nm(fbuild.db.PersistentObject):
-    def __init__(self, ctx, exe=None):
+    def __init__(self, ctx, exe=None, *, read_elf=False):
         super().__init__(ctx)
 
         self.exe = fbuild.builders.find_program(ctx, [exe or 'nm'])
 
+        # If set, read the symbols of ELF objects ourselves instead of running
+        # nm on them.
+        self.read_elf = read_elf
+
     @fbuild.db.cachemethod
     def object_dependencies(self, objs:fbuild.db.SRCS):
+        """Sort the L{objs} so that each object comes before the objects
+        that define the symbols it uses."""
         defined_symbols_lookup = {}
         undefined_symbols_lookup = {}
 
-        for obj in objs:
-            defined_symbols, undefined_symbols = self._run(obj)
+        # Read the objects in parallel. Each one is cached on its own, so
+        # only the objects that changed are read again.
+        for obj, (defined_symbols, undefined_symbols) in zip(objs,
+                self.ctx.scheduler.map(self.symbols, objs)):
             for symbol in defined_symbols:
                 defined_symbols_lookup[symbol] = obj
 
             undefined_symbols_lookup[obj] = undefined_symbols
 
         new_objs = []
+        visited = set()
         def f(obj):
-            if obj in new_objs:
+            if obj in visited:
                 return
+            visited.add(obj)
 
             for undefined_symbol in undefined_symbols_lookup[obj]:
                 try:
@@ -45,7 +56,23 @@ class Nm(fbuild.db.PersistentObject):
         for obj in objs:
             f(obj)
 
-        return reversed(new_objs)
+        new_objs.reverse()
+
+        return new_objs
+
+    @fbuild.db.cachemethod
+    def symbols(self, obj:fbuild.db.SRC):
+        """Return the sets of the external symbols the object defines, and
+        the ones it uses but doesn't define."""
+        if self.read_elf:
+            try:
+                return fbuild.builders.elf.read(obj)
+            except fbuild.builders.elf.ElfFormatError:
+                # It's an archive or some other kind of object, so let nm
+                # deal with it.
+                pass
+
+        return self._run(obj)
 
     def _run(self, obj:fbuild.db.SRC):
         obj = fbuild.path.Path(obj)
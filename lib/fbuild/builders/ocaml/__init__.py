@@ -7,6 +7,9 @@ This builder is compatible with ocaml 3.10 and above.
 import collections
 import re
 import os
+import threading
+import time
+import weakref
 from functools import partial
 from itertools import chain
 
@@ -19,6 +22,12 @@ from fbuild.path import Path
 
 # ------------------------------------------------------------------------------
 
+# The filenames in the directories Ocamldep.source_dependencies searches for
+# modules, along with each directory's status when we listed it. They last for
+# a single build.
+_listings = weakref.WeakKeyDictionary()
+_listings_lock = threading.Lock()
+
 class Ocamldep(fbuild.db.PersistentObject):
     """Use ocamldep to generate dependencies for ocaml files."""
 
@@ -30,12 +39,55 @@ class Ocamldep(fbuild.db.PersistentObject):
         self.pre_flags = tuple(pre_flags)
         self.flags = tuple(flags)
 
+    # The most sources to pass to a single ocamldep.
+    batch_size = 256
+
     @fbuild.db.cachemethod
     def modules(self, src:fbuild.db.SRC, *,
             preprocessor=None,
             flags=()):
         """Calculate the modules this ocaml file depends on."""
-        src = Path(src)
+
+        return self._run([Path(src)], preprocessor, flags)[src]
+
+    def modules_batch(self, srcs, **kwargs):
+        """Calculate the modules each of the L{srcs} depends on. The ones that
+        changed are passed to ocamldep together, but the results are cached
+        for each src just like L{modules}."""
+
+        srcs = [Path(src) for src in srcs]
+
+        def run(dirty):
+            batches = [dirty[i:i + self.batch_size]
+                for i in range(0, len(dirty), self.batch_size)]
+
+            results = {}
+            for r in self.ctx.scheduler.map(
+                    partial(self._run_batch, **kwargs), batches):
+                results.update(r)
+
+            return results
+
+        return fbuild.db.call_batched(self.modules, srcs, run, **kwargs)
+
+    def _run_batch(self, srcs, *, preprocessor=None, flags=()):
+        """Run ocamldep on the L{srcs}. If it fails, run it on each src on its
+        own, so the error points at the right file."""
+
+        if len(srcs) == 1:
+            return self._run(srcs, preprocessor, flags)
+
+        try:
+            return self._run(srcs, preprocessor, flags, quieter=1)
+        except fbuild.ExecutionError:
+            results = {}
+            for src in srcs:
+                results.update(self._run([src], preprocessor, flags))
+            return results
+
+    def _run(self, srcs, preprocessor, flags, **kwargs):
+        """Run ocamldep on the L{srcs}, and return the modules each of them
+        depends on."""
 
         cmd = [self.exe]
         cmd.extend(self.pre_flags)
@@ -46,23 +98,36 @@ class Ocamldep(fbuild.db.PersistentObject):
 
         cmd.extend(self.flags)
         cmd.extend(flags)
-        cmd.append(src)
+        cmd.extend(srcs)
 
         # Now, run ocamldep
-        stdout, stderr = self.ctx.execute(cmd, str(self), src,
+        stdout, stderr = self.ctx.execute(cmd, str(self), ' '.join(srcs),
             color='yellow',
-            stdout_quieter=1)
+            stdout_quieter=1,
+            **kwargs)
 
-        # Parse the output and return the module dependencies.
-        m = re.match(b'\S+:(?: (.*))?$', stdout.strip())
-        if not m:
+        # Parse the output and return the module dependencies. There's a line
+        # for each src, though long lines may be continued with a backslash.
+        lookup = {str(src): src for src in srcs}
+        results = {}
+        for line in stdout.replace(b'\\\n', b' ').splitlines():
+            line = line.strip()
+            if not line:
+                continue
+
+            m = re.match(b'(\S+):(?:\s+(.*))?$', line)
+            if not m or m.group(1).decode() not in lookup:
+                raise fbuild.ExecutionError('unable to understand %r' % line)
+
+            s = m.group(2)
+            results[lookup[m.group(1).decode()]] = \
+                () if s is None else tuple(s.decode().split())
+
+        missing = [src for src in srcs if src not in results]
+        if missing:
             raise fbuild.ExecutionError('unable to understand %r' % stdout)
 
-        s = m.group(1)
-        if s is None:
-            return ()
-        else:
-            return tuple(s.decode().split())
+        return results
 
     @fbuild.db.cachemethod
     def source_dependencies(self, src:fbuild.db.SRC, *,
@@ -82,16 +147,15 @@ class Ocamldep(fbuild.db.PersistentObject):
 
             # Grab the filenames in the directory.
             if include is None:
-                dirs = Path.getcwd().listdir()
+                dirs = self._listdir(Path.getcwd())
             else:
                 include = Path(include)
+                dirs = self._listdir(include)
 
-                if not include.exists():
-                    # We can't search for dependencies in a directory that
-                    # doesn't exist, so exit early.
-                    return False
-
-                dirs = include.listdir()
+            if dirs is None:
+                # We can't search for dependencies in a directory that
+                # doesn't exist, so exit early.
+                return False
 
             found = False
             for suffix in '.mli', '.ml':
@@ -143,6 +207,41 @@ class Ocamldep(fbuild.db.PersistentObject):
 
         return deps
 
+    def _listdir(self, path):
+        """Return the set of filenames in the directory I{path}, or None if it
+        doesn't exist. The listing is reused for the rest of the build until
+        the directory's status changes. Modification times can be too coarse
+        to notice a file that's added right after we list the directory, so
+        a directory that was modified less than a second before we listed it
+        is listed again the next time."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        status = (st.st_ino, st.st_mtime_ns, st.st_ctime_ns, st.st_nlink)
+
+        with _listings_lock:
+            listings = _listings.setdefault(self.ctx, {})
+            try:
+                old_status, listed_at, names = listings[path]
+            except KeyError:
+                pass
+            else:
+                if old_status == status and \
+                        listed_at - st.st_mtime_ns / 1e9 > 1.0:
+                    return names
+
+        # We took the status first, so if the directory changes while we list
+        # it, the next lookup will just list it again.
+        listed_at = time.time()
+        names = frozenset(os.listdir(path))
+
+        with _listings_lock:
+            listings[path] = (status, listed_at, names)
+
+        return names
+
     def __str__(self):
         return self.exe.name
 
@@ -155,6 +254,102 @@ class Ocamldep(fbuild.db.PersistentObject):
 
 # ------------------------------------------------------------------------------
 
+class DependencyGraph:
+    """The transitive source dependencies of ocaml files. I{edges} is a
+    function that returns the files a file directly depends on. Each file's
+    edges are only looked up once, and the closures are computed for a whole
+    strongly connected component at a time, so files that share dependencies,
+    or depend on each other, don't walk the same part of the graph again."""
+
+    def __init__(self, edges):
+        self.edges = edges
+        self._edges = {}
+        self._closures = {}
+        self._lock = threading.Lock()
+
+    def closure(self, src):
+        """Return all the files I{src} depends on, directly or not."""
+        with self._lock:
+            try:
+                return self._closures[src]
+            except KeyError:
+                pass
+
+            self._condense(src)
+
+            return self._closures[src]
+
+    def _direct(self, src):
+        try:
+            return self._edges[src]
+        except KeyError:
+            edges = self._edges[src] = tuple(self.edges(src))
+            return edges
+
+    def _condense(self, root):
+        """Find the strongly connected components reachable from the I{root}
+        with Tarjan's algorithm. They're found in reverse topological order,
+        so each component's dependencies already have their closures by the
+        time we get to it."""
+
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        work = []
+
+        def visit(src):
+            index[src] = lowlink[src] = len(index)
+            stack.append(src)
+            on_stack.add(src)
+            work.append((src, iter(self._direct(src))))
+
+        visit(root)
+        while work:
+            src, deps = work[-1]
+            for dep in deps:
+                if dep in self._closures:
+                    # We finished this one in an earlier walk.
+                    continue
+                elif dep not in index:
+                    visit(dep)
+                    break
+                elif dep in on_stack:
+                    lowlink[src] = min(lowlink[src], index[dep])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[src])
+
+                if lowlink[src] == index[src]:
+                    component = []
+                    while True:
+                        dep = stack.pop()
+                        on_stack.discard(dep)
+                        component.append(dep)
+                        if dep == src:
+                            break
+
+                    closure = set()
+                    for s in component:
+                        for dep in self._direct(s):
+                            closure.add(dep)
+                            if dep in self._closures:
+                                closure.update(self._closures[dep])
+
+                    closure = frozenset(closure)
+                    for s in component:
+                        self._closures[s] = closure
+
+# The dependency graphs last for a single build, and are shared by all the
+# scans a builder does with the same arguments. The graphs are kept out of the
+# builders since those are saved in the database.
+_graphs = weakref.WeakKeyDictionary()
+_graphs_lock = threading.Lock()
+
+# ------------------------------------------------------------------------------
+
 class Builder(fbuild.builders.AbstractCompilerBuilder):
     def __init__(self, ctx, exe, *,
             platform=None,
@@ -345,6 +540,40 @@ class Builder(fbuild.builders.AbstractCompilerBuilder):
 
     # --------------------------------------------------------------------------
 
+    def dependency_graph(self, *, includes=(), preprocessor=None, flags=()):
+        """Return the L{DependencyGraph} this builder uses for this build to
+        scan files with these arguments."""
+        key = (id(self), frozenset(includes), preprocessor, tuple(flags))
+        with _graphs_lock:
+            graphs = _graphs.setdefault(self.ctx, {})
+            try:
+                return graphs[key]
+            except KeyError:
+                graph = graphs[key] = DependencyGraph(partial(
+                    self._scan_edges,
+                    includes=includes,
+                    preprocessor=preprocessor,
+                    flags=flags))
+                return graph
+
+    def _scan_edges(self, src, **kwargs):
+        """Return the files that L{scan} follows from the I{src}."""
+        return self.ocamldep.source_dependencies(src, **kwargs)
+
+    @fbuild.db.cachemethod
+    def scan(self, src:fbuild.db.SRC, *,
+            includes=(),
+            preprocessor=None,
+            flags=()) -> fbuild.db.DSTS:
+        """Recursively compute all the source files this ocaml file depends
+        on."""
+        return set(self.dependency_graph(
+            includes=includes,
+            preprocessor=preprocessor,
+            flags=flags).closure(src))
+
+    # --------------------------------------------------------------------------
+
     @fbuild.db.cachemethod
     def compile(self, src:fbuild.db.SRC, *args,
             includes=(),
@@ -360,7 +589,8 @@ class Builder(fbuild.builders.AbstractCompilerBuilder):
         self._add_compile_dependencies(dst, src,
             includes=includes,
             preprocessor=preprocessor,
-            flags=ocamldep_flags)
+            flags=ocamldep_flags,
+            buildroot=kwargs.get('buildroot'))
         return dst
 
 
@@ -395,7 +625,8 @@ class Builder(fbuild.builders.AbstractCompilerBuilder):
             buildroot=buildroot,
             *args, **kwargs)
 
-    def _add_compile_dependencies(self, dst, src, **kwargs):
+    def _add_compile_dependencies(self, dst, src, *, buildroot=None,
+            **kwargs):
         # If the .mli file doesn't exist, ocaml creates one from the .ml file
         if src.endswith('.ml') and not src.replaceext('.mli').exists():
             dsts = (dst.replaceext('.cmi'),)
@@ -403,9 +634,36 @@ class Builder(fbuild.builders.AbstractCompilerBuilder):
             dsts = ()
 
         self.ctx.db.add_external_dependencies_to_call(
-            srcs=self.scan(src, **kwargs),
+            srcs=self._compiled_dependencies(src,
+                buildroot=buildroot,
+                **kwargs),
             dsts=dsts)
 
+    def _compiled_dependencies(self, src, *, buildroot=None, **kwargs):
+        """Return the files the compile of I{src} reads for the modules it
+        uses. We depend on the compiled interfaces of the modules that we've
+        already compiled, rather than on their sources. A compiled interface
+        records the digests of the interfaces it uses in turn, so it only
+        changes if one of them does, and changing just the implementation of
+        a module won't recompile the modules that use it. Any module we
+        haven't compiled is depended on through its sources."""
+        buildroot = buildroot or self.ctx.buildroot
+
+        deps = set()
+        for dep in self._scan_edges(src, **kwargs):
+            compiled = self._compiled_interfaces(dep.addroot(buildroot))
+            if all(path.exists() for path in compiled):
+                deps.update(compiled)
+            else:
+                deps.add(dep)
+                deps.update(self.dependency_graph(**kwargs).closure(dep))
+
+        return deps
+
+    def _compiled_interfaces(self, dep):
+        """Return the files a compile reads from the compiled I{dep}."""
+        return (dep.replaceext('.cmi'),)
+
     # --------------------------------------------------------------------------
 
     @fbuild.db.cachemethod
@@ -476,31 +734,31 @@ class Builder(fbuild.builders.AbstractCompilerBuilder):
             preprocessor=None,
             **kwargs) -> fbuild.db.DSTS:
         """Compile all the L{srcs} in parallel."""
+        srcs = [Path(src) for src in srcs]
+
         kwargs['buildroot'] = buildroot = buildroot or self.ctx.buildroot
-        kwargs['includes']  = includes  = set(includes)
+        kwargs['includes']  = includes  = self._objects_includes(srcs,
+            includes=includes,
+            libs=libs,
+            external_libs=external_libs)
 
-        # Add the library parents to the search paths
-        includes.update(lib.parent for lib in libs)
-        includes.update(lib.parent for lib in external_libs)
+        # Run ocamldep on all the srcs that changed at once, so that scanning
+        # them one at a time finds their modules in the database.
+        self.ocamldep.modules_batch(srcs,
+            preprocessor=preprocessor,
+            flags=ocamldep_flags)
 
-        srcs = [Path(src) for src in srcs]
-        for src in srcs:
-            parent = src.parent
-            if parent:
-                includes.add(parent)
-                includes.add(parent.addroot(self.ctx.buildroot))
-            else:
-                # We're at the toplevel directory, so just add the buildroot to
-                # the includes.
-                includes.add(self.ctx.buildroot)
+        # Add additional source dependencies to the call. The graph is shared
+        # with the compiles' scans, so each file's dependencies are only
+        # walked once.
+        graph = self.dependency_graph(
+            includes=includes,
+            preprocessor=preprocessor,
+            flags=ocamldep_flags)
 
-        # Add additional source dependencies to the call.
         deps = set()
         for src in srcs:
-            deps.update(self.scan(src,
-                includes=includes,
-                preprocessor=preprocessor,
-                flags=ocamldep_flags))
+            deps.update(graph.closure(src))
 
         if deps:
             self.ctx.db.add_external_dependencies_to_call(srcs=deps)
@@ -521,6 +779,26 @@ class Builder(fbuild.builders.AbstractCompilerBuilder):
 
         return objs
 
+    def _objects_includes(self, srcs, *, includes, libs, external_libs):
+        """Return the search paths to compile the L{srcs} with."""
+        includes = set(includes)
+
+        # Add the library parents to the search paths
+        includes.update(lib.parent for lib in libs)
+        includes.update(lib.parent for lib in external_libs)
+
+        for src in srcs:
+            parent = src.parent
+            if parent:
+                includes.add(parent)
+                includes.add(parent.addroot(self.ctx.buildroot))
+            else:
+                # We're at the toplevel directory, so just add the buildroot to
+                # the includes.
+                includes.add(self.ctx.buildroot)
+
+        return includes
+
     # --------------------------------------------------------------------------
 
     @fbuild.db.cachemethod
@@ -647,27 +925,16 @@ class BytecodeBuilder(Builder):
             lib_suffix=lib_suffix,
             **kwargs)
 
-    @fbuild.db.cachemethod
-    def scan(self, src:fbuild.db.SRC, *,
-            includes=(),
-            **kwargs) -> fbuild.db.DSTS:
-        """Recursively compute all the source files this ocaml file depends
-        on."""
+    def _scan_edges(self, src, **kwargs):
+        """Bytecode only depends on the interface of a module if it has
+        one."""
         lookup = {}
-        for dep in self.ocamldep.source_dependencies(src,
-                includes=includes,
-                **kwargs):
+        for dep in self.ocamldep.source_dependencies(src, **kwargs):
             base, ext = dep.splitext()
             if ext == '.mli' or base not in lookup:
                 lookup[base] = dep
 
-        deps = set()
-        for dep in lookup.values():
-            deps.add(dep)
-            d = self.scan(dep, includes=includes, **kwargs)
-            deps.update(d)
-
-        return deps
+        return lookup.values()
 
 # ------------------------------------------------------------------------------
 
@@ -736,28 +1003,6 @@ class Ocamlopt(Builder):
 
     # --------------------------------------------------------------------------
 
-    @fbuild.db.cachemethod
-    def scan(self, src:fbuild.db.SRC, *,
-            includes=(),
-            **kwargs) -> fbuild.db.DSTS:
-        """Recursively compute all the source files this ocaml file depends
-        on."""
-        deps = set()
-        def f(src):
-            for dep in self.ocamldep.source_dependencies(src,
-                    includes=includes,
-                    **kwargs):
-                # Don't scan this dependency if we've already scanned it.
-                if dep not in deps:
-                    deps.add(dep)
-                    f(dep)
-
-        f(src)
-
-        return deps
-
-    # --------------------------------------------------------------------------
-
     def _run(self, *args, flags=(), profile=None, profile_flags=None, **kwargs):
         """Add the profile flags if requested."""
         if (profile is None and self.profile) or profile:
@@ -796,6 +1041,14 @@ class Ocamlopt(Builder):
         self.ctx.db.add_external_dependencies_to_call(
             dsts=(dst.replaceext(self.native_obj_suffix),))
 
+    def _compiled_interfaces(self, dep):
+        """ocamlopt also reads the .cmx files of the implementations, since
+        it can inline code across modules."""
+        if dep.endswith('.ml'):
+            return (dep.replaceext('.cmi'), dep.replaceext('.cmx'))
+        else:
+            return (dep.replaceext('.cmi'),)
+
     def _add_link_dependencies(self, dst, srcs, includes, libs):
         super()._add_link_dependencies(dst, srcs, includes, libs)
 
@@ -834,6 +1087,8 @@ class Ocaml(fbuild.builders.AbstractCompilerBuilder):
             make_ocamlopt=Ocamlopt,
             profile=False,
             **kwargs):
+        super().__init__(ctx, src_suffix='.ml')
+
         self.ocamldep = ocamldep or make_ocamldep(ctx)
 
         # ocamlc doesn't take profile flags.
@@ -909,37 +1164,89 @@ class Ocaml(fbuild.builders.AbstractCompilerBuilder):
     # --------------------------------------------------------------------------
 
     def build_objects(self, srcs, *args, **kwargs):
-        """Compile all the L{srcs} in parallel."""
+        """Compile all the L{srcs} in parallel. This returns the bytecode
+        objects followed by the native objects."""
+        objs = self._build_objects(srcs, *args, **kwargs)
+
         return \
-            self.ocamlc.build_objects(srcs, *args, **kwargs) + \
-            self.ocamlopt.build_objects(srcs, *args, **kwargs)
+            [obj.bytecode for obj in objs] + \
+            [obj.native for obj in objs]
 
-    def build_lib(self, *args, **kwargs):
+    def _build_objects(self, srcs, *,
+            includes=(),
+            libs=(),
+            external_libs=(),
+            buildroot=None,
+            ocamldep_flags=(),
+            preprocessor=None,
+            **kwargs):
+        """Compile each of the L{srcs} with both compilers, and return a
+        L{Tuple} of the objects for each. A source is compiled once the
+        sources it depends on have been compiled by both, so the two
+        compilers never write the same .cmi while the other one is reading
+        it."""
+        srcs = [Path(src) for src in srcs]
+        buildroot = buildroot or self.ctx.buildroot
+        includes = self.ocamlc._objects_includes(srcs,
+            includes=includes,
+            libs=[(l[0] if isinstance(l, self.Tuple) else l) for l in libs],
+            external_libs=external_libs)
+
+        self.ocamldep.modules_batch(srcs,
+            preprocessor=preprocessor,
+            flags=ocamldep_flags)
+
+        return self.ctx.scheduler.map_with_dependencies(
+            partial(self.ocamldep.source_dependencies,
+                includes=includes,
+                preprocessor=preprocessor,
+                flags=ocamldep_flags),
+            partial(self.compile,
+                includes=includes,
+                buildroot=buildroot,
+                ocamldep_flags=ocamldep_flags,
+                preprocessor=preprocessor,
+                **kwargs),
+            srcs)
+
+    def build_lib(self, dst, srcs, *args, **kwargs):
         """Compile and link ocaml source files into a bytecode and native
         library."""
-        return self._link(
+        return self._build_link(self.link_lib,
             self.ocamlc.build_lib,
-            self.ocamlopt.build_lib, *args, **kwargs)
+            self.ocamlopt.build_lib, dst, srcs, *args, **kwargs)
 
-    def build_exe(self, *args, **kwargs):
+    def build_exe(self, dst, srcs, *args, **kwargs):
         """Compile and link ocaml source files into a bytecode and native
         executable."""
-        return self._link(
+        return self._build_link(self.link_exe,
             self.ocamlc.build_exe,
-            self.ocamlopt.build_exe, *args, **kwargs)
+            self.ocamlopt.build_exe, dst, srcs, *args, **kwargs)
 
     # --------------------------------------------------------------------------
 
-    def _compile(self, bcompile, ncompile, *args, **kwargs):
+    def _compile(self, bcompile, ncompile, src, *args, **kwargs):
         """Actually compile the source using the bytecode and native
         compilers."""
-        bobj = bcompile(*args, **kwargs)
+        src = Path(src)
 
         if src.endswith('.mli'):
             # We only need to generate the interface once.
-            nobj = bobj
-        else:
-            nobj = ncompile(*args, **kwargs)
+            bobj = bcompile(src, *args, **kwargs)
+            return self.Tuple(bobj, bobj)
+
+        if not src.replaceext('.mli').exists():
+            # Without an interface file, both compilers write the .cmi, so
+            # they can't run at the same time.
+            return self.Tuple(
+                bcompile(src, *args, **kwargs),
+                ncompile(src, *args, **kwargs))
+
+        # Otherwise they only read the .cmi compiled from the interface file,
+        # so run them both at once.
+        bobj, nobj = self.ctx.scheduler.map(
+            lambda compile: compile(src, *args, **kwargs),
+            (bcompile, ncompile))
 
         return self.Tuple(bobj, nobj)
 
@@ -956,15 +1263,101 @@ class Ocaml(fbuild.builders.AbstractCompilerBuilder):
         blibs = [(l[0] if isinstance(l, self.Tuple) else l) for l in libs]
         nlibs = [(l[1] if isinstance(l, self.Tuple) else l) for l in libs]
 
-        blib = blink(dst + '.byte', bsrcs, *args,
-            libs=blibs,
-            custom=custom, **kwargs)
-        nlib = nlink(dst + '.native', nsrcs, *args,
-            libs=nlibs,
-            **kwargs)
+        # The bytecode and native outputs don't share any files, so link them
+        # at the same time.
+        blib, nlib = self.ctx.scheduler.map(lambda link: link(), (
+            partial(blink, dst + '.byte', bsrcs, *args,
+                libs=blibs,
+                custom=custom, **kwargs),
+            partial(nlink, dst + '.native', nsrcs, *args,
+                libs=nlibs,
+                **kwargs)))
 
         return self.Tuple(blib, nlib)
 
+    def _build_link(self, link, bbuild, nbuild, dst, srcs, *,
+            objs=(),
+            pack=None,
+            includes=(),
+            cflags=(),
+            ckwargs={},
+            libs=(),
+            external_libs=(),
+            custom=False,
+            c_libs=(),
+            lflags=(),
+            lkwargs={},
+            flags=(),
+            buildroot=None,
+            **kwargs):
+        """Compile the sources with both compilers, then link them."""
+        if pack is not None:
+            # Packing compiles the sources differently for each compiler, so
+            # let each of them do the whole build. They share .cmi files, so
+            # they have to run one after the other.
+            blib = bbuild(dst + '.byte', srcs,
+                objs=[(o[0] if isinstance(o, self.Tuple) else o)
+                    for o in objs],
+                pack=pack,
+                includes=includes,
+                cflags=cflags,
+                ckwargs=ckwargs,
+                libs=[(l[0] if isinstance(l, self.Tuple) else l)
+                    for l in libs],
+                external_libs=external_libs,
+                custom=custom,
+                c_libs=c_libs,
+                lflags=lflags,
+                lkwargs=lkwargs,
+                flags=flags,
+                buildroot=buildroot,
+                **kwargs)
+            nlib = nbuild(dst + '.native', srcs,
+                objs=[(o[1] if isinstance(o, self.Tuple) else o)
+                    for o in objs],
+                pack=pack,
+                includes=includes,
+                cflags=cflags,
+                ckwargs=ckwargs,
+                libs=[(l[1] if isinstance(l, self.Tuple) else l)
+                    for l in libs],
+                external_libs=external_libs,
+                c_libs=c_libs,
+                lflags=lflags,
+                lkwargs=lkwargs,
+                flags=flags,
+                buildroot=buildroot,
+                **kwargs)
+
+            return self.Tuple(blib, nlib)
+
+        buildroot = buildroot or self.ctx.buildroot
+        includes = set(includes)
+        for lib in libs:
+            if isinstance(lib, self.Tuple):
+                lib = lib.bytecode
+
+            if isinstance(lib, Path):
+                includes.add(lib.parent)
+                includes.add(lib.parent.removeroot(buildroot + os.sep))
+
+        objs = list(objs)
+        objs.extend(self._build_objects(srcs,
+            includes=includes,
+            flags=list(chain(flags, cflags)),
+            buildroot=buildroot,
+            **dict(kwargs, **ckwargs)))
+
+        return link(dst, objs,
+            includes=includes,
+            libs=libs,
+            external_libs=external_libs,
+            custom=custom,
+            c_libs=c_libs,
+            flags=list(chain(flags, lflags)),
+            buildroot=buildroot,
+            **dict(kwargs, **lkwargs))
+
 # ------------------------------------------------------------------------------
 
 class Ocamllex(fbuild.db.PersistentObject):
@@ -1,3 +1,7 @@
+import threading
+import weakref
+from itertools import chain
+
 import fbuild
 import fbuild.builders.java
 from fbuild.path import Path
@@ -73,17 +77,114 @@ class Scalac(AbstractCompiler):
 
 # ------------------------------------------------------------------------------
 
+class CompileServer:
+    """A resident scala compiler that L{Fsc} hands its compiles to. fsc starts
+    the server the first time it's needed, so we just make sure it's answering
+    before the first compile of the build, and stop it when the build is done
+    if we were the ones who started it."""
+
+    def __init__(self, ctx, exe, flags):
+        self.ctx = ctx
+        self.exe = exe
+        self.flags = flags
+        self._lock = threading.Lock()
+        self._running = False
+        self._started = False
+
+    def start(self):
+        """Start the server if it isn't running already."""
+        with self._lock:
+            if self._running:
+                return
+
+            # Resetting the server starts it if it's not up, checks that it
+            # answers, and makes it forget the classes it loaded during an
+            # earlier build, which may have changed since. fsc only says it's
+            # starting a new server when it's verbose.
+            stdout, stderr = self.ctx.execute(
+                list(chain((self.exe,), self.flags, ('-verbose', '-reset'))),
+                self.exe.name, 'starting compile server',
+                quieter=1)
+
+            self._running = True
+
+            # Leave a server that was already up, such as one another build
+            # is using, running.
+            if b'[Executing command:' in stdout + stderr:
+                self._started = True
+                self.ctx.add_cleanup(self.shutdown)
+
+    def shutdown(self):
+        """Stop the server if we started it."""
+        with self._lock:
+            if not self._started:
+                return
+
+            self._running = False
+            self._started = False
+            self.ctx.execute(
+                list(chain((self.exe,), self.flags, ('-shutdown',))),
+                self.exe.name, 'stopping compile server',
+                quieter=1)
+
+
+# The servers are shared by every compiler that uses the same fsc and server
+# flags. They're kept out of the compilers themselves since those are saved in
+# the database.
+_servers = weakref.WeakKeyDictionary()
+_servers_lock = threading.Lock()
+
+class Fsc(Scalac):
+    """Compile with fsc, which hands the compiles to a L{CompileServer}, so
+    we only pay for starting up the JVM and the compiler once per build.
+    I{server_flags} are passed to every fsc call, such as -server or
+    -max-idle."""
+
+    def __init__(self, ctx, exe='fsc', *args, server_flags=[], **kwargs):
+        self.server_flags = server_flags
+
+        super().__init__(ctx, exe, *args, **kwargs)
+
+    def server(self):
+        """Return the compile server this compiler uses."""
+        key = (self.exe, tuple(self.server_flags))
+        with _servers_lock:
+            servers = _servers.setdefault(self.ctx, {})
+            try:
+                return servers[key]
+            except KeyError:
+                server = servers[key] = CompileServer(self.ctx, self.exe,
+                    self.server_flags)
+                return server
+
+    def _run(self, *args, flags=[], **kwargs):
+        self.server().start()
+
+        return super()._run(*args,
+            flags=list(chain(self.server_flags, flags)),
+            **kwargs)
+
+# ------------------------------------------------------------------------------
+
 class Builder(fbuild.builders.java.AbstractBuilder):
     def __init__(self, ctx, *,
-            jar='jar',
+            jar=None,
             java='java',
             scala='scala',
             scalac='scalac',
+            fsc='fsc',
+            compile_server=False,
             **kwargs):
         super().__init__(ctx, jar=jar, java=java, src_suffix='.scala')
 
         self.scala = Scala(ctx, scala)
-        self.scalac = Scalac(ctx, scalac, **kwargs)
+
+        # Optionally compile with a compile server that stays up for the
+        # whole build.
+        if compile_server:
+            self.scalac = Fsc(ctx, fsc, **kwargs)
+        else:
+            self.scalac = Scalac(ctx, scalac, **kwargs)
 
     def where(self):
         """Return the scala library directory."""
@@ -92,6 +193,9 @@ class Builder(fbuild.builders.java.AbstractBuilder):
     def uncached_compile(self, *args, **kwargs):
         return self._run(self.scalac, *args, **kwargs)
 
+    def uncached_compile_batch(self, *args, **kwargs):
+        return self._run_batch(self.scalac, *args, **kwargs)
+
     def run_script(self, src, *args, **kwargs):
         """Run a scala script."""
         return self.scala((src,), *args, **kwargs)
@@ -1,4 +1,4 @@
-import collections
+import collections.abc
 import re
 
 import fbuild
@@ -73,7 +73,7 @@ def autoconf_config_file(ctx, dst, src:fbuild.db.SRC, patterns, *,
         value = patterns[match.group(1)]
         if isinstance(value, str):
             return value
-        elif isinstance(value, collections.Iterable):
+        elif isinstance(value, collections.abc.Iterable):
             return ' '.join(str(v) for v in value)
         return str(value)
 
@@ -112,7 +112,7 @@ def autoconf_config_header(ctx, dst, src:fbuild.db.SRC, patterns, *,
             value = patterns[match.group('sub')]
             if isinstance(value, str):
                 return value
-            elif isinstance(value, collections.Iterable):
+            elif isinstance(value, collections.abc.Iterable):
                 return ' '.join(str(v) for v in value)
             return str(value)
         else:
@@ -130,7 +130,7 @@ def autoconf_config_header(ctx, dst, src:fbuild.db.SRC, patterns, *,
                 value = int(value)
             elif \
                     not isinstance(value, str) and \
-                    isinstance(value, collections.Iterable):
+                    isinstance(value, collections.abc.Iterable):
                 value = ' '.join(str(v) for v in value)
 
             if value:
@@ -1,15 +1,20 @@
 import os
 import signal
+import sys
 import threading
 import time
 
 import fbuild
 import fbuild.builders.platform
 import fbuild.console
+import fbuild.db
 import fbuild.db.database
 import fbuild.path
+import fbuild.remote
 import fbuild.sched
+import fbuild.subprocess.multiplexer
 import fbuild.subprocess.killableprocess
+import fbuild.trace
 
 # ------------------------------------------------------------------------------
 
@@ -25,11 +30,80 @@ class Context:
             threadcount=options.threadcount,
             show_threads=options.show_threads)
 
+        # Record a timeline of the build if we've been asked to.
+        if options.trace:
+            self.tracer = fbuild.trace.Tracer()
+        else:
+            self.tracer = fbuild.trace.NullTracer()
+
         self.db = fbuild.db.database.Database(self,
             engine=options.database_engine,
-            explain=options.explain_database)
-        self.scheduler = fbuild.sched.Scheduler(options.threadcount,
-            logger=self.logger)
+            explain=options.explain_database,
+            tracer=self.tracer)
+        # A thread that's waiting on a command runs other tasks in the
+        # meantime, so we only need enough threads to keep the processors
+        # busy, along with enough to run all the jobs without stacking too
+        # many tasks on one thread. Windows runs the commands in the thread
+        # that waits for them though, so it needs a thread for every job.
+        jobs = max(1, options.threadcount)
+        if sys.platform == 'win32':
+            threadcount = jobs
+        else:
+            threadcount = min(jobs, max(os.cpu_count() or 1,
+                -(-jobs // fbuild.sched.Scheduler.max_wait_depth)))
+
+        # Connect to the remote workers. The scheduler gets a thread and a
+        # job for each of their job slots.
+        if options.remote_workers:
+            self.remote = fbuild.remote.Pool(options.remote_workers,
+                secret=fbuild.remote.read_secret(options.remote_secret_file),
+                logger=self.logger)
+            remote_slots = self.remote.slots
+        else:
+            self.remote = None
+            remote_slots = 0
+
+        self.scheduler = fbuild.sched.Scheduler(threadcount + remote_slots,
+            jobs=jobs + remote_slots,
+            logger=self.logger,
+            keep_going=options.keep_going,
+            jobserver=options.jobserver,
+            tracer=self.tracer)
+
+        # Make sure we don't run more than the requested number of jobs
+        # locally, or as many as make lets us run.
+        self._local_slots = threading.Semaphore(
+            self.scheduler.jobs - remote_slots)
+
+        # Let any makes we run share our job slots. Like make, we export
+        # MAKEFLAGS, so that commands that don't need anything else changed
+        # can still inherit our environment.
+        self._old_makeflags = os.environ.get('MAKEFLAGS')
+        self._exported_makeflags = False
+        jobserver = self.scheduler.jobserver
+        if jobserver is not None:
+            makeflags = jobserver.makeflags(self._old_makeflags or '')
+            if makeflags != self._old_makeflags:
+                os.environ['MAKEFLAGS'] = makeflags
+                self._exported_makeflags = True
+
+        # Watch the pipes, exits and timeouts of the running commands from one
+        # event loop thread. Windows can't wait on pipes with an event loop
+        # though, so it runs the commands entirely in the calling thread.
+        if sys.platform == 'win32':
+            self.multiplexer = None
+        else:
+            self.multiplexer = fbuild.subprocess.multiplexer.Multiplexer()
+            self.multiplexer.start()
+
+        # The variables we've computed for running commands with.
+        self._environments = {}
+
+        # The functions to call once the build is done, such as the ones that
+        # stop the servers the builders started.
+        self._cleanups = []
+        self._cleanups_lock = threading.Lock()
+        self._shut_down = False
 
         self.options = options
         self.args = args
@@ -69,6 +143,64 @@ class Context:
             finally:
                 signal.signal(signal.SIGINT, prev_handler)
 
+    def shutdown(self, *, wait=True):
+        """Stop everything the build started and save the database. The
+        scheduler's threads are only stopped if I{wait} is true, since we
+        can't reliably stop them after a KeyboardInterrupt. Shutting down a
+        context that's already shut down does nothing."""
+
+        if self._shut_down:
+            return
+        self._shut_down = True
+
+        if wait:
+            self.scheduler.shutdown()
+
+        try:
+            # Stop anything the builders left running. This can run
+            # commands, so it needs to happen before the multiplexer goes away.
+            self.cleanup()
+
+            self.save_configuration()
+            self.db.shutdown()
+
+            if self.options.trace:
+                self.tracer.save(self.options.trace)
+        finally:
+            if self._exported_makeflags:
+                if self._old_makeflags is None:
+                    del os.environ['MAKEFLAGS']
+                else:
+                    os.environ['MAKEFLAGS'] = self._old_makeflags
+
+            if self.remote is not None:
+                self.remote.close()
+
+            if self.multiplexer is not None:
+                self.multiplexer.shutdown()
+
+            if self.logger.file is not None:
+                self.logger.file.close()
+
+    def add_cleanup(self, function, *args, **kwargs):
+        """Call I{function} with the arguments when the build is done."""
+        with self._cleanups_lock:
+            self._cleanups.append((function, args, kwargs))
+
+    def cleanup(self):
+        """Call the cleanup functions in the reverse order they were added.
+        A failing cleanup is logged so that the rest still run."""
+        while True:
+            with self._cleanups_lock:
+                if not self._cleanups:
+                    return
+                function, args, kwargs = self._cleanups.pop()
+
+            try:
+                function(*args, **kwargs)
+            except Exception as e:
+                self.logger.log('cleanup failed: %s' % e, color='red')
+
     # --------------------------------------------------------------------------
     # Logging wrapper functions
 
@@ -99,8 +231,21 @@ class Context:
             timeout=None,
             env=None,
             runtime_libpaths=None,
+            inputs=None,
+            outputs=None,
+            stdout_hook=None,
+            stderr_hook=None,
+            output_limit=None,
             **kwargs):
-        """Execute the command and return the output."""
+        """Execute the command and return the output. If the I{inputs} and
+        I{outputs} files of the command are specified, the command may be run
+        on a remote worker.
+
+        The I{stdout_hook} and I{stderr_hook} are called with each line of the
+        output as it arrives. If there's an I{output_limit}, only that many
+        bytes from the end of each output are kept and returned. Larger
+        outputs are saved in full to a file in the buildroot, which is kept
+        if the command fails."""
 
         if isinstance(cmd, str):
             cmd_string = cmd
@@ -113,28 +258,13 @@ class Context:
         if stderr_quieter is None:
             stderr_quieter = quieter
 
-        # Windows needs something in the environment, so for the moment we'll
-        # just make sure everything is passed on to the executable.
-        if env is None:
-            env = dict(os.environ)
-        else:
-            env = dict(os.environ, **env)
-
-        # Add in the runtime library search paths.
-        if runtime_libpaths:
-            # Look up the current architecture
-            runtime_env_libpath = \
-                fbuild.builders.platform.runtime_env_libpath(self)
-
-            runtime_libpaths = os.pathsep.join(runtime_libpaths)
-            try:
-                libpaths = env[runtime_env_libpath]
-            except KeyError:
-                libpaths = runtime_libpaths
-            else:
-                libpaths += os.pathsep + runtime_libpaths
+        env = self._environment(env, runtime_libpaths)
 
-            env[runtime_env_libpath] = libpaths
+        # Let any makes we run share our job slots.
+        jobserver = self.scheduler.jobserver
+        if jobserver is not None and jobserver.pass_fds:
+            kwargs['pass_fds'] = \
+                tuple(kwargs.get('pass_fds', ())) + jobserver.pass_fds
 
         self.logger.write('%-10s: starting %r\n' %
             (threading.current_thread().name, cmd_string),
@@ -151,51 +281,118 @@ class Context:
                     color=color,
                     verbose=quieter)
 
-        # Define a function that gets called if execution times out. We will
-        # raise an exception if the timeout occurs.
-        if timeout:
-            timed_out = False
-            def timeout_function(p):
-                nonlocal timed_out
-                timed_out = True
-                p.kill(group=True)
-
-            # Set the timer to None for now to make sure it's defined.
-            timer = None
+        if stdout_hook is None and \
+                stderr_hook is None and \
+                output_limit is None:
+            buffers = None
+        else:
+            spill_dir = self.buildroot / 'output'
+            buffers = (
+                fbuild.subprocess.multiplexer.OutputBuffer(
+                    hook=stdout_hook,
+                    limit=output_limit,
+                    spill_dir=spill_dir,
+                    suffix='.stdout'),
+                fbuild.subprocess.multiplexer.OutputBuffer(
+                    hook=stderr_hook,
+                    limit=output_limit,
+                    spill_dir=spill_dir,
+                    suffix='.stderr'))
 
         starttime = time.time()
+        finished = False
         try:
-            p = fbuild.subprocess.killableprocess.Popen(cmd,
-                stdin=fbuild.subprocess.PIPE if input else stdin,
-                stdout=stdout,
-                stderr=stderr,
-                env=env,
-                **kwargs)
-
-            try:
-                if timeout:
-                    timer = threading.Timer(timeout, timeout_function, (p,))
-                    timer.start()
-
-                stdout, stderr = p.communicate(input)
-                returncode = p.wait()
-            except KeyboardInterrupt:
-                # Make sure if we get a keyboard interrupt to kill the process.
-                p.kill(group=True)
-                raise
+            if isinstance(cmd, str):
+                trace_name = cmd.split(None, 1)[0] if cmd.strip() else cmd
             else:
-                # Detect Ctrl-C in subprocess.
-                if returncode == -signal.SIGINT:
-                    raise KeyboardInterrupt
+                trace_name = os.path.basename(str(cmd[0]))
+
+            with self.tracer.span(trace_name, 'execute',
+                    cmd=cmd_string) as trace_args:
+                # Try to run the command remotely if it's self contained.
+                result = None
+                if self.remote is not None and \
+                        inputs is not None and \
+                        outputs is not None and \
+                        input is None and \
+                        stdin is None:
+                    result = self.remote.execute(cmd,
+                        inputs=inputs,
+                        outputs=outputs,
+                        cwd=kwargs.get('cwd'),
+                        timeout=timeout)
+                    trace_args['remote'] = result is not None
+
+                # The multiplexer streams the output into the buffers, but
+                # everything else gives us the output all at once.
+                streamed = False
+                if result is None:
+                    # The job slot is given back as soon as the command
+                    # exits, since this thread may be busy running another
+                    # task by then.
+                    slot = threading.Lock()
+                    def release_slot():
+                        if slot.acquire(blocking=False):
+                            self._local_slots.release()
+
+                    if self.multiplexer is None:
+                        execute = self._popen
+                    else:
+                        execute = self.multiplexer.execute
+                        kwargs['wait'] = self.scheduler.wait
+                        kwargs['on_exit'] = release_slot
+                        if buffers is not None:
+                            kwargs['stdout_buffer'], \
+                                kwargs['stderr_buffer'] = buffers
+                            streamed = True
+
+                    self._local_slots.acquire()
+                    try:
+                        result = execute(cmd,
+                            input=input,
+                            stdin=stdin,
+                            stdout=stdout,
+                            stderr=stderr,
+                            timeout=timeout,
+                            env=env,
+                            **kwargs)
+                    finally:
+                        release_slot()
+
+                returncode, stdout, stderr, timed_out = result
+                trace_args['returncode'] = returncode
+
+                if buffers is not None and not streamed:
+                    stdout, stderr = [self._buffer(buffer, output)
+                        for buffer, output in zip(buffers, (stdout, stderr))]
+
+            # Detect Ctrl-C in subprocess.
+            if returncode == -signal.SIGINT:
+                raise KeyboardInterrupt
+
+            finished = True
         except OSError as e:
             # flush the logger
             self.logger.log('command failed: ' + cmd_string, color='red')
             raise e from e
         finally:
-            if timeout and timer is not None:
-                timer.cancel()
+            # We don't need the full output of a command that didn't finish.
+            if not finished and buffers is not None:
+                for buffer in buffers:
+                    buffer.discard()
         endtime = time.time()
 
+        # Only the local multiplexer knows how much the command used.
+        usage = getattr(result, 'usage', None)
+        if usage is None:
+            usage = (None, None, None)
+
+        self.db.add_command_to_call(fbuild.db.Command(cmd_string,
+            str(msg1) if msg1 else trace_name,
+            returncode,
+            endtime - starttime,
+            *usage))
+
         if returncode:
             self.logger.log(' + ' + cmd_string, verbose=quieter)
         else:
@@ -215,17 +412,149 @@ class Context:
             except UnicodeDecodeError:
                 self.logger.log(repr(stderr.rstrip()), verbose=stderr_quieter)
 
-        self.logger.log(
-            ' - exit %d, %.2f sec' % (returncode, endtime - starttime),
-            verbose=2)
-
-        if timeout and timed_out:
+        if usage[0] is None:
+            self.logger.log(
+                ' - exit %d, %.2f sec' % (returncode, endtime - starttime),
+                verbose=2)
+        else:
+            self.logger.log(
+                ' - exit %d, %.2f sec, %.2f user, %.2f sys, %d KB max rss' % (
+                    (returncode, endtime - starttime) + tuple(usage)),
+                verbose=2)
+
+        # Only keep the full output around if we might need to look at it.
+        if buffers is not None:
+            for buffer in buffers:
+                if buffer.spill_file is None:
+                    continue
+
+                if timed_out or returncode:
+                    self.logger.log(' - full output saved in ' +
+                        buffer.spill_file, verbose=quieter)
+                else:
+                    buffer.discard()
+
+        if timed_out:
             raise fbuild.ExecutionTimedOut(cmd, stdout, stderr, returncode)
         elif returncode:
             raise fbuild.ExecutionError(cmd, stdout, stderr, returncode)
 
         return stdout, stderr
 
+    def _environment(self, env, runtime_libpaths):
+        """Return the environment to run a command in, or None if it can
+        inherit ours. Only the variables the command changes are cached, and
+        they're applied to I{os.environ} as it is now, so changes to it are
+        always seen."""
+
+        if runtime_libpaths:
+            runtime_env_libpath = \
+                fbuild.builders.platform.runtime_env_libpath(self)
+        else:
+            runtime_env_libpath = None
+
+        # The variables depend on the library search path and MAKEFLAGS we
+        # were run with.
+        key = (
+            tuple(sorted(env.items())) if env else (),
+            tuple(runtime_libpaths or ()),
+            runtime_env_libpath and os.environ.get(runtime_env_libpath),
+            os.environ.get('MAKEFLAGS'))
+
+        try:
+            variables = self._environments[key]
+        except KeyError:
+            variables = self._environments[key] = self._environment_variables(
+                env, runtime_env_libpath, runtime_libpaths)
+
+        # Don't pass an environment at all if it's the same as ours, since
+        # then the new process doesn't need to copy it.
+        if all(os.environ.get(k) == v for k, v in variables.items()):
+            return None
+
+        new_env = dict(os.environ)
+        new_env.update(variables)
+
+        return new_env
+
+    def _environment_variables(self, env, runtime_env_libpath,
+            runtime_libpaths):
+        """Return the variables a command's environment needs on top of
+        ours."""
+
+        variables = dict(env) if env else {}
+
+        # Add in the runtime library search paths.
+        if runtime_libpaths:
+            runtime_libpaths = os.pathsep.join(runtime_libpaths)
+            try:
+                libpaths = variables[runtime_env_libpath]
+            except KeyError:
+                libpaths = os.environ.get(runtime_env_libpath)
+
+            if libpaths:
+                libpaths += os.pathsep + runtime_libpaths
+            else:
+                libpaths = runtime_libpaths
+
+            variables[runtime_env_libpath] = libpaths
+
+        # We export our job slots in MAKEFLAGS, so they need to be added back
+        # if the command replaces it.
+        jobserver = self.scheduler.jobserver
+        if jobserver is not None and 'MAKEFLAGS' in variables:
+            variables['MAKEFLAGS'] = jobserver.makeflags(
+                variables['MAKEFLAGS'])
+
+        return variables
+
+    def _buffer(self, buffer, output):
+        """Pass output we got all at once through the buffer."""
+
+        if output is None:
+            return None
+
+        buffer.feed(output)
+        return buffer.close()
+
+    def _popen(self, cmd, *, input, stdin, stdout, stderr, timeout, **kwargs):
+        """Run the command in this thread. Returns the exit code, the stdout
+        and stderr output, and whether or not the command timed out."""
+
+        # Define a function that gets called if execution times out. We will
+        # raise an exception if the timeout occurs.
+        timed_out = False
+        def timeout_function(p):
+            nonlocal timed_out
+            timed_out = True
+            p.kill(group=True)
+
+        # Set the timer to None for now to make sure it's defined.
+        timer = None
+
+        p = fbuild.subprocess.killableprocess.Popen(cmd,
+            stdin=fbuild.subprocess.PIPE if input else stdin,
+            stdout=stdout,
+            stderr=stderr,
+            **kwargs)
+
+        try:
+            if timeout:
+                timer = threading.Timer(timeout, timeout_function, (p,))
+                timer.start()
+
+            stdout, stderr = p.communicate(input)
+            returncode = p.wait()
+        except KeyboardInterrupt:
+            # Make sure if we get a keyboard interrupt to kill the process.
+            p.kill(group=True)
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        return returncode, stdout, stderr, timed_out
+
 # ------------------------------------------------------------------------------
 
 def make_default_context(args=[]):
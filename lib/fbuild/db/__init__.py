@@ -1,4 +1,5 @@
 import abc
+import collections
 import functools
 import types
 
@@ -56,6 +57,15 @@ class OPTIONAL_DST(DST):
 
 # ------------------------------------------------------------------------------
 
+class Command(collections.namedtuple('Command',
+        'cmd builder returncode seconds user_time system_time max_rss')):
+    """A record of a command that a cached call ran. The I{user_time} and
+    I{system_time} are the CPU seconds the command used, and I{max_rss} is its
+    peak memory use in kilobytes. They're None if the command ran somewhere we
+    couldn't measure it."""
+
+# ------------------------------------------------------------------------------
+
 class PersistentMeta(abc.ABCMeta):
     """A metaclass that searches the db for an already instantiated class with
     the same arguments.  It subclasses from ABCMeta so that subclasses can
@@ -124,6 +134,9 @@ class caches:
     def call(self, ctx, *args, **kwargs):
         return ctx.db.call(self.function, ctx, *args, **kwargs)
 
+    def prepare(self, ctx, *args, **kwargs):
+        return ctx.db.prepare(self.function, ctx, *args, **kwargs)
+
 
 class cachemethod:
     """L{cachemethod} decorates a method of a class to cache the results.
@@ -165,6 +178,10 @@ class cachemethod_wrapper:
     def call(self, *args, **kwargs):
         return self.method.__self__.ctx.db.call(self.method, *args, **kwargs)
 
+    def prepare(self, *args, **kwargs):
+        return self.method.__self__.ctx.db.prepare(self.method,
+            *args, **kwargs)
+
 
 class cacheproperty:
     """L{cacheproperty} acts like a normal I{property} but will memoize the
@@ -199,3 +216,48 @@ class cacheproperty:
 
     def call(self, instance):
         return instance.ctx.db.call(types.MethodType(self.method, instance))
+
+# ------------------------------------------------------------------------------
+
+def call_batched(function, srcs, run, complete=None, **kwargs):
+    """Call the cached I{function} on each of the I{srcs}, but compute the
+    results of the calls that are out of date all together with I{run}, which
+    takes a list of srcs and returns a dictionary of their results. Each
+    result is still cached under its own call, so a later build only redoes
+    the srcs that changed. If I{complete} is given, it's called with each src
+    and its result from I{run} inside the src's own call, so it can add
+    dependencies to it, and it returns the result to cache. Returns the
+    results in the order of the srcs."""
+
+    results = {}
+    dirty = {}
+    for src in srcs:
+        prepared = function.prepare(src, **kwargs)
+        if prepared.dirty:
+            dirty[src] = prepared
+        else:
+            results[src] = prepared.result
+
+    if dirty:
+        for src, (result, _, _) in run_batched(dirty, run, complete).items():
+            results[src] = result
+
+    return [results[src] for src in srcs]
+
+
+def run_batched(calls, run, complete=None):
+    """Compute the results of the dirty prepared I{calls}, which are keyed by
+    their src, all together with I{run}, and cache each one under its own
+    call like L{call_batched}. Returns a dictionary of the result, src
+    dependencies, and dst dependencies of each call."""
+
+    batch_results = run(list(calls))
+
+    if complete is None:
+        complete = lambda src, result: result
+
+    results = {}
+    for src, prepared in calls.items():
+        results[src] = prepared.complete(complete, src, batch_results[src])
+
+    return results
@@ -72,7 +72,8 @@ class Backend:
             result,
             call_file_digests,
             external_srcs,
-            external_dsts):
+            external_dsts,
+            commands=()):
         """Saves the function call into the database."""
 
         # Lock the db since we're updating data structures.
@@ -86,14 +87,17 @@ class Backend:
 
             fun_id = self.save_function(fun_id, fun_name, fun_digest)
 
-        # Get the real call_id to use in the call files.
-        if call_dirty:
-            call_id = self.save_call(call_id, fun_id, bound, result)
+        # Get the real call_id to use in the call files. Save the result even
+        # if we've seen these arguments before, since a call that reran because
+        # its files changed may have returned something else.
+        call_id = self.save_call(call_id, fun_id, bound, result)
 
         self.save_call_files(call_id, call_file_digests)
 
         self.save_external_files(call_id, external_srcs, external_dsts)
 
+        self.save_call_commands(call_id, commands)
+
     # --------------------------------------------------------------------------
 
     def check_function(self, fun_name, fun_digest):
@@ -237,6 +241,18 @@ class Backend:
 
     # --------------------------------------------------------------------------
 
+    def find_commands(self):
+        """Returns the function name and command record of every command the
+        calls ran."""
+        raise NotImplementedError
+
+
+    def save_call_commands(self, call_id, commands):
+        """Replace the commands the call ran."""
+        raise NotImplementedError
+
+    # --------------------------------------------------------------------------
+
     def add_file(self, file_name):
         """Insert or update the file information. Returns True if the content
         of the file is different from what was in the table."""
@@ -3,8 +3,9 @@ import fbuild.db.backend
 # ------------------------------------------------------------------------------
 
 class CacheBackend(fbuild.db.backend.Backend):
-    def connect(self):
-        """Create the database cache."""
+    def connect(self, filename=None):
+        """Create the database cache. The cache isn't saved, so the
+        filename is ignored."""
 
         self._functions = {}
         self._function_calls = {}
@@ -12,6 +13,7 @@ class CacheBackend(fbuild.db.backend.Backend):
         self._call_files = {}
         self._external_srcs = {}
         self._external_dsts = {}
+        self._call_commands = {}
 
     def close(self):
         """Clear the database cache."""
@@ -22,6 +24,7 @@ class CacheBackend(fbuild.db.backend.Backend):
         del self._call_files
         del self._external_srcs
         del self._external_dsts
+        del self._call_commands
 
     # --------------------------------------------------------------------------
 
@@ -97,6 +100,13 @@ class CacheBackend(fbuild.db.backend.Backend):
         else:
             function_existed |= True
 
+        try:
+            del self._call_commands[fun_name]
+        except KeyError:
+            pass
+        else:
+            function_existed |= True
+
         # Since _call_files is indexed by filename, we need to search through
         # each item and delete any references to this function. The assumption
         # is that the files will change much less frequently compared to
@@ -296,6 +306,41 @@ class CacheBackend(fbuild.db.backend.Backend):
 
     # --------------------------------------------------------------------------
 
+    def find_commands(self):
+        """Returns the function name and command record of every command the
+        calls ran."""
+
+        commands = []
+        for fun_name, calls in self._call_commands.items():
+            for call_index, call_commands in calls.items():
+                commands.extend((fun_name, c) for c in call_commands)
+
+        return commands
+
+
+    def save_call_commands(self, call_id, commands):
+        """Replace the commands the call ran."""
+
+        # Make sure we got the right types.
+        assert isinstance(call_id, tuple), call_id
+
+        # Extract out the real fun_name and call_id
+        fun_name, call_index = call_id
+
+        assert isinstance(fun_name, str), fun_name
+        assert isinstance(call_index, int), call_index
+
+        if commands:
+            self._call_commands.setdefault(fun_name, {})[call_index] = \
+                tuple(commands)
+        else:
+            try:
+                del self._call_commands[fun_name][call_index]
+            except KeyError:
+                pass
+
+    # --------------------------------------------------------------------------
+
     def find_file(self, file_name):
         """Returns the mtime and digest of the file, or None if it does not
         exist."""
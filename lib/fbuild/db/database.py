@@ -1,3 +1,4 @@
+import collections
 import hashlib
 import itertools
 import pprint
@@ -8,6 +9,8 @@ import fbuild.functools
 import fbuild.inspect
 import fbuild.path
 import fbuild.rpc
+import fbuild.sched
+import fbuild.trace
 
 import fbuild.db
 import fbuild.db.pickle_backend
@@ -19,14 +22,26 @@ import fbuild.db.sqlite_backend
 class Database:
     """L{Database} persistently stores the results of argument calls."""
 
-    def __init__(self, ctx, *, engine, explain=False):
+    def __init__(self, ctx, *, engine, explain=False, tracer=None):
+        if tracer is None:
+            tracer = fbuild.trace.NullTracer()
+
         def handle_rpc(method, *args, **kwargs):
-            return method(*args, **kwargs)
+            with tracer.span(method.__name__, 'rpc'):
+                return method(*args, **kwargs)
 
         self._ctx = ctx
         self._explain = explain
+        self._tracer = tracer
         self._connected = False
 
+        # The cached calls each thread is running, innermost last.
+        self._calls = threading.local()
+
+        # The commands the calls ran in this build.
+        self._build_commands = []
+        self._build_commands_lock = threading.Lock()
+
         if engine == 'pickle':
             self._backend = fbuild.db.pickle_backend.PickleBackend(self._ctx)
         elif engine == 'cache':
@@ -71,6 +86,17 @@ class Database:
         "srcs" are also modified.  Finally, if any of the filenames in "dsts"
         do not exist, re-run the function no matter what."""
 
+        prepared = self.prepare(function, *args, **kwargs)
+        if not prepared.dirty:
+            return prepared.result, prepared.all_srcs, prepared.all_dsts
+
+        return prepared.run()
+
+    def prepare(self, function, *args, **kwargs):
+        """Check if the call of the function is up to date without running
+        it. Returns a L{PreparedCall}, which holds the cached result, src
+        dependencies and dst dependencies if the call isn't dirty."""
+
         # Make sure none of the arguments are a generator.
         assert all(not fbuild.inspect.isgenerator(arg)
             for arg in itertools.chain(args, kwargs.values())), \
@@ -90,15 +116,20 @@ class Database:
             args,
             kwargs)
 
-        fun_dirty, fun_id, call_dirty, call_id, old_result, call_file_digests, \
-            external_srcs, external_dsts, external_digests = \
-                self._rpc.call(self._backend.prepare,
+        with self._tracer.span('prepare', 'db', function=fun_name):
+            fun_dirty, fun_id, call_dirty, call_id, old_result, \
+                call_file_digests, external_srcs, external_dsts, \
+                external_digests = self._rpc.call(self._backend.prepare,
                     fun_name,
                     fun_digest,
                     call_bound,
                     srcs,
                     dsts)
 
+        prepared = PreparedCall(self, fun_name, function, args, kwargs,
+            fun_digest, fun_dirty, fun_id, call_bound, call_dirty, call_id,
+            call_file_digests, srcs, dsts, return_type, old_result)
+
         dirty_dsts = set()
 
         # Check if we have a result. If not, then we're dirty.
@@ -123,10 +154,12 @@ class Database:
                     break
             else:
                 # The call was not dirty, so return the cached value.
-                all_srcs = srcs.union(external_srcs)
-                all_dsts = dsts.union(external_dsts)
-                all_dsts.update(return_dsts)
-                return old_result, all_srcs, all_dsts
+                prepared.dirty = False
+                prepared.result = old_result
+                prepared.all_srcs = srcs.union(external_srcs)
+                prepared.all_dsts = dsts.union(external_dsts)
+                prepared.all_dsts.update(return_dsts)
+                return prepared
 
         if self._explain:
             # Explain why we are going to run the function.
@@ -153,31 +186,54 @@ class Database:
                 for dst in dirty_dsts:
                     self._ctx.logger.log('\t%s' % dst)
 
-        # Clear external srcs and dsts since they'll be recomputed inside
-        # the function.
+        return prepared
+
+    def complete(self, prepared, function, *args, **kwargs):
+        """Compute the result of the L{PreparedCall} by calling I{function}
+        with the arguments, and cache it as the result of the prepared call,
+        even if the call was up to date. The function can add external
+        dependencies to the call. Returns the result, src dependencies, and
+        dst dependencies."""
+
+        # The external srcs and dsts are recomputed inside the function, along
+        # with the commands the function runs.
         external_srcs = set()
         external_dsts = set()
+        commands = []
 
-        # The call was dirty, so recompute it.
-        call_result = function(*args, **kwargs)
+        stack = self._call_stack()
+        stack.append(_Call(fbuild.sched.current_task(),
+            external_srcs, external_dsts, commands))
+        try:
+            with self._tracer.span(prepared.fun_name, 'db'):
+                call_result = function(*args, **kwargs)
+        finally:
+            stack.pop()
 
         # Make sure the result is not a generator.
         assert not fbuild.inspect.isgenerator(call_result), \
             "Cannot store generator in database"
 
         # Save the results in the database.
-        self._rpc.call(self._backend.cache,
-            fun_dirty, fun_id, fun_name, fun_digest,
-            call_dirty, call_id, call_bound, call_result,
-            call_file_digests, external_srcs, external_dsts)
-
+        with self._tracer.span('cache', 'db', function=prepared.fun_name):
+            self._rpc.call(self._backend.cache,
+                prepared.fun_dirty, prepared.fun_id, prepared.fun_name,
+                prepared.fun_digest, prepared.call_dirty, prepared.call_id,
+                prepared.call_bound, call_result, prepared.call_file_digests,
+                external_srcs, external_dsts, commands)
+
+        with self._build_commands_lock:
+            self._build_commands.extend(
+                (prepared.fun_name, c) for c in commands)
+
+        return_type = prepared.return_type
         if return_type is not None and issubclass(return_type, fbuild.db.DST):
             return_dsts = return_type.convert(call_result)
         else:
             return_dsts = ()
 
-        all_srcs = srcs.union(external_srcs)
-        all_dsts = dsts.union(external_dsts)
+        all_srcs = prepared.srcs.union(external_srcs)
+        all_dsts = prepared.dsts.union(external_dsts)
         all_dsts.update(return_dsts)
         return call_result, all_srcs, all_dsts
 
@@ -191,6 +247,17 @@ class Database:
 
         return self._rpc.call(self._backend.delete_file, file_name)
 
+    def find_commands(self, *, this_build=False):
+        """Return a list of the function names and L{fbuild.db.Command}s of
+        every command the cached calls ran. If I{this_build} is true, only
+        return the commands of the calls that ran in this build."""
+
+        if this_build:
+            with self._build_commands_lock:
+                return list(self._build_commands)
+
+        return self._rpc.call(self._backend.find_commands)
+
     def dump_database(self):
         """Print the database."""
         pprint.pprint(self._backend.__dict__)
@@ -275,21 +342,90 @@ class Database:
 
     def add_external_dependencies_to_call(self, *, srcs=(), dsts=()):
         """When inside a cached method, register additional src
-        dependencies for the call. This function can only be called from
-        a cached function and will error out if it is called from an
-        uncached function."""
-
-        # Hack in additional dependencies
-        frame = fbuild.inspect.currentframe()
+        dependencies for the call, and the calls it was made from. This is
+        ignored outside of a cached function."""
+
+        for call in self._current_calls():
+            call.external_srcs.update(srcs)
+            call.external_dsts.update(dsts)
+
+    def add_command_to_call(self, command):
+        """When inside a cached method, record the L{fbuild.db.Command} the
+        call ran. Commands run outside of a cached function are ignored."""
+
+        # Only the innermost call ran the command.
+        for call in self._current_calls():
+            call.commands.append(command)
+            break
+
+    def _call_stack(self):
+        """Return the stack of the cached calls this thread is running."""
+        try:
+            return self._calls.stack
+        except AttributeError:
+            stack = self._calls.stack = []
+            return stack
+
+    def _current_calls(self):
+        """Yield the cached calls the current task is running, innermost
+        first. The thread may be running other tasks' calls underneath them
+        while it waits on a nested evaluation, but those didn't make this
+        call."""
+        task = fbuild.sched.current_task()
+        for call in reversed(self._call_stack()):
+            if call.task is not task:
+                break
+            yield call
 
-        if frame is None:
-            return
+# ------------------------------------------------------------------------------
 
-        frame = frame.f_back
+class PreparedCall:
+    """A call of a cached function that L{Database.prepare} checked against
+    the database. I{srcs} and I{dsts} are the ones in the call's arguments,
+    and I{old_result} is the result the database has for the call, if any. If
+    the call isn't I{dirty}, I{result}, I{all_srcs} and I{all_dsts} are the
+    cached result, src dependencies and dst dependencies."""
+
+    def __init__(self, db, fun_name, function, args, kwargs,
+            fun_digest, fun_dirty, fun_id,
+            call_bound, call_dirty, call_id, call_file_digests,
+            srcs, dsts, return_type, old_result):
+        self.db = db
+        self.fun_name = fun_name
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.fun_digest = fun_digest
+        self.fun_dirty = fun_dirty
+        self.fun_id = fun_id
+        self.call_bound = call_bound
+        self.call_dirty = call_dirty
+        self.call_id = call_id
+        self.call_file_digests = call_file_digests
+        self.srcs = srcs
+        self.dsts = dsts
+        self.return_type = return_type
+        self.old_result = old_result
+
+        self.dirty = True
+        self.result = None
+        self.all_srcs = None
+        self.all_dsts = None
+
+    def run(self):
+        """Run the call and cache its result. Returns the result, src
+        dependencies, and dst dependencies."""
+        return self.complete(self.function, *self.args, **self.kwargs)
+
+    def complete(self, function, *args, **kwargs):
+        """Cache the result of calling I{function} with the arguments as the
+        result of the call. Returns the result, src dependencies, and dst
+        dependencies."""
+        return self.db.complete(self, function, *args, **kwargs)
 
-        while frame:
-            if frame.f_code == self.call.__code__:
-                frame.f_locals['external_srcs'].update(srcs)
-                frame.f_locals['external_dsts'].update(dsts)
+# ------------------------------------------------------------------------------
 
-            frame = frame.f_back
+class _Call(collections.namedtuple('_Call',
+        'task external_srcs external_dsts commands')):
+    """A cached call that's running, and what it's found out about itself
+    so far."""
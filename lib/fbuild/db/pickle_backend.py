@@ -18,7 +18,10 @@ class PickleBackend(fbuild.db.cache_backend.CacheBackend):
 
                 self._functions, self._function_calls, self._files, \
                     self._call_files, self._external_srcs, \
-                    self._external_dsts = unpickler.load()
+                    self._external_dsts, *rest = unpickler.load()
+
+            # Older state files didn't record the commands.
+            self._call_commands = rest[0] if rest else {}
         else:
             super().connect()
 
@@ -35,7 +38,8 @@ class PickleBackend(fbuild.db.cache_backend.CacheBackend):
             self._files,
             self._call_files,
             self._external_srcs,
-            self._external_dsts))
+            self._external_dsts,
+            self._call_commands))
 
         s = f.getvalue()
 
@@ -105,6 +105,20 @@ class SqliteBackend(fbuild.db.backend.Backend):
                     ON DELETE CASCADE
                     ON UPDATE CASCADE,
                 PRIMARY KEY (call_id, file_id));
+
+            CREATE TABLE IF NOT EXISTS CallCommand (
+                call_id INTEGER REFERENCES Call(call_id)
+                    ON DELETE CASCADE
+                    ON UPDATE CASCADE,
+                command_index INTEGER,
+                cmd TEXT,
+                builder TEXT,
+                returncode INTEGER,
+                seconds REAL,
+                user_time REAL,
+                system_time REAL,
+                max_rss INTEGER,
+                PRIMARY KEY (call_id, command_index));
             ''')
 
     # --------------------------------------------------------------------------
@@ -185,6 +199,10 @@ class SqliteBackend(fbuild.db.backend.Backend):
                 'DELETE FROM ExternalDst WHERE call_id=?',
                 (call_id,))
 
+            self.cursor.execute(
+                'DELETE FROM CallCommand WHERE call_id=?',
+                (call_id,))
+
         self.cursor.execute(
             'DELETE FROM Function WHERE fun_name=?',
             (fun_name,))
@@ -426,6 +444,40 @@ class SqliteBackend(fbuild.db.backend.Backend):
 
     # --------------------------------------------------------------------------
 
+    def find_commands(self):
+        """Returns the function name and command record of every command the
+        calls ran."""
+
+        return [(fun_name, fbuild.db.Command(*row))
+            for fun_name, *row in self.cursor.execute('''
+                SELECT fun_name, cmd, builder, returncode, seconds,
+                    user_time, system_time, max_rss
+                FROM CallCommand
+                JOIN Call USING (call_id)
+                JOIN Function USING (fun_id)
+                ORDER BY call_id, command_index
+                ''').fetchall()]
+
+
+    def save_call_commands(self, call_id, commands):
+        """Replace the commands the call ran."""
+
+        # Make sure we got the right types.
+        assert isinstance(call_id, int), call_id
+
+        self.cursor.execute(
+            'DELETE FROM CallCommand WHERE call_id=?',
+            (call_id,))
+
+        self.cursor.executemany('''
+            INSERT INTO CallCommand (call_id, command_index, cmd, builder,
+                returncode, seconds, user_time, system_time, max_rss)
+            VALUES (?,?,?,?,?,?,?,?,?)
+            ''', ((call_id, i) + tuple(command)
+                for i, command in enumerate(commands)))
+
+    # --------------------------------------------------------------------------
+
     def find_file(self, file_name):
         """Returns the mtime and digest of the file, or None if it does not
         exist."""
@@ -0,0 +1,205 @@
+"""
+Share job slots with GNU make.
+
+GNU make limits the number of jobs a recursive build runs at once by handing
+out tokens through a pipe. Every process gets one implicit token for free, and
+has to read another token from the pipe before it can run each additional job.
+When the job finishes, the token gets written back so someone else can use it.
+"""
+
+import os
+import re
+import select
+import threading
+
+import fbuild
+
+# ------------------------------------------------------------------------------
+
+class JobserverError(fbuild.Error):
+    pass
+
+# ------------------------------------------------------------------------------
+
+_auth_regex = re.compile(r'--jobserver-(?:auth|fds)=(\S+)')
+_jobs_regex = re.compile(r'(?:^|\s)-j\s*(\d+)')
+
+def parse_makeflags(makeflags):
+    """Extract the jobserver authorization and the number of jobs from the
+    MAKEFLAGS environment variable. Either can be None if they weren't
+    specified.
+
+    >>> parse_makeflags(' -j4 --jobserver-auth=3,4')
+    ('3,4', 4)
+    >>> parse_makeflags('s -- FOO=bar')
+    (None, None)
+    """
+
+    # Only look at the flags, not at the variable overrides.
+    makeflags = makeflags.split(' -- ', 1)[0]
+
+    auths = _auth_regex.findall(makeflags)
+    auth = auths[-1] if auths else None
+
+    jobs = _jobs_regex.findall(makeflags)
+    jobs = int(jobs[-1]) if jobs else None
+
+    return auth, jobs
+
+
+def strip_makeflags(makeflags):
+    """Remove the jobserver flags from the MAKEFLAGS environment variable.
+
+    >>> strip_makeflags(' -j4 --jobserver-auth=3,4 -- FOO=bar')
+    ' -- FOO=bar'
+    """
+
+    flags, sep, overrides = makeflags.partition(' -- ')
+    flags = _auth_regex.sub('', flags)
+    flags = _jobs_regex.sub('', flags)
+
+    return ' '.join(flags.split()) + sep + overrides
+
+
+def from_makeflags(makeflags):
+    """Connect to the jobserver described in the MAKEFLAGS environment
+    variable. Returns None if there isn't a usable one."""
+
+    auth, jobs = parse_makeflags(makeflags)
+
+    if auth is None:
+        return None
+
+    if auth.startswith('fifo:'):
+        try:
+            fd = os.open(auth[len('fifo:'):], os.O_RDWR)
+        except OSError:
+            return None
+
+        return Client(fd, fd, jobs=jobs)
+
+    try:
+        read_fd, write_fd = (int(fd) for fd in auth.split(','))
+    except ValueError:
+        raise JobserverError('unable to understand jobserver %r' % auth)
+
+    # make closes the jobserver pipe for commands it doesn't think are
+    # recursive makes, so make sure the descriptors are actually open.
+    for fd in read_fd, write_fd:
+        try:
+            os.fstat(fd)
+        except OSError:
+            return None
+
+    return Client(read_fd, write_fd, jobs=jobs, pass_fds=(read_fd, write_fd))
+
+# ------------------------------------------------------------------------------
+
+class Client:
+    """Acquire and release job tokens from a jobserver."""
+
+    def __init__(self, read_fd, write_fd, *, jobs=None, pass_fds=()):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.jobs = jobs
+        self.pass_fds = tuple(pass_fds)
+
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._implicit_token = True
+
+    def acquire(self, block=True):
+        """Block until we can run a job, and return a token that must be
+        passed back to L{release} when the job is finished. If I{block} is
+        False, raise BlockingIOError instead of waiting for a token."""
+
+        # Use our free token if no one else is using it.
+        with self._lock:
+            if self._implicit_token:
+                self._implicit_token = False
+                return None
+
+        while True:
+            # Someone else may have made the pipe non-blocking, so wait for
+            # the pipe to be readable before trying to grab a token.
+            if block:
+                select.select([self.read_fd], [], [])
+
+            # Only read once the pipe is still readable after our other
+            # threads are done with it, so we don't block on a token one of
+            # them just took.
+            with self._read_lock:
+                if select.select([self.read_fd], [], [], 0)[0]:
+                    try:
+                        token = os.read(self.read_fd, 1)
+                    except (BlockingIOError, InterruptedError):
+                        token = None
+                    else:
+                        if not token:
+                            raise JobserverError('jobserver closed the pipe')
+
+                        return token
+
+            if not block:
+                raise BlockingIOError('no job tokens are available')
+
+    def release(self, token):
+        """Return the token to the jobserver."""
+
+        if token is None:
+            with self._lock:
+                self._implicit_token = True
+        else:
+            os.write(self.write_fd, token)
+
+    def makeflags(self, makeflags):
+        """Return the MAKEFLAGS a child process needs to share our
+        jobserver."""
+
+        # We're passing along make's jobserver, so there's nothing to change.
+        return makeflags
+
+    def close(self):
+        """Disconnect from the jobserver."""
+        pass
+
+# ------------------------------------------------------------------------------
+
+class Server(Client):
+    """Create a jobserver that allows I{jobs} jobs to run at once."""
+
+    def __init__(self, jobs):
+        read_fd, write_fd = os.pipe()
+
+        super().__init__(read_fd, write_fd,
+            jobs=jobs,
+            pass_fds=(read_fd, write_fd))
+
+        # We already have one token, so only put the rest in the pipe.
+        os.write(self.write_fd, b'+' * (jobs - 1))
+
+    def makeflags(self, makeflags):
+        """Return the MAKEFLAGS a child process needs to share our
+        jobserver."""
+
+        flags, sep, overrides = strip_makeflags(makeflags).partition(' -- ')
+
+        return '%s -j%d --jobserver-auth=%d,%d%s%s' % (
+            flags,
+            self.jobs,
+            self.read_fd,
+            self.write_fd,
+            sep,
+            overrides)
+
+    def close(self):
+        """Shut down the jobserver."""
+
+        if self.read_fd is not None:
+            os.close(self.read_fd)
+            os.close(self.write_fd)
+            self.read_fd = None
+            self.write_fd = None
+
+    def __del__(self):
+        self.close()
@@ -39,6 +39,34 @@ def make_parser():
             type='int',
             default=1,
             help='Allow N jobs at once'),
+        make_option('-k', '--keep-going',
+            action='store_true',
+            default=False,
+            help='Keep running the jobs that do not depend on a failed job'),
+        make_option('--no-jobserver',
+            dest='jobserver',
+            action='store_false',
+            default=True,
+            help='Do not share job slots with GNU make'),
+        make_option('--remote',
+            dest='remote_workers',
+            metavar='HOST:PORT',
+            action='append',
+            default=[],
+            help='Run compiles on the fbuild-worker at HOST:PORT. This may ' \
+                'be given multiple times'),
+        make_option('--remote-secret-file',
+            metavar='FILE',
+            help='Read the secret shared with the remote workers from FILE ' \
+                '(default is the FBUILD_WORKER_SECRET environment variable)'),
+        make_option('--trace',
+            metavar='FILE',
+            help='Save a Chrome trace event timeline of the build to FILE'),
+        make_option('--report',
+            action='store_true',
+            default=False,
+            help='Print the slowest and most memory hungry commands and the ' \
+                'time spent in each builder'),
         make_option('--nocolor',
             action='store_true',
             default=False,
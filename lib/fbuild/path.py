@@ -1,4 +1,4 @@
-import collections
+import collections.abc
 import hashlib
 import itertools
 import os
@@ -523,7 +523,7 @@ class Path(str):
         for pattern in patterns:
             if \
                     not isinstance(pattern, str) and \
-                    isinstance(pattern, collections.Iterable):
+                    isinstance(pattern, collections.abc.Iterable):
                 paths = Path.igloball(*pattern)
             else:
                 paths = Path.glob(pattern, **kwargs)
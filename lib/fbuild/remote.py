@@ -0,0 +1,541 @@
+"""
+Run commands on remote worker nodes.
+
+A L{Worker} daemon listens for connections from fbuild. For every command,
+fbuild sends the command line along with the content digests of the files the
+command reads. The worker asks for the contents of any files it hasn't already
+stored, runs the command in a scratch directory, then sends back the exit
+code, the output, and the digests of the files the command wrote. fbuild then
+downloads the files it doesn't already have.
+
+Every message is a 4 byte length followed by a JSON object. File contents are
+sent as a I{blob} message followed by the raw bytes.
+
+Since a worker runs whatever it's sent, and fbuild writes whatever files the
+worker sends back, both sides have to prove that they know the shared secret
+before anything else happens. fbuild sends a random challenge in its I{hello}
+message, and the worker answers with its own challenge and the HMAC of both
+challenges keyed with the secret. fbuild checks that, then replies with its
+own HMAC of the challenges, and the worker only accepts the connection if
+it's right. The secret itself is never sent. The messages after that aren't
+signed or encrypted though, so the network between fbuild and the workers
+still has to be trusted.
+
+fbuild also only writes the outputs it asked for, and only after checking the
+contents match their digests.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import queue
+import shutil
+import socket
+import socketserver
+import struct
+import subprocess
+import tempfile
+import threading
+
+import fbuild
+from fbuild.path import Path
+
+# ------------------------------------------------------------------------------
+
+class RemoteError(fbuild.Error):
+    pass
+
+# ------------------------------------------------------------------------------
+
+_header = struct.Struct('!I')
+
+def send_message(f, msg):
+    """Write the message to the file."""
+    data = json.dumps(msg).encode()
+    f.write(_header.pack(len(data)))
+    f.write(data)
+
+
+def recv_message(f):
+    """Read a message from the file."""
+    data = f.read(_header.size)
+    if len(data) != _header.size:
+        raise RemoteError('connection closed')
+
+    size, = _header.unpack(data)
+    data = f.read(size)
+    if len(data) != size:
+        raise RemoteError('connection closed')
+
+    return json.loads(data.decode())
+
+
+def send_blob(f, digest, data):
+    """Write the contents of a file to the file."""
+    send_message(f, {'op': 'blob', 'digest': digest, 'size': len(data)})
+    f.write(data)
+
+
+def recv_blob(f):
+    """Read the contents of a file from the file. Returns the digest and the
+    data."""
+    msg = recv_message(f)
+    if msg.get('op') != 'blob':
+        raise RemoteError('expected blob, got %r' % msg.get('op'))
+
+    data = f.read(msg['size'])
+    if len(data) != msg['size'] or digest_bytes(data) != msg['digest']:
+        raise RemoteError('corrupt blob %s' % msg['digest'])
+
+    return msg['digest'], data
+
+
+def digest_bytes(data):
+    """Digest the data the same way L{Path.digest} digests files."""
+    return hashlib.md5(data).hexdigest()
+
+
+def read_secret(path=None):
+    """Read the shared secret from the file I{path}, or from the
+    FBUILD_WORKER_SECRET environment variable if there's no file."""
+    if path is not None:
+        with open(path, 'rb') as f:
+            secret = f.read().strip()
+    else:
+        secret = os.environ.get('FBUILD_WORKER_SECRET', '').encode()
+
+    if not secret:
+        raise RemoteError('no shared secret for the remote workers. Set ' \
+            'FBUILD_WORKER_SECRET or pass a secret file')
+
+    return secret
+
+
+def sign(secret, role, *challenges):
+    """Sign the I{challenges} with the shared I{secret} on behalf of the
+    I{role}, either 'client' or 'worker', so that one side's signature can't
+    be passed off as the other's."""
+    data = '\0'.join((role,) + challenges)
+    return hmac.new(secret, data.encode(), hashlib.sha256).hexdigest()
+
+
+def verify(secret, signature, role, *challenges):
+    """Returns whether or not the I{signature} is the I{role}'s signature of
+    the I{challenges}."""
+    return hmac.compare_digest(str(signature),
+        sign(secret, role, *challenges))
+
+
+def check_relative(path):
+    """Make sure the path can be safely recreated inside a scratch
+    directory."""
+    path = os.path.normpath(path)
+    if os.path.isabs(path) or path.split(os.sep)[0] == os.pardir:
+        raise RemoteError('cannot run %r remotely' % path)
+
+    return path
+
+# ------------------------------------------------------------------------------
+
+class Worker(socketserver.ThreadingTCPServer):
+    """A daemon that runs commands for fbuild. I{secret} is the shared
+    secret clients need to know, I{jobs} is the number of commands this
+    worker will offer to run at the same time, and I{root} is the directory
+    where it stores the file contents it's been sent."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('localhost', 0), *, secret, jobs=1,
+            root=None):
+        if not secret:
+            raise RemoteError('the worker needs a shared secret')
+
+        super().__init__(address, _WorkerHandler)
+
+        self.secret = secret
+        self.jobs = jobs
+
+        if root is None:
+            root = tempfile.mkdtemp(prefix='fbuild-worker-')
+        self.root = Path(root)
+        self.blobs = self.root / 'blobs'
+        self.blobs.makedirs()
+
+    def verify(self, signature, role, *challenges):
+        """Check a client's I{signature} of the I{challenges}."""
+        return verify(self.secret, signature, role, *challenges)
+
+    def has_blob(self, digest):
+        return (self.blobs / digest).exists()
+
+    def save_blob(self, digest, data):
+        # Write to a temporary file first so that a concurrent reader never
+        # sees a partial blob.
+        dst = self.blobs / digest
+        with tempfile.NamedTemporaryFile(dir=self.blobs, delete=False) as f:
+            f.write(data)
+        os.replace(f.name, dst)
+
+    def load_blob(self, digest):
+        with open(self.blobs / digest, 'rb') as f:
+            return f.read()
+
+    def run_command(self, msg):
+        """Run the command inside a scratch directory that contains all of
+        the command's inputs."""
+
+        scratch = Path(tempfile.mkdtemp(dir=self.root, prefix='job-'))
+        try:
+            for path, digest in msg['inputs'].items():
+                dst = scratch / check_relative(path)
+                dst.parent.makedirs()
+                shutil.copyfile(self.blobs / digest, dst)
+
+            cwd = scratch / check_relative(msg.get('cwd') or os.curdir)
+            cwd.makedirs()
+
+            for path in msg['outputs']:
+                (scratch / check_relative(path)).parent.makedirs()
+
+            timed_out = False
+            try:
+                p = subprocess.run(msg['cmd'],
+                    cwd=cwd,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    timeout=msg.get('timeout'))
+            except subprocess.TimeoutExpired as e:
+                timed_out = True
+                returncode = -9
+                stdout = e.stdout or b''
+                stderr = e.stderr or b''
+            except OSError as e:
+                returncode = 127
+                stdout = b''
+                stderr = str(e).encode()
+            else:
+                returncode = p.returncode
+                stdout = p.stdout
+                stderr = p.stderr
+
+            # Save the outputs so the client can fetch them.
+            outputs = {}
+            for path in msg['outputs']:
+                src = scratch / check_relative(path)
+                if src.exists():
+                    with open(src, 'rb') as f:
+                        data = f.read()
+                    digest = digest_bytes(data)
+                    if not self.has_blob(digest):
+                        self.save_blob(digest, data)
+                    outputs[path] = digest
+
+            return {
+                'op': 'result',
+                'returncode': returncode,
+                'stdout': base64.b64encode(stdout).decode(),
+                'stderr': base64.b64encode(stderr).decode(),
+                'timed_out': timed_out,
+                'outputs': outputs,
+            }
+        finally:
+            scratch.rmtree()
+
+
+class _WorkerHandler(socketserver.StreamRequestHandler):
+    """Process the messages from one fbuild connection."""
+
+    def handle(self):
+        worker = self.server
+
+        if not self.authenticate():
+            return
+
+        while True:
+            try:
+                msg = recv_message(self.rfile)
+            except RemoteError:
+                return
+
+            op = msg.get('op')
+            if op == 'execute':
+                # Ask for the inputs that we don't have yet.
+                missing = sorted(set(digest
+                    for digest in msg['inputs'].values()
+                    if not worker.has_blob(digest)))
+                send_message(self.wfile, {'op': 'need', 'digests': missing})
+                self.wfile.flush()
+
+                for i in range(len(missing)):
+                    digest, data = recv_blob(self.rfile)
+                    worker.save_blob(digest, data)
+
+                try:
+                    result = worker.run_command(msg)
+                except RemoteError as e:
+                    result = {'op': 'error', 'message': str(e)}
+                send_message(self.wfile, result)
+            elif op == 'get':
+                for digest in msg['digests']:
+                    send_blob(self.wfile, digest, worker.load_blob(digest))
+            else:
+                send_message(self.wfile, {
+                    'op': 'error',
+                    'message': 'unknown operation %r' % op})
+
+            self.wfile.flush()
+
+    def authenticate(self):
+        """Prove to the client that we know the secret, and make sure the
+        client knows it too. Returns whether or not it does."""
+        worker = self.server
+
+        try:
+            msg = recv_message(self.rfile)
+            if msg.get('op') != 'hello':
+                raise RemoteError('expected hello, got %r' % msg.get('op'))
+
+            client_challenge = str(msg.get('challenge'))
+            challenge = os.urandom(16).hex()
+            send_message(self.wfile, {
+                'op': 'challenge',
+                'challenge': challenge,
+                'signature': sign(worker.secret, 'worker',
+                    client_challenge, challenge)})
+            self.wfile.flush()
+
+            msg = recv_message(self.rfile)
+            if msg.get('op') != 'auth' or not worker.verify(
+                    msg.get('signature'), 'client',
+                    challenge, client_challenge):
+                raise RemoteError('authentication failed')
+        except RemoteError as e:
+            try:
+                send_message(self.wfile, {'op': 'error', 'message': str(e)})
+                self.wfile.flush()
+            except OSError:
+                pass
+            return False
+
+        send_message(self.wfile, {'op': 'hello', 'jobs': worker.jobs})
+        self.wfile.flush()
+        return True
+
+# ------------------------------------------------------------------------------
+
+class _Connection:
+    """A connection to one of a worker's job slots."""
+
+    def __init__(self, address, secret):
+        self.address = address
+        self.secret = secret
+        self.socket = None
+
+    def connect(self):
+        """Connect and authenticate with the worker if we haven't already.
+        Returns the number of jobs the worker offers."""
+        if self.socket is None:
+            self.socket = socket.create_connection(self.address)
+            self.rfile = self.socket.makefile('rb')
+            self.wfile = self.socket.makefile('wb')
+
+            challenge = os.urandom(16).hex()
+            self.send({'op': 'hello', 'challenge': challenge})
+            msg = self.recv()
+            if msg.get('op') != 'challenge':
+                raise RemoteError(msg.get('message', 'unexpected response'))
+
+            # Make sure we're talking to a worker that knows the secret
+            # before we trust anything it sends us.
+            worker_challenge = str(msg.get('challenge'))
+            if not verify(self.secret, msg.get('signature'), 'worker',
+                    challenge, worker_challenge):
+                raise RemoteError('the worker failed to authenticate')
+
+            self.send({
+                'op': 'auth',
+                'signature': sign(self.secret, 'client',
+                    worker_challenge, challenge)})
+            msg = self.recv()
+            if msg.get('op') != 'hello':
+                raise RemoteError(msg.get('message', 'unexpected response'))
+
+            self.jobs = msg['jobs']
+
+        return self.jobs
+
+    def send(self, msg):
+        send_message(self.wfile, msg)
+        self.wfile.flush()
+
+    def recv(self):
+        return recv_message(self.rfile)
+
+    def close(self):
+        if self.socket is not None:
+            self.rfile.close()
+            self.wfile.close()
+            self.socket.close()
+            self.socket = None
+
+    def __str__(self):
+        return '%s:%d' % self.address
+
+
+class Pool:
+    """The job slots offered by a set of remote workers that share the
+    I{secret}."""
+
+    def __init__(self, addresses, *, secret, logger=None):
+        self._logger = logger
+        self._idle = queue.Queue()
+        self.slots = 0
+
+        for address in addresses:
+            address = parse_address(address)
+
+            # Ask the worker how many jobs it'll run for us.
+            connection = _Connection(address, secret)
+            try:
+                jobs = connection.connect()
+            except (OSError, RemoteError) as e:
+                self._log('cannot connect to worker %s: %s' % (connection, e))
+                connection.close()
+                continue
+
+            self._idle.put(connection)
+            for i in range(jobs - 1):
+                self._idle.put(_Connection(address, secret))
+
+            self.slots += jobs
+
+    def _log(self, msg):
+        if self._logger is not None:
+            self._logger.log(msg, color='yellow')
+
+    def idle(self):
+        """Returns whether or not a job slot is free right now."""
+        return not self._idle.empty()
+
+    def execute(self, cmd, *, inputs, outputs, cwd=None, timeout=None):
+        """Run the command on a free remote job slot. Returns the exit code,
+        the stdout and stderr output, and whether or not the command timed
+        out. Returns None if there are no free slots, or the command cannot
+        be run remotely."""
+
+        try:
+            connection = self._idle.get(block=False)
+        except queue.Empty:
+            return None
+
+        try:
+            result = self._execute(connection, cmd, inputs, outputs, cwd,
+                timeout)
+        except (OSError, RemoteError) as e:
+            # Something went wrong, so drop the connection and let the caller
+            # run the command locally.
+            self._log('remote execution on %s failed: %s' % (connection, e))
+            connection.close()
+            result = None
+
+        self._idle.put(connection)
+
+        return result
+
+    def _execute(self, connection, cmd, inputs, outputs, cwd, timeout):
+        # Convert everything relative to the current directory, since that's
+        # where the worker will recreate our files.
+        if cwd is not None:
+            cwd = check_relative(cwd)
+
+        digests = {}
+        for path in inputs:
+            digests[check_relative(path)] = Path(path).digest()
+
+        outputs = [check_relative(path) for path in outputs]
+
+        connection.connect()
+        connection.send({
+            'op': 'execute',
+            'cmd': [str(c) for c in cmd],
+            'cwd': cwd,
+            'inputs': digests,
+            'outputs': outputs,
+            'timeout': timeout,
+        })
+
+        # Upload the files the worker doesn't have.
+        msg = connection.recv()
+        if msg.get('op') != 'need':
+            raise RemoteError(msg.get('message', 'unexpected response'))
+
+        paths = {digest: path for path, digest in digests.items()}
+        for digest in msg['digests']:
+            with open(paths[digest], 'rb') as f:
+                send_blob(connection.wfile, digest, f.read())
+        connection.wfile.flush()
+
+        msg = connection.recv()
+        if msg.get('op') != 'result':
+            raise RemoteError(msg.get('message', 'unexpected response'))
+
+        # Download the outputs that changed. Only take the ones we asked for.
+        fetch = {}
+        for path, digest in msg['outputs'].items():
+            if path not in outputs:
+                raise RemoteError('unexpected output %r' % path)
+
+            path = Path(path)
+            if not path.exists() or path.digest() != digest:
+                fetch.setdefault(str(digest), []).append(path)
+
+        if fetch:
+            connection.send({'op': 'get', 'digests': sorted(fetch)})
+            for i in range(len(fetch)):
+                # recv_blob makes sure the data matches the digest.
+                digest, data = recv_blob(connection.rfile)
+                if digest not in fetch:
+                    raise RemoteError('unexpected blob %r' % digest)
+
+                for path in fetch.pop(digest):
+                    if path.parent:
+                        path.parent.makedirs()
+                    with open(path, 'wb') as f:
+                        f.write(data)
+
+        return (
+            msg['returncode'],
+            base64.b64decode(msg['stdout']),
+            base64.b64decode(msg['stderr']),
+            msg['timed_out'])
+
+    def close(self):
+        """Close all the connections to the workers."""
+        while True:
+            try:
+                connection = self._idle.get(block=False)
+            except queue.Empty:
+                break
+            connection.close()
+
+# ------------------------------------------------------------------------------
+
+def parse_address(address):
+    """Split a I{host:port} string into a tuple.
+
+    >>> parse_address('localhost:8000')
+    ('localhost', 8000)
+    """
+
+    if isinstance(address, tuple):
+        return address
+
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        raise RemoteError('worker address %r must be host:port' % address)
+
+    return host, int(port)
@@ -0,0 +1,56 @@
+"""
+Summarize the commands the cached calls ran, using the resource usage the
+database recorded for each of them.
+"""
+
+# ------------------------------------------------------------------------------
+
+def summarize(commands):
+    """Add up the commands for each builder. Returns a list of (builder,
+    count, seconds, user_time, system_time, max_rss) tuples, with the builders
+    that spent the most time first."""
+
+    builders = {}
+    for fun_name, command in commands:
+        count, seconds, user_time, system_time, max_rss = \
+            builders.get(command.builder, (0, 0.0, 0.0, 0.0, 0))
+
+        builders[command.builder] = (
+            count + 1,
+            seconds + command.seconds,
+            user_time + (command.user_time or 0.0),
+            system_time + (command.system_time or 0.0),
+            max(max_rss, command.max_rss or 0))
+
+    summary = [(builder,) + totals for builder, totals in builders.items()]
+    summary.sort(key=lambda s: (-s[2], s[0]))
+
+    return summary
+
+
+def log_report(logger, commands, *, limit=10):
+    """Log the slowest and the most memory hungry of the I{commands}, which
+    are (function name, L{fbuild.db.Command}) pairs, and how much each
+    builder used."""
+
+    commands = list(commands)
+
+    logger.log('slowest commands:')
+    for fun_name, command in sorted(commands,
+            key=lambda c: -c[1].seconds)[:limit]:
+        logger.log('  %8.2f sec  %s' % (command.seconds, command.cmd))
+
+    measured = [c for c in commands if c[1].max_rss is not None]
+    if measured:
+        logger.log('most memory hungry commands:')
+        for fun_name, command in sorted(measured,
+                key=lambda c: -c[1].max_rss)[:limit]:
+            logger.log('  %8d KB   %s' % (command.max_rss, command.cmd))
+
+    logger.log('commands per builder:')
+    logger.log('  %-30s %6s %10s %10s %10s %12s' % (
+        'builder', 'count', 'wall', 'user', 'sys', 'max rss'))
+    for builder, count, seconds, user_time, system_time, max_rss in \
+            summarize(commands):
+        logger.log('  %-30s %6d %10.2f %10.2f %10.2f %9d KB' % (
+            builder, count, seconds, user_time, system_time, max_rss))
@@ -1,6 +1,8 @@
 import collections
+import functools
 import io
 import operator
+import os
 import queue
 import sys
 import threading
@@ -8,6 +10,9 @@ import time
 import _thread
 
 import fbuild
+import fbuild.console
+import fbuild.jobserver
+import fbuild.trace
 
 # ------------------------------------------------------------------------------
 
@@ -42,6 +47,35 @@ class DependencyLoop(fbuild.Error):
 
         return s.getvalue().strip()
 
+class TasksFailed(fbuild.Error):
+    """
+    Raised when the scheduler is keeping going past errors and more than one
+    of the tasks failed.
+    """
+
+    def __init__(self, errors):
+        """
+        Create a TasksFailed.
+
+        errors: a list of the exceptions raised by the tasks.
+        """
+
+        # Flatten out any errors from nested schedules.
+        self.errors = []
+        for error in errors:
+            if isinstance(error, TasksFailed):
+                self.errors.extend(error.errors)
+            else:
+                self.errors.append(error)
+
+    def __str__(self):
+        s = io.StringIO()
+        print('%d tasks failed:' % len(self.errors), file=s)
+        for error in self.errors:
+            print('  %s' % error, file=s)
+
+        return s.getvalue().strip()
+
 # ------------------------------------------------------------------------------
 
 class Scheduler:
@@ -55,6 +89,15 @@ class Scheduler:
     >>> scheduler.map(f, [1, 2, 3])
     [1, 4, 9]
 
+    Results can also be consumed as soon as they finish, or a single function
+    can be submitted to run in the background:
+
+    >>> sorted(scheduler.imap_unordered(f, [1, 2, 3]))
+    [1, 4, 9]
+    >>> future = scheduler.submit(f, 4)
+    >>> future.result()
+    16
+
     Schedulers also support functions with dependencies. The scheduler will
     make sure that the dependencies will be processed before their dependents:
 
@@ -67,9 +110,42 @@ class Scheduler:
 
     """
 
-    def __init__(self, threadcount=0, *, logger=None):
+    def __init__(self, threadcount=0, *,
+            jobs=None,
+            logger=None,
+            keep_going=False,
+            jobserver=False,
+            tracer=None):
+        # Each thread runs one job at a time, unless we're told how many jobs
+        # to run, since the threads can run other tasks while they L{wait}.
+        threads_per_job = jobs is None
+        if jobs is None:
+            jobs = threadcount
+
+        # If we're asked to, share our job slots with GNU make. If we were run
+        # from make, we'll get our tokens from it, otherwise we'll hand out
+        # our own tokens to any makes we run.
+        self.jobserver = None
+        if jobserver and sys.platform != 'win32':
+            self.jobserver = fbuild.jobserver.from_makeflags(
+                os.environ.get('MAKEFLAGS', ''))
+
+            if self.jobserver is not None:
+                # Make sure we can use all of make's jobs.
+                if self.jobserver.jobs is not None:
+                    jobs = max(jobs, self.jobserver.jobs)
+                    if threads_per_job:
+                        threadcount = max(threadcount, jobs)
+            elif jobs > 1:
+                self.jobserver = fbuild.jobserver.Server(jobs)
+
         # We need at least 1 thread.
         threadcount = max(1, threadcount)
+        self.jobs = max(1, jobs)
+
+        # If a task fails, should we keep running all the tasks that don't
+        # depend on it before we error out?
+        self.keep_going = keep_going
 
         # Our threads.
         self.__threads = []
@@ -84,12 +160,15 @@ class Scheduler:
         # don't have races when we're logging to the console. So we need to
         # make one if we weren't given one.
         if logger is None:
-            import fbuild.console
             logger = fbuild.console.Log()
 
+        if tracer is None:
+            tracer = fbuild.trace.NullTracer()
+
         # Spin up our threads!
         for i in range(threadcount):
-            thread = WorkerThread(logger, self.__ready_queue)
+            thread = WorkerThread(logger, self.__ready_queue, self.jobserver,
+                tracer)
             self.__threads.append(thread)
             thread.start()
 
@@ -107,8 +186,10 @@ class Scheduler:
 
     def map_with_dependencies(self, depends, function, srcs):
         """Calculate the dependencies between the input sources and run them
-        concurrently. This function returns the results in the order that they
-        finished, not their initial order."""
+        concurrently. A source's function runs as soon as its own
+        dependencies are known and have finished, even if the dependencies of
+        the other sources are still being calculated. This function returns
+        the results in a depth first order of the dependencies."""
 
         # First create tasks for all the input sources and create an index from
         # src to task. We'll use this as a lookup when we invert the dependency
@@ -117,28 +198,31 @@ class Scheduler:
         for src in srcs:
             tasks[src] = Task(function, src)
 
-        # Evaluate the dependencies for each source.
-        for dep_task in self._evaluate([Task(depends, src) for src in srcs]):
-            try:
-                task = tasks[dep_task.src]
-            except KeyError:
-                # ignore missing dependencies
-                pass
-            else:
-                for dep in dep_task.result:
-                    try:
-                        task.dependencies.append(tasks[dep])
-                    except KeyError:
-                        # ignore missing dependencies
-                        pass
+        # Create a task to calculate the dependencies of each source. Once it
+        # finishes, the function task learns what it depends on.
+        def discover(task, deps):
+            for dep in deps:
+                try:
+                    yield task, tasks[dep]
+                except KeyError:
+                    # ignore missing dependencies
+                    pass
+
+        dep_tasks = []
+        for src in srcs:
+            task = tasks[src]
+            dep_task = Task(depends, src)
+            dep_task.discover = functools.partial(discover, task)
+            task.dependencies.append(dep_task)
+            dep_tasks.append(dep_task)
 
-        # Evaluate the functions.
-        self._evaluate(list(tasks.values()))
+        # Evaluate the dependencies and the functions together.
+        self._evaluate(dep_tasks + list(tasks.values()))
 
         # Sort the functions in a depth first order. Otherwise, the order of
         # the function evaluation could change between calls, which could break
         # caching these results.
-        visited = set()
+        visited = set(dep_tasks)
         results = []
 
         def f(task):
@@ -155,8 +239,45 @@ class Scheduler:
 
         return results
 
+    def imap_unordered(self, function, srcs):
+        """Run the function over the input sources concurrently. This function
+        is a generator that yields the results as soon as they finish, so the
+        caller can start working on them while the rest are still running."""
+        tasks = [Task(function, src, index) for index, src in enumerate(srcs)]
+
+        for task in self._iter_evaluate(tasks):
+            yield task.result
+
+    def submit(self, function, *args, **kwargs):
+        """Schedule the function to be called with the arguments and return a
+        L{Future} that will hold the result."""
+        def f(src):
+            return function(*args, **kwargs)
+
+        future = Future(self, Task(f, None))
+        future._task.running = True
+        self.__ready_queue.put((future, future._task))
+
+        return future
+
+    def as_completed(self, futures):
+        """Yield the L{Future}s as they finish."""
+        futures = list(futures)
+
+        done_queue = queue.Queue()
+        for future in futures:
+            future._add_done_queue(done_queue)
+
+        for i in range(len(futures)):
+            yield self._get(done_queue)
+
     def _evaluate(self, tasks):
         """Evaluate the function over these tasks and return the results."""
+        return list(self._iter_evaluate(tasks))
+
+    def _iter_evaluate(self, tasks):
+        """Evaluate the function over these tasks and yield the tasks as they
+        finish."""
 
         # Keep a counter for the number of active tasks. When this reaches 0 we
         # know we can exit.
@@ -178,41 +299,15 @@ class Scheduler:
                 task.running = True
                 self.__ready_queue.put((done_queue, task))
 
-        # A naive threadpool scheduler can deadlock if a function the scheduler
-        # is mapping also makes calls to the scheduler. The traditional way of
-        # writing a scheduler has the client of the scheduler block until the
-        # scheduler finishes running. This works fine until the function that
-        # is scheduled also makes a call into the scheduler. This will result
-        # in a deadlock because all the scheduler threads will be blocked
-        # waiting for work with no one left to actually do anything.
-        #
-        # The way we avoid this problem is that we detect if the current thread is
-        # one of our worker threads, and if so, we know we're are being used
-        # recursively. When this happens, we know we can reuse this thread to
-        # run another queued up function.
-        current_thread = threading.current_thread()
+        # The number of finished tasks.
+        finished = 0
 
-        # The list of function results.
-        results = []
+        # The errors we've collected when we're keeping going.
+        errors = []
 
         # Run until all of our tasks finished.
         while count != 0:
-            if isinstance(current_thread, WorkerThread):
-                # We're inside an already running thread, so we're going to run
-                # until all of our tasks are done.
-                try:
-                    current_thread.run_one(block=False)
-                except queue.Empty:
-                    pass
-
-                # See if any of our tasks finished.
-                try:
-                    task = done_queue.get(block=False)
-                except queue.Empty:
-                    # No tasks done, so loop.
-                    continue
-            else:
-                task = done_queue.get()
+            task = self._get(done_queue)
 
             # We finished a task!
             count -= 1
@@ -221,25 +316,55 @@ class Scheduler:
             # If a task raised an exception, cancel the rest of the tasks and
             # error out.
             if task.exc is not None:
-                # Clear our queue of tasks.
-                for t in tasks:
-                    t.done = True
-
-                raise task.exc
-
-            # Otherwise, add it to our results.
-            results.append(task)
+                if not self.keep_going:
+                    # Clear our queue of tasks.
+                    for t in tasks:
+                        t.done = True
+
+                    raise task.exc
+
+                # Otherwise, skip everything that depends on the failed task,
+                # but keep running the independent tasks.
+                errors.append(task.exc)
+                finished += 1 + self._skip_dependents(task, children)
+                continue
+
+            # Add any dependencies the task discovered to the graph. A
+            # dependency that's already done doesn't hold anything up, unless
+            # it failed while we were keeping going.
+            if task.discover is not None:
+                for dependent, dep in task.discover(task.result):
+                    dependent.dependencies.append(dep)
+                    if not dep.done:
+                        children[dep].append(dependent)
+                    elif (dep.exc is not None or dep.skipped) and \
+                            not dependent.done:
+                        dependent.done = True
+                        dependent.skipped = True
+                        finished += 1 + \
+                            self._skip_dependents(dependent, children)
 
             # If we have any dependent childs, see if they can run now. If so,
-            # add them to our work queue.
+            # add them to our work queue. We do this before handing the task
+            # back so the children can run while our caller is busy.
             for child in children[task]:
                 if child.can_run():
                     count += 1
                     child.running = True
                     self.__ready_queue.put((done_queue, child))
 
+            # Otherwise, pass it back to our caller.
+            finished += 1
+            yield task
+
+        # Now that everything that could run has run, report the errors.
+        if len(errors) == 1:
+            raise errors[0]
+        elif errors:
+            raise TasksFailed(errors)
+
         # Check if we ran all of the tasks.
-        if len(results) != len(tasks):
+        if finished != len(tasks):
             # Uh oh, we must have a mutually dependent task. Figure out all the
             # dependencies and error out.
             recursive_srcs = set()
@@ -254,7 +379,90 @@ class Scheduler:
 
             raise DependencyLoop(recursive_srcs)
 
-        return results
+    def _skip_dependents(self, task, children):
+        """Mark all the tasks that recursively depend on the task as done
+        without running them. Returns the number of tasks that were skipped."""
+        skipped = 0
+        stack = list(children[task])
+        while stack:
+            child = stack.pop()
+            if child.done:
+                continue
+
+            child.done = True
+            child.skipped = True
+            skipped += 1
+            stack.extend(children[child])
+
+        return skipped
+
+    # The most tasks that L{wait} stacks up on one thread.
+    max_wait_depth = 16
+
+    def wait(self, q, *, interval=0.01):
+        """Wait for an item to show up on the queue I{q}, such as the output
+        of a running command. If this is one of our worker threads, it runs
+        the ready tasks in the meantime, checking the queue every
+        I{interval} seconds, so a task that's waiting on a command doesn't
+        tie up a thread. The tasks run on top of the waiting one, so a
+        thread only stacks up L{max_wait_depth} of them before it just
+        waits."""
+
+        current_thread = threading.current_thread()
+
+        if not isinstance(current_thread, WorkerThread) or \
+                current_thread.depth >= self.max_wait_depth:
+            return q.get()
+
+        while True:
+            try:
+                return q.get(timeout=interval)
+            except queue.Empty:
+                pass
+
+            try:
+                if not current_thread.run_one_waiting():
+                    # We're shutting down, so leave the thread's shutdown
+                    # marker for the thread's own loop.
+                    self.__ready_queue.put(None)
+                    return q.get()
+            except queue.Empty:
+                pass
+
+    def _get(self, done_queue):
+        """Wait for an item to show up on the done queue."""
+
+        # A naive threadpool scheduler can deadlock if a function the scheduler
+        # is mapping also makes calls to the scheduler. The traditional way of
+        # writing a scheduler has the client of the scheduler block until the
+        # scheduler finishes running. This works fine until the function that
+        # is scheduled also makes a call into the scheduler. This will result
+        # in a deadlock because all the scheduler threads will be blocked
+        # waiting for work with no one left to actually do anything.
+        #
+        # The way we avoid this problem is that we detect if the current thread is
+        # one of our worker threads, and if so, we know we're are being used
+        # recursively. When this happens, we know we can reuse this thread to
+        # run another queued up function.
+        current_thread = threading.current_thread()
+
+        if not isinstance(current_thread, WorkerThread):
+            return done_queue.get()
+
+        while True:
+            # We're inside an already running thread, so we're going to run
+            # other tasks until ours is done.
+            try:
+                current_thread.run_one(block=False)
+            except queue.Empty:
+                pass
+
+            # See if any of our tasks finished.
+            try:
+                return done_queue.get(block=False)
+            except queue.Empty:
+                # No tasks done, so loop.
+                continue
 
     def __del__(self):
         # Make sure we shutdown all our threads before we quit.
@@ -274,6 +482,18 @@ class Scheduler:
         # Reset our thread list.
         self.__threads = []
 
+        if self.jobserver is not None:
+            self.jobserver.close()
+
+# ------------------------------------------------------------------------------
+
+def current_task():
+    """Return the L{Task} the current thread is running, or None if it isn't
+    one of the scheduler's threads. A thread that's waiting on a nested
+    evaluation runs other tasks in the meantime, so this is the innermost
+    one."""
+    return getattr(threading.current_thread(), 'task', None)
+
 # ------------------------------------------------------------------------------
 
 class WorkerThread(threading.Thread):
@@ -282,14 +502,25 @@ class WorkerThread(threading.Thread):
     left.
     """
 
-    def __init__(self, logger, ready_queue):
+    def __init__(self, logger, ready_queue, jobserver=None, tracer=None):
         super().__init__()
         self.daemon = True
 
         self.__logger = logger
         self.__ready_queue = ready_queue
+        self.__jobserver = jobserver
+        self.__tracer = tracer or fbuild.trace.NullTracer()
         self.__finished = False
 
+        # The innermost task this thread is running, and how many tasks it's
+        # running inside each other.
+        self.task = None
+        self.depth = 0
+
+        # Are we holding a jobserver token? Tasks that we run while waiting
+        # on a nested evaluation reuse the token of the outer task.
+        self.__has_token = False
+
     def shutdown(self):
         """Tell the thread to exit."""
         self.__finished = True
@@ -313,22 +544,169 @@ class WorkerThread(threading.Thread):
 
         queue_task = self.__ready_queue.get(*args, **kwargs)
 
+        if queue_task is not None and self.__jobserver is not None and \
+                not self.__has_token:
+            # Don't hold on to the task while we wait for a token, since it
+            # could be a nested task that a thread with a token is waiting
+            # on. Put it back so that thread can run it, and only take a task
+            # off the queue once we have a token.
+            self.__ready_queue.put(queue_task)
+            self.__ready_queue.task_done()
+
+            return self.__run_with_token()
+
         try:
             # This should be tested in the try block so that we update the done
             # counter in the ready queue, even if we errored out.
             if queue_task is None:
                 return False
 
-            done_queue, task = queue_task
+            self.__run_queue_task(queue_task)
+        finally:
+            self.__ready_queue.task_done()
+
+        return True
+
+    def run_one_waiting(self):
+        """Try to run one ready task while the current task waits on a
+        command. The command is using the current task's jobserver token, so
+        the task needs a token of its own. Raises queue.Empty if there's
+        nothing we can run, otherwise works like L{run_one}."""
+
+        if self.__jobserver is None:
+            return self.run_one(block=False)
+
+        if not self.__has_token:
+            raise queue.Empty
+
+        queue_task = self.__ready_queue.get(block=False)
+        if queue_task is None:
+            self.__ready_queue.task_done()
+            return False
+
+        try:
+            token = self.__jobserver.acquire(block=False)
+        except BlockingIOError:
+            self.__ready_queue.put(queue_task)
+            self.__ready_queue.task_done()
+            raise queue.Empty
+
+        try:
+            self.__run_queue_task(queue_task)
+        finally:
+            self.__ready_queue.task_done()
+            self.__jobserver.release(token)
+
+        return True
+
+    def __run_with_token(self):
+        """Wait for a jobserver token, then run a task with it if there's
+        still one ready."""
+
+        with self.__tracer.span('jobserver', 'sched'):
+            token = self.__jobserver.acquire()
+
+        self.__has_token = True
+        try:
             try:
-                task.run()
+                queue_task = self.__ready_queue.get(block=False)
+            except queue.Empty:
+                # Someone else ran the task while we were waiting.
+                return True
+
+            try:
+                if queue_task is None:
+                    return False
+
+                self.__run_queue_task(queue_task)
             finally:
-                done_queue.put(task)
+                self.__ready_queue.task_done()
         finally:
-            self.__ready_queue.task_done()
+            self.__has_token = False
+            self.__jobserver.release(token)
 
         return True
 
+    def __run_queue_task(self, queue_task):
+        done_queue, task = queue_task
+        try:
+            self.__run_task(task)
+        finally:
+            done_queue.put(task)
+
+    def __run_task(self, task):
+        outer_task, self.task = self.task, task
+        self.depth += 1
+        try:
+            name = getattr(task.function, '__name__', 'task')
+            with self.__tracer.span(name, 'sched', src=task.src) as args:
+                task.run()
+                if task.exc is not None:
+                    args['error'] = task.exc
+        finally:
+            self.task = outer_task
+            self.depth -= 1
+
+# ------------------------------------------------------------------------------
+
+class Future:
+    """
+    The eventual result of a function submitted to the scheduler with
+    L{Scheduler.submit}.
+    """
+
+    def __init__(self, scheduler, task):
+        self._scheduler = scheduler
+        self._task = task
+        self._lock = threading.Lock()
+        self._done_queues = []
+
+    def done(self):
+        """Returns True if the function finished running."""
+        return self._task.done
+
+    def result(self):
+        """Wait for the function to finish and return the result, or raise the
+        exception the function raised."""
+        if not self._task.done:
+            done_queue = queue.Queue()
+            self._add_done_queue(done_queue)
+            self._scheduler._get(done_queue)
+
+        if self._task.exc is not None:
+            raise self._task.exc
+
+        return self._task.result
+
+    def exception(self):
+        """Wait for the function to finish and return the exception it raised,
+        or None if it succeeded."""
+        if not self._task.done:
+            done_queue = queue.Queue()
+            self._add_done_queue(done_queue)
+            self._scheduler._get(done_queue)
+
+        return self._task.exc
+
+    def _add_done_queue(self, done_queue):
+        """Put ourselves on the done queue when we finish."""
+        with self._lock:
+            if not self._task.done:
+                self._done_queues.append(done_queue)
+                return
+
+        done_queue.put(self)
+
+    def put(self, task):
+        """Called by the worker thread when the task finished."""
+        with self._lock:
+            task.done = True
+            done_queues = self._done_queues
+            self._done_queues = []
+
+        for done_queue in done_queues:
+            done_queue.put(self)
+
 # ------------------------------------------------------------------------------
 
 class Task:
@@ -342,8 +720,13 @@ class Task:
         self.index = index
         self.running = False
         self.done = False
+        self.skipped = False
         self.dependencies = []
-        self.exc =None
+        self.exc = None
+
+        # An optional function that's called with the task's result once it
+        # finishes, and returns (task, dependency) pairs to add to the graph.
+        self.discover = None
 
     def can_run(self):
         """Returns True if all of this task's dependencies are done. Otherwise
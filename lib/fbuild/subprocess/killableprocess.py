@@ -204,6 +204,10 @@ class Popen(subprocess.Popen):
         if self.returncode is not None:
             return self.returncode
 
+        # Newer versions of subprocess wait without a timeout by passing None.
+        if timeout is None:
+            timeout = -1
+
         if mswindows:
             if timeout != -1:
                 timeout = timeout * 1000
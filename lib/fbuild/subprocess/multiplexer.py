@@ -0,0 +1,491 @@
+"""
+Multiplex the pipes, exits and timeouts of running commands onto one event
+loop thread.
+
+Rather than having every command read its pipes inside I{Popen.communicate}
+with a timer thread watching for timeouts, the L{Multiplexer} hands the
+command's pipes, exit status and timeout over to an asyncio event loop that
+runs in one background thread. The calling thread only waits for the lines
+of output it needs to pass to its hooks and for the command to finish, and
+it can be handed a I{wait} function that does other work in the meantime.
+The scheduler's L{fbuild.sched.Scheduler.wait} runs other tasks while it
+waits, so a build doesn't need one thread for every job.
+
+The processes are reaped with I{wait4} so that we can report how much CPU time
+and memory each command used.
+
+The output is collected by L{OutputBuffer}s, which can hand each line to a
+parser as it arrives, and can keep just the end of a large output in memory
+while spilling all of it to a file.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import os
+import queue
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+
+# ------------------------------------------------------------------------------
+
+# Put each command in its own process group so that we can kill it and all of
+# its children. Newer pythons can do this without a preexec function.
+if sys.version_info >= (3, 11):
+    _new_process_group = {'process_group': 0}
+else:
+    _new_process_group = {'start_new_session': True}
+
+# The size of the chunks we read from and write to the pipes.
+_CHUNK_SIZE = 65536
+
+# ------------------------------------------------------------------------------
+
+class ResourceUsage(collections.namedtuple('ResourceUsage',
+        'user_time system_time max_rss')):
+    """The CPU time in seconds and the maximum resident set size in kilobytes
+    that a command used."""
+
+    @classmethod
+    def from_rusage(cls, rusage):
+        # Darwin reports the resident set size in bytes, everyone else in
+        # kilobytes.
+        max_rss = rusage.ru_maxrss
+        if sys.platform == 'darwin':
+            max_rss //= 1024
+
+        return cls(rusage.ru_utime, rusage.ru_stime, max_rss)
+
+
+class Result(collections.namedtuple('Result',
+        'returncode stdout stderr timed_out')):
+    """The result of running a command. The L{ResourceUsage} of the command is
+    stored in I{usage}, or None if it's not known."""
+
+    usage = None
+
+# ------------------------------------------------------------------------------
+
+class OutputBuffer:
+    """Collect the output of a command. Every complete line is passed to the
+    I{hook} as soon as it arrives. If there's a I{limit}, only the last
+    I{limit} bytes are kept in memory, and a line longer than that is passed
+    to the hook in pieces. Once the output grows past it, all of it is also
+    written to a spill file in I{spill_dir}, whose name is stored in
+    I{spill_file}.
+
+    If I{dispatch} is set, it's called with the hook and the line instead of
+    calling the hook, so that the hook can be run in another thread."""
+
+    def __init__(self, *, hook=None, limit=None, spill_dir=None,
+            suffix='.log'):
+        self.hook = hook
+        self.limit = limit
+        self.spill_dir = spill_dir
+        self.suffix = suffix
+        self.spill_file = None
+        self.dispatch = None
+
+        self._chunks = collections.deque()
+        self._size = 0
+        self._partial = []
+        self._partial_size = 0
+        self._spill = None
+
+    def feed(self, data):
+        """Add some of the output."""
+
+        if self.hook is not None:
+            self._feed_lines(data)
+
+        if self.limit is not None and self._spill is None and \
+                self.spill_dir is not None and \
+                self._size + len(data) > self.limit:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            fd, self.spill_file = tempfile.mkstemp(
+                dir=self.spill_dir,
+                prefix='output-',
+                suffix=self.suffix)
+            self._spill = os.fdopen(fd, 'wb')
+            self._spill.writelines(self._chunks)
+
+        if self._spill is not None:
+            self._spill.write(data)
+
+        self._chunks.append(data)
+        self._size += len(data)
+
+        # Throw away the start of the output if we've got too much.
+        if self.limit is not None:
+            while self._size > self.limit:
+                excess = self._size - self.limit
+                if len(self._chunks[0]) <= excess:
+                    self._size -= len(self._chunks.popleft())
+                else:
+                    self._chunks[0] = self._chunks[0][excess:]
+                    self._size -= excess
+
+    def _feed_lines(self, data):
+        """Pass the lines that the data completes to the hook. Only the new
+        data is searched for line ends, so a long line doesn't get slower as
+        it grows."""
+
+        lines = data.split(b'\n')
+        for line in lines[:-1]:
+            self._partial.append(line)
+            self._partial.append(b'\n')
+            self._flush_partial()
+
+        if lines[-1]:
+            self._partial.append(lines[-1])
+            self._partial_size += len(lines[-1])
+
+            if self.limit is not None and self._partial_size > self.limit:
+                self._flush_partial()
+
+    def _flush_partial(self):
+        """Pass what we have of the current line to the hook."""
+
+        line = b''.join(self._partial)
+        self._partial = []
+        self._partial_size = 0
+
+        if self.dispatch is None:
+            self.hook(line)
+        else:
+            self.dispatch(self.hook, line)
+
+    def close(self):
+        """Finish the output, and return what we kept of it."""
+
+        if self.hook is not None and self._partial:
+            self._flush_partial()
+
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+        return b''.join(self._chunks)
+
+    def discard(self):
+        """Close and delete the spill file, if there is one."""
+
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+        if self.spill_file is not None:
+            try:
+                os.remove(self.spill_file)
+            except FileNotFoundError:
+                pass
+            self.spill_file = None
+
+# ------------------------------------------------------------------------------
+
+class Multiplexer(threading.Thread):
+    """Watch the pipes, exits and timeouts of concurrently running commands
+    from an event loop in a background thread."""
+
+    def __init__(self):
+        super().__init__()
+        self.daemon = True
+
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+
+    def start(self, *args, **kwargs):
+        super().start(*args, **kwargs)
+
+        self._started.wait()
+
+    def run(self):
+        """Run the event loop until we're told to shut down."""
+
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(self._started.set)
+
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    def shutdown(self):
+        """Tell the event loop to stop and wait for the thread to exit."""
+
+        if self.is_alive():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self.join()
+
+    # --------------------------------------------------------------------------
+
+    def execute(self, cmd, *,
+            input=None,
+            stdin=None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=None,
+            stdout_buffer=None,
+            stderr_buffer=None,
+            wait=None,
+            on_exit=None,
+            **kwargs):
+        """Run the command and wait until it finishes. Returns a L{Result}
+        with the exit code, the stdout and stderr output, and whether or not
+        the command timed out. The output is collected in the
+        L{OutputBuffer}s, if they're given, and their hooks are called in
+        this thread, so that a slow hook doesn't hold up the other
+        commands.
+
+        If I{wait} is given, it's called with a queue to wait for the next
+        item on it, instead of just blocking on the queue. I{on_exit} is
+        called from the event loop once the command has exited, even if
+        this thread is still busy with something else."""
+
+        if wait is None:
+            wait = lambda q: q.get()
+
+        stdout_buffer = stdout_buffer or OutputBuffer()
+        stderr_buffer = stderr_buffer or OutputBuffer()
+
+        # The event loop sends us the lines for the hooks, followed by None
+        # once the command is done.
+        lines = queue.Queue()
+        def dispatch(hook, line):
+            lines.put((hook, line))
+
+        stdout_buffer.dispatch = dispatch
+        stderr_buffer.dispatch = dispatch
+
+        p = subprocess.Popen(cmd,
+            stdin=subprocess.PIPE if input else stdin,
+            stdout=stdout,
+            stderr=stderr,
+            **dict(_new_process_group, **kwargs))
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._communicate(p, input, timeout, stdout_buffer,
+                stderr_buffer),
+            self._loop)
+        def done(future):
+            if on_exit is not None:
+                on_exit()
+            lines.put(None)
+
+        future.add_done_callback(done)
+
+        try:
+            while True:
+                item = wait(lines)
+                if item is None:
+                    break
+
+                hook, line = item
+                hook(line)
+        except KeyboardInterrupt:
+            # Make sure if we get a keyboard interrupt to kill the process.
+            self._loop.call_soon_threadsafe(self._kill, p)
+            raise
+        except BaseException:
+            # The hook failed, so kill the process, and wait for the event
+            # loop to be done with the buffers before we pass on the error.
+            self._loop.call_soon_threadsafe(self._kill, p)
+            concurrent.futures.wait([future])
+            raise
+
+        return future.result()
+
+    # --------------------------------------------------------------------------
+
+    async def _communicate(self, p, input, timeout, stdout_buffer,
+            stderr_buffer):
+        """Feed the input to the process, collect the output, and wait for it
+        to exit."""
+
+        futures = [
+            self._write(p.stdin, input),
+            self._read(p.stdout, stdout_buffer),
+            self._read(p.stderr, stderr_buffer),
+            self._wait(p),
+        ]
+
+        # Kill the process if it runs too long.
+        timed_out = False
+        def on_timeout():
+            nonlocal timed_out
+            timed_out = True
+            self._kill(p)
+
+        if timeout:
+            handle = self._loop.call_later(timeout, on_timeout)
+        else:
+            handle = None
+
+        try:
+            stdin, stdout, stderr, usage = await asyncio.gather(*futures)
+        except BaseException:
+            # We were cancelled or couldn't write the spill file.
+            self._kill(p)
+            raise
+        finally:
+            if handle is not None:
+                handle.cancel()
+
+        result = Result(p.returncode, stdout, stderr, timed_out)
+        result.usage = usage
+
+        return result
+
+    def _write(self, pipe, input):
+        """Write the input into the pipe, then close it."""
+
+        future = self._loop.create_future()
+
+        if pipe is None:
+            future.set_result(None)
+            return future
+
+        fd = pipe.fileno()
+        os.set_blocking(fd, False)
+        view = memoryview(input or b'')
+        offset = 0
+
+        def done():
+            self._loop.remove_writer(fd)
+            pipe.close()
+            if not future.done():
+                future.set_result(None)
+
+        def on_writable():
+            nonlocal offset
+            try:
+                offset += os.write(fd, view[offset:offset + _CHUNK_SIZE])
+            except BlockingIOError:
+                return
+            except (BrokenPipeError, ConnectionResetError):
+                # The process doesn't want any more input.
+                done()
+                return
+
+            if offset >= len(view):
+                done()
+
+        if view:
+            self._loop.add_writer(fd, on_writable)
+        else:
+            pipe.close()
+            future.set_result(None)
+
+        return future
+
+    def _read(self, pipe, buffer):
+        """Read everything from the pipe into the buffer until it closes."""
+
+        future = self._loop.create_future()
+
+        if pipe is None:
+            future.set_result(None)
+            return future
+
+        fd = pipe.fileno()
+        os.set_blocking(fd, False)
+
+        def on_readable():
+            try:
+                data = os.read(fd, _CHUNK_SIZE)
+            except BlockingIOError:
+                return
+
+            try:
+                if data:
+                    buffer.feed(data)
+                    return
+
+                result = buffer.close()
+            except BaseException as e:
+                # Pass the error from the buffer back to the caller.
+                self._loop.remove_reader(fd)
+                pipe.close()
+                if not future.done():
+                    future.set_exception(e)
+                return
+
+            self._loop.remove_reader(fd)
+            pipe.close()
+            if not future.done():
+                future.set_result(result)
+
+        self._loop.add_reader(fd, on_readable)
+
+        return future
+
+    def _wait(self, p):
+        """Wait for the process to exit. The future's result is the process's
+        L{ResourceUsage}."""
+
+        future = self._loop.create_future()
+
+        def finish(usage):
+            if not future.done():
+                future.set_result(usage)
+
+        # Linux can tell us when the process exits through a file descriptor.
+        try:
+            pidfd = os.pidfd_open(p.pid)
+        except (AttributeError, OSError):
+            pidfd = None
+
+        if pidfd is not None:
+            def on_exit():
+                self._loop.remove_reader(pidfd)
+                os.close(pidfd)
+                finish(_reap(p, 0))
+
+            self._loop.add_reader(pidfd, on_exit)
+        else:
+            # Otherwise, poll the process with a backoff.
+            delay = 0.001
+            def poll():
+                nonlocal delay
+                usage = _reap(p, os.WNOHANG)
+                if p.returncode is None:
+                    delay = min(delay * 2, 0.05)
+                    self._loop.call_later(delay, poll)
+                else:
+                    finish(usage)
+
+            poll()
+
+        return future
+
+    def _kill(self, p):
+        """Kill the process and all of its children."""
+
+        try:
+            os.killpg(p.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+# ------------------------------------------------------------------------------
+
+def _reap(p, options):
+    """Wait for the process with I{wait4} and set its return code. Returns the
+    process's L{ResourceUsage}, or None if it's still running or we don't know
+    how much it used."""
+
+    try:
+        pid, status, rusage = os.wait4(p.pid, options)
+    except ChildProcessError:
+        # Someone else already reaped the process.
+        p.wait()
+        return None
+
+    if pid == 0:
+        return None
+
+    p.returncode = os.waitstatus_to_exitcode(status)
+
+    return ResourceUsage.from_rusage(rusage)
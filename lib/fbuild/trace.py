@@ -0,0 +1,89 @@
+"""
+Record a timeline of the build.
+
+A L{Tracer} records spans of time, such as a scheduler task running or a
+command executing, along with the thread they ran on. The timeline is saved in
+the Chrome trace event format, which can be viewed in chrome://tracing or
+Perfetto. Spans that start and finish within another span on the same thread
+are shown nested inside of it.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+# ------------------------------------------------------------------------------
+
+class Tracer:
+    """Collect the spans of time spent inside the build."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._thread_names = {}
+        self._pid = os.getpid()
+        self._start = time.perf_counter()
+
+    def _now(self):
+        """The time since we started tracing, in microseconds."""
+        return (time.perf_counter() - self._start) * 1e6
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        """Record the time it takes to run the body of the with statement.
+        Any I{args} are shown with the span, and the body can add more by
+        updating the yielded dictionary."""
+
+        thread = threading.current_thread()
+        start = self._now()
+        try:
+            yield args
+        finally:
+            end = self._now()
+
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': start,
+                'dur': end - start,
+                'pid': self._pid,
+                'tid': thread.ident,
+            }
+
+            if args:
+                event['args'] = {k: str(v) for k, v in args.items()}
+
+            with self._lock:
+                self._events.append(event)
+                self._thread_names.setdefault(thread.ident, thread.name)
+
+    def save(self, filename):
+        """Write the trace events to the file."""
+
+        with self._lock:
+            events = [{
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': self._pid,
+                'tid': tid,
+                'args': {'name': name},
+            } for tid, name in self._thread_names.items()]
+
+            events.extend(self._events)
+
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+class NullTracer:
+    """A tracer that doesn't record anything, for when tracing is off."""
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        yield args
+
+    def save(self, filename):
+        pass
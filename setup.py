@@ -24,6 +24,6 @@ setup(
         'fbuild.config.cxx',
         'fbuild.subprocess',
     ],
-    scripts=['bin/fbuild'],
+    scripts=['bin/fbuild', 'bin/fbuild-worker'],
     package_dir={'': 'lib'},
 )
@@ -0,0 +1,24 @@
+import tempfile
+
+import fbuild.context
+from fbuild.path import Path
+
+# -----------------------------------------------------------------------------
+
+def make_tempdir(test):
+    """Make a temporary directory that's removed once the I{test} is
+    finished."""
+    path = Path(tempfile.mkdtemp())
+    test.addCleanup(path.rmtree)
+    return path
+
+
+def make_context(test, buildroot, *args):
+    """Make a context that builds into the I{buildroot}, with the extra
+    command line I{args}, and shut it down once the I{test} is finished."""
+    ctx = fbuild.context.make_default_context(
+        ['--buildroot', buildroot] + list(args))
+    ctx.create_buildroot()
+    ctx.load_configuration()
+    test.addCleanup(ctx.shutdown)
+    return ctx
@@ -7,10 +7,25 @@ import unittest
 
 sys.path.append(os.path.join(os.path.dirname(sys.argv[0]), '..', 'lib'))
 
+import test_classfile
+import test_context
+import test_db
+import test_elf
+import test_multiplexer
 import test_fnmatch
 import test_functools
+import test_gcc
+import test_ghc
 import test_glob
+import test_java
+import test_jobserver
+import test_nm
+import test_ocaml
+import test_remote
+import test_report
+import test_scala
 import test_scheduler
+import test_trace
 
 # -----------------------------------------------------------------------------
 
@@ -42,10 +57,25 @@ def main():
             else:
                 suite.addTest(test)
 
+    suite.addTest(test_classfile.suite())
+    suite.addTest(test_context.suite())
+    suite.addTest(test_db.suite())
+    suite.addTest(test_elf.suite())
+    suite.addTest(test_multiplexer.suite())
     suite.addTest(test_fnmatch.suite())
     suite.addTest(test_functools.suite())
+    suite.addTest(test_gcc.suite())
+    suite.addTest(test_ghc.suite())
     suite.addTest(test_glob.suite())
+    suite.addTest(test_java.suite())
+    suite.addTest(test_jobserver.suite())
+    suite.addTest(test_nm.suite())
+    suite.addTest(test_ocaml.suite())
+    suite.addTest(test_remote.suite())
+    suite.addTest(test_report.suite())
+    suite.addTest(test_scala.suite())
     suite.addTest(test_scheduler.suite())
+    suite.addTest(test_trace.suite())
 
     runner = unittest.TextTestRunner(verbosity=2)
     runner.run(suite)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3.1
+
+import struct
+import unittest
+
+import fbuild.builders.classfile
+
+# -----------------------------------------------------------------------------
+
+def make_class(name, *, superclass='java/lang/Object', interfaces=(),
+        fields=(), methods=(), uses=(), code=b'', source=None):
+    """Write a class file. The I{fields} and I{methods} are (access, name,
+    descriptor) tuples, and a field can have an int constant value as a
+    fourth item. I{uses} are the classes the code refers to,
+    I{code} stands in for the method bodies, and I{source} is the name of the
+    source file, if it's recorded."""
+
+    pool = []
+    index = {}
+    def constant(tag, *value):
+        key = (tag,) + value
+        if key not in index:
+            if tag == 1:
+                data = value[0].encode()
+                pool.append(struct.pack('>BH', tag, len(data)) + data)
+            elif tag == 3:
+                pool.append(struct.pack('>Bi', tag, *value))
+            else:
+                pool.append(struct.pack('>B' + 'H' * len(value), tag, *value))
+            index[key] = len(pool)
+        return index[key]
+
+    def utf8(s):
+        return constant(1, s)
+
+    def cls(s):
+        return constant(7, utf8(s))
+
+    body = struct.pack('>HHH', 0x0021, cls(name), cls(superclass))
+    body += struct.pack('>H', len(interfaces))
+    body += b''.join(struct.pack('>H', cls(i)) for i in interfaces)
+
+    for members, attribute in (fields, None), (methods, 'Code'):
+        body += struct.pack('>H', len(members))
+        for access, member, descriptor, *value in members:
+            body += struct.pack('>HHH', access, utf8(member), utf8(descriptor))
+            if value:
+                body += struct.pack('>HHIH', 1, utf8('ConstantValue'), 2,
+                    constant(3, value[0]))
+            elif attribute is None:
+                body += struct.pack('>H', 0)
+            else:
+                body += struct.pack('>HHI', 1, utf8(attribute), len(code))
+                body += code
+
+    for use in uses:
+        cls(use)
+
+    if source is None:
+        body += struct.pack('>H', 0)
+    else:
+        body += struct.pack('>HHIH', 1, utf8('SourceFile'), 2, utf8(source))
+
+    return struct.pack('>IHHH', 0xCAFEBABE, 0, 50, len(pool) + 1) + \
+        b''.join(pool) + body
+
+# -----------------------------------------------------------------------------
+
+class TestClassFile(unittest.TestCase):
+    def testParse(self):
+        cls = fbuild.builders.classfile.parse(make_class('p/A',
+            interfaces=['java/lang/Runnable'],
+            fields=[(0x0001, 'x', 'Lp/B;')],
+            methods=[(0x0001, 'run', '()V')],
+            uses=['p/C', '[Lp/D;']))
+
+        self.assertEqual(cls.name, 'p/A')
+        self.assertEqual(cls.references, frozenset([
+            'java/lang/Object', 'java/lang/Runnable', 'p/B', 'p/C', 'p/D']))
+        self.assertEqual(cls.source, None)
+
+    def testSource(self):
+        def parse(**kwargs):
+            return fbuild.builders.classfile.parse(make_class('p/A$1',
+                **kwargs))
+
+        cls = parse(source='A.java')
+        self.assertEqual(cls.source, 'A.java')
+
+        # The source file isn't part of the API.
+        self.assertEqual(cls.api, parse(source='B.java').api)
+        self.assertEqual(cls.api, parse().api)
+
+    def testApi(self):
+        def api(**kwargs):
+            return fbuild.builders.classfile.parse(make_class('A',
+                **kwargs)).api
+
+        base = api(methods=[(0x0001, 'f', '()V')])
+
+        # Method bodies and private members aren't part of the API.
+        self.assertEqual(base, api(methods=[(0x0001, 'f', '()V')],
+            code=b'\x00'))
+        self.assertEqual(base, api(methods=[
+            (0x0001, 'f', '()V'),
+            (0x0002, 'g', '()V'),
+            (0x1008, 'access$000', '()V')]))
+
+        # But anything that can be seen from outside is.
+        self.assertNotEqual(base, api(methods=[(0x0001, 'f', '()I')]))
+        self.assertNotEqual(base, api(methods=[(0x0001, 'f', '()V')],
+            fields=[(0x0000, 'x', 'I')]))
+        self.assertNotEqual(base, api(methods=[(0x0001, 'f', '()V')],
+            superclass='B'))
+
+    def testConstants(self):
+        def parse(*fields):
+            return fbuild.builders.classfile.parse(make_class('A',
+                fields=fields))
+
+        self.assertEqual(parse((0x0001, 'x', 'I')).constants, None)
+
+        # Only the constants other classes can see count.
+        base = parse((0x0019, 'X', 'I', 1), (0x001a, 'Y', 'I', 2))
+        self.assertEqual(base.constants,
+            parse((0x0019, 'X', 'I', 1), (0x001a, 'Y', 'I', 3)).constants)
+        self.assertNotEqual(base.constants,
+            parse((0x0019, 'X', 'I', 2), (0x001a, 'Y', 'I', 2)).constants)
+
+        # A constant's value is part of the API too.
+        self.assertNotEqual(base.api,
+            parse((0x0019, 'X', 'I', 2), (0x001a, 'Y', 'I', 2)).api)
+
+    def testBadClass(self):
+        self.assertRaises(fbuild.builders.classfile.ClassFormatError,
+            fbuild.builders.classfile.parse, b'fake class')
+        self.assertRaises(fbuild.builders.classfile.ClassFormatError,
+            fbuild.builders.classfile.parse, make_class('A')[:-4])
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    return unittest.TestLoader().loadTestsFromTestCase(TestClassFile)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3.1
+
+import os
+import sys
+import time
+import unittest
+
+import fbuild
+
+from helpers import make_context, make_tempdir
+
+# -----------------------------------------------------------------------------
+
+class TestContext(unittest.TestCase):
+    def setUp(self):
+        self.buildroot = make_tempdir(self)
+
+    def make_context(self, *args):
+        return make_context(self, self.buildroot, *args)
+
+    def testInheritEnvironment(self):
+        ctx = self.make_context('-j1')
+
+        # There's nothing to change, so the command gets our environment.
+        self.assertEquals(ctx._environment(None, None), None)
+
+        stdout, stderr = ctx.execute([sys.executable, '-c',
+            'import os; print(os.environ.get("PATH"))'])
+        self.assertEquals(stdout.decode().strip(), os.environ.get('PATH'))
+
+    def testEnvironment(self):
+        ctx = self.make_context('-j1')
+
+        env = ctx._environment({'FBUILD_TEST': '1'}, ['a', 'b'])
+        self.assertEquals(env['FBUILD_TEST'], '1')
+        self.assertEquals(env['PATH'], os.environ['PATH'])
+        self.assertTrue(env['LD_LIBRARY_PATH'].endswith(
+            'a' + os.pathsep + 'b'))
+
+        # The variables are cached, but they're applied to the current
+        # environment, so later changes to it are seen.
+        count = len(ctx._environments)
+        os.environ['FBUILD_TEST_OTHER'] = '3'
+        try:
+            env = ctx._environment({'FBUILD_TEST': '1'}, ['a', 'b'])
+        finally:
+            del os.environ['FBUILD_TEST_OTHER']
+        self.assertEquals(len(ctx._environments), count)
+        self.assertEquals(env['FBUILD_TEST_OTHER'], '3')
+        self.assertEquals(env['FBUILD_TEST'], '1')
+
+        # A variable that's already set to the same value doesn't need an
+        # environment of its own.
+        os.environ['FBUILD_TEST'] = '1'
+        try:
+            self.assertEquals(ctx._environment({'FBUILD_TEST': '1'}, None),
+                None)
+        finally:
+            del os.environ['FBUILD_TEST']
+
+        stdout, stderr = ctx.execute([sys.executable, '-c',
+            'import os; print(os.environ["FBUILD_TEST"])'],
+            env={'FBUILD_TEST': '2'})
+        self.assertEquals(stdout, b'2\n')
+
+    def testOutputLimit(self):
+        ctx = self.make_context('-j1')
+
+        lines = []
+        stdout, stderr = ctx.execute([sys.executable, '-c',
+            'for i in range(10000): print(i)'],
+            stdout_hook=lines.append,
+            output_limit=100,
+            quieter=1)
+
+        self.assertEquals(len(lines), 10000)
+        self.assertEquals(stdout, b''.join(lines)[-100:])
+
+        # The full output is only kept if the command fails.
+        self.assertEquals((self.buildroot / 'output').listdir(), [])
+
+        self.assertRaises(fbuild.ExecutionError, ctx.execute,
+            [sys.executable, '-c',
+                'import sys\n'
+                'for i in range(10000): print(i)\n'
+                'sys.exit(1)\n'],
+            output_limit=100,
+            quieter=1)
+
+        spill_file, = (self.buildroot / 'output').listdir()
+        with open(self.buildroot / 'output' / spill_file, 'rb') as f:
+            self.assertEquals(f.read(), b''.join(lines))
+
+    def testOutputHookError(self):
+        ctx = self.make_context('-j1')
+
+        def hook(line):
+            if line == b'5000\n':
+                raise ValueError(line)
+
+        self.assertRaises(ValueError, ctx.execute,
+            [sys.executable, '-c', 'for i in range(10000): print(i)'],
+            stdout_hook=hook,
+            output_limit=100,
+            quieter=1)
+
+        # The command didn't finish, so its full output isn't kept.
+        output = self.buildroot / 'output'
+        self.assertEquals(output.listdir() if output.exists() else [], [])
+
+    def testCleanup(self):
+        ctx = self.make_context('-j1')
+
+        calls = []
+        def fail():
+            calls.append('fail')
+            raise ValueError('oops')
+
+        ctx.add_cleanup(calls.append, 1)
+        ctx.add_cleanup(fail)
+        ctx.add_cleanup(calls.append, 2)
+
+        # The cleanups run last to first, and a failure doesn't stop the rest.
+        ctx.cleanup()
+        self.assertEquals(calls, [2, 'fail', 1])
+
+        ctx.cleanup()
+        self.assertEquals(calls, [2, 'fail', 1])
+
+    def testConcurrentCommands(self):
+        ctx = self.make_context('-j8')
+
+        if ctx.multiplexer is None:
+            return
+
+        # We don't need a thread for every job, since the threads that are
+        # waiting on a command run the other tasks.
+        self.assertTrue(ctx.scheduler.threadcount <= (os.cpu_count() or 1))
+
+        def sleep(i):
+            ctx.execute([sys.executable, '-c', 'import time; time.sleep(1)'],
+                quieter=1)
+            return i
+
+        start = time.time()
+        self.assertEquals(ctx.scheduler.map(sleep, range(8)), list(range(8)))
+        self.assertTrue(time.time() - start < 4)
+
+    def testJobserverEnvironment(self):
+        ctx = self.make_context('-j4')
+
+        if ctx.scheduler.jobserver is None:
+            return
+
+        # Our job slots are exported, so commands still inherit our
+        # environment.
+        self.assertEquals(ctx._environment(None, None), None)
+        self.assertTrue('--jobserver' in os.environ['MAKEFLAGS'])
+
+        stdout, stderr = ctx.execute([sys.executable, '-c',
+            'import os; print(os.environ["MAKEFLAGS"])'])
+        self.assertTrue(b'--jobserver' in stdout)
+
+        # Replacing MAKEFLAGS keeps the job slots.
+        env = ctx._environment({'MAKEFLAGS': 'k'}, None)
+        self.assertTrue('--jobserver' in env['MAKEFLAGS'])
+
+        makeflags = os.environ.get('MAKEFLAGS')
+        ctx.shutdown()
+        self.assertNotEquals(os.environ.get('MAKEFLAGS'), makeflags)
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    return unittest.TestLoader().loadTestsFromTestCase(TestContext)
+
+if __name__ == "__main__":
+    unittest.main()
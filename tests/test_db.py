@@ -0,0 +1,115 @@
+#!/usr/bin/env python3.1
+
+import threading
+import unittest
+
+import fbuild
+import fbuild.db
+
+from helpers import make_context, make_tempdir
+
+# -----------------------------------------------------------------------------
+
+@fbuild.db.caches
+def read(ctx, src:fbuild.db.SRC):
+    with open(src) as f:
+        return f.read()
+
+class Reader(fbuild.db.PersistentObject):
+    """Read files, and read the ones that changed in batches."""
+
+    def __init__(self, ctx):
+        super().__init__(ctx)
+        self.batches = []
+
+    @fbuild.db.cachemethod
+    def read(self, src:fbuild.db.SRC):
+        with open(src) as f:
+            return f.read()
+
+    def read_batch(self, srcs, during=lambda: None):
+        def run(dirty):
+            self.batches.append(dirty)
+            during()
+            results = {}
+            for src in dirty:
+                with open(src) as f:
+                    results[src] = f.read()
+            return results
+
+        return fbuild.db.call_batched(self.read, srcs, run)
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.buildroot = make_tempdir(self)
+        self.src = self.buildroot / 'src'
+
+    def write(self, text):
+        with open(self.src, 'w') as f:
+            f.write(text)
+
+    def build(self, engine):
+        """Read the src in a build of its own, and save the database."""
+        ctx = make_context(self, self.buildroot, '--database-engine', engine)
+        try:
+            return read(ctx, self.src)
+        finally:
+            ctx.shutdown()
+
+    def check_rerun(self, engine):
+        self.write('1')
+        self.assertEquals(self.build(engine), '1')
+
+        # The call reruns because the src changed, and the next build needs
+        # to get the new result out of the database.
+        self.write('2')
+        self.assertEquals(self.build(engine), '2')
+        self.assertEquals(self.build(engine), '2')
+
+    def testRerunPickle(self):
+        self.check_rerun('pickle')
+
+    def testRerunCache(self):
+        self.check_rerun('cache')
+
+    def testRerunSqlite(self):
+        self.check_rerun('sqlite')
+
+    def testCallBatched(self):
+        ctx = make_context(self, self.buildroot)
+        reader = Reader(ctx)
+
+        srcs = []
+        for name in 'abc':
+            self.src = self.buildroot / name
+            self.write(name)
+            srcs.append(self.src)
+
+        # A call of one of the srcs while its batch is running doesn't see
+        # the batch, it just runs on its own.
+        results = []
+        def during():
+            thread = threading.Thread(
+                target=lambda: results.append(reader.read(srcs[0])))
+            thread.start()
+            thread.join()
+
+        self.assertEquals(reader.read_batch(srcs, during), ['a', 'b', 'c'])
+        self.assertEquals(results, ['a'])
+        self.assertEquals(reader.batches, [srcs])
+
+        # The results of the batch are cached for each src, and only the
+        # srcs that changed are run again.
+        self.assertEquals(reader.read(srcs[1]), 'b')
+        self.src = srcs[2]
+        self.write('d')
+        self.assertEquals(reader.read_batch(srcs), ['a', 'b', 'd'])
+        self.assertEquals(reader.batches, [srcs, srcs[2:]])
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    return unittest.TestLoader().loadTestsFromTestCase(TestDatabase)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3.1
+
+import struct
+import unittest
+
+import fbuild.builders.elf
+
+# -----------------------------------------------------------------------------
+
+def make_elf(symbols, *, elfclass=64, byteorder='<'):
+    """Write an ELF object file with a symbol table. The I{symbols} are
+    (name, binding, type, section index) tuples."""
+
+    strtab = b'\0'
+    entries = [(0, 0, 0)]
+    for name, bind, kind, shndx in symbols:
+        entries.append((len(strtab), (bind << 4) | kind, shndx))
+        strtab += name + b'\0'
+
+    if elfclass == 64:
+        symtab = b''.join(struct.pack(byteorder + 'IBBHQQ',
+            name, info, 0, shndx, 0, 0) for name, info, shndx in entries)
+        header_size, section_size = 64, 64
+    else:
+        symtab = b''.join(struct.pack(byteorder + 'IIIBBH',
+            name, 0, 0, info, 0, shndx) for name, info, shndx in entries)
+        header_size, section_size = 52, 40
+
+    strtab_offset = header_size
+    symtab_offset = strtab_offset + len(strtab)
+    shoff = symtab_offset + len(symtab)
+
+    ident = b'\x7fELF' + bytes([
+        1 if elfclass == 32 else 2,
+        1 if byteorder == '<' else 2,
+        1]) + bytes(9)
+
+    if elfclass == 64:
+        header = ident + struct.pack(byteorder + 'HHIQQQIHHHHHH',
+            1, 62, 1, 0, 0, shoff, 0, header_size, 0, 0, section_size, 3, 2)
+        section = byteorder + 'IIQQQQIIQQ'
+    else:
+        header = ident + struct.pack(byteorder + 'HHIIIIIHHHHHH',
+            1, 3, 1, 0, 0, shoff, 0, header_size, 0, 0, section_size, 3, 2)
+        section = byteorder + 'IIIIIIIIII'
+
+    sections = b''.join([
+        struct.pack(section, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+        struct.pack(section, 0, 2, 0, 0, symtab_offset, len(symtab), 2, 1,
+            8, len(symtab) // len(entries)),
+        struct.pack(section, 0, 3, 0, 0, strtab_offset, len(strtab), 0, 0,
+            1, 0),
+    ])
+
+    return header + strtab + symtab + sections
+
+# -----------------------------------------------------------------------------
+
+class TestElf(unittest.TestCase):
+    symbols = [
+        (b'f', 1, 2, 1),        # global function
+        (b'x', 1, 1, 2),        # global object
+        (b'common', 1, 1, 0xfff2),
+        (b'printf', 1, 0, 0),   # undefined
+        (b'local', 0, 2, 1),
+        (b'weak', 2, 2, 1),
+        (b'weak_undef', 2, 0, 0),
+        (b'ifunc', 1, 10, 1),
+        (b't.c', 0, 4, 0xfff1),
+    ]
+
+    def testSymbols(self):
+        for elfclass in 32, 64:
+            for byteorder in '<', '>':
+                self.assertEqual(fbuild.builders.elf.symbols(make_elf(
+                        self.symbols,
+                        elfclass=elfclass,
+                        byteorder=byteorder)),
+                    ({b'f', b'x', b'common'}, {b'printf'}))
+
+    def testBadElf(self):
+        self.assertFalse(fbuild.builders.elf.is_elf(b'!<arch>\n'))
+        self.assertRaises(fbuild.builders.elf.ElfFormatError,
+            fbuild.builders.elf.symbols, b'!<arch>\n')
+        self.assertRaises(fbuild.builders.elf.ElfFormatError,
+            fbuild.builders.elf.symbols, make_elf(self.symbols)[:-10])
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    return unittest.TestLoader().loadTestsFromTestCase(TestElf)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3.1
+
+import shutil
+import unittest
+
+import fbuild
+import fbuild.builders.c.gcc
+
+from helpers import make_context, make_tempdir
+
+# -----------------------------------------------------------------------------
+
+@unittest.skipUnless(shutil.which('gcc'), 'gcc is not installed')
+class TestGccPch(unittest.TestCase):
+    def setUp(self):
+        self.buildroot = make_tempdir(self)
+        self.srcdir = make_tempdir(self)
+
+        self.ctx = make_context(self, self.buildroot, '-j2')
+
+        self.gcc = fbuild.builders.c.gcc.static(self.ctx)
+
+        self.write('inner.h', '#ifndef VALUE\n#define VALUE 5\n#endif\n')
+        self.header = self.write('big.h',
+            '#include "inner.h"\n'
+            'int value(void);\n')
+        self.src = self.write('main.c',
+            '#include <stdio.h>\n'
+            'int value(void) { return VALUE; }\n'
+            'int main(void) { printf("%d", value()); return 0; }\n')
+
+    def write(self, name, text):
+        path = self.srcdir / name
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def testBuildPch(self):
+        pch = self.gcc.build_pch(self.header)
+        self.assertEqual(pch.name, 'big.h.gch')
+        self.assertTrue(pch.exists())
+
+        # With the header out of the way, the source only compiles if gcc
+        # uses the precompiled header.
+        self.header.rename(self.srcdir / 'moved.h')
+        obj = self.gcc.uncached_compile(self.src, pch=pch, quieter=1)
+        self.assertTrue(obj.exists())
+
+    def testPchDependencies(self):
+        def build():
+            exe = self.gcc.build_exe('main', [self.src],
+                ckwargs={'pch': self.header})
+            return self.gcc.run([exe], quieter=1)[0]
+
+        self.assertEqual(build(), b'5')
+
+        # The sources don't include the header that changed, but the
+        # precompiled header does.
+        self.write('inner.h', '#define VALUE 6\n')
+        self.assertEqual(build(), b'6')
+
+    def testInvalidPch(self):
+        pch = self.gcc.build_pch(self.header)
+
+        # The pch wasn't made with this macro, so gcc reads the header
+        # instead.
+        obj = self.gcc.compile(self.src, pch=pch, macros=['VALUE=7'],
+            quieter=1)
+        exe = self.gcc.link_exe('main', [obj])
+        self.assertEqual(self.gcc.run([exe], quieter=1)[0], b'7')
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    return unittest.TestLoader().loadTestsFromTestCase(TestGccPch)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3.1
+
+import os
+import sys
+import unittest
+
+import fbuild.builders.ghc
+from fbuild.path import Path
+
+from helpers import make_context, make_tempdir
+
+# -----------------------------------------------------------------------------
+
+# A stand in for ghc that logs the srcs it compiled. The interface it writes
+# for a module is made up of the lines of the src that start with "export".
+fake_ghc = '''\
+#!%s
+import os, re, sys
+args = sys.argv[1:]
+srcs = [a for a in args if a.endswith(('.hs', '.hs-boot'))]
+with open(%r, 'a') as f:
+    f.write(' '.join(srcs) + '\\n')
+dst = args[args.index('-o') + 1]
+open(dst, 'w').close()
+if '-c' in args:
+    hidir = args[args.index('-hidir') + 1]
+    for src in srcs:
+        code = open(src).read()
+        m = re.search('^module ([A-Za-z.]+)', code, re.M)
+        module = m.group(1) if m else 'Main'
+        suffix = '.hi-boot' if src.endswith('-boot') else '.hi'
+        with open(os.path.join(hidir, module + suffix), 'w') as f:
+            f.write(''.join(line for line in code.splitlines(True)
+                if line.startswith('export')))
+'''
+
+class TestGhc(unittest.TestCase):
+    def setUp(self):
+        self.buildroot = make_tempdir(self)
+        self.srcdir = make_tempdir(self)
+
+        self.log = self.buildroot / 'ghc.log'
+        exe = self.buildroot / 'ghc'
+        with open(exe, 'w') as f:
+            f.write(fake_ghc % (sys.executable, str(self.log)))
+        os.chmod(exe, 0o755)
+
+        self.ctx = make_context(self, self.buildroot, '-j4')
+
+        self.ghc = fbuild.builders.ghc.Builder(self.ctx, ghc=exe)
+        self.compiles()
+
+    def write(self, name, code):
+        path = self.srcdir / name
+        with open(path, 'w') as f:
+            f.write(code)
+        return path
+
+    def compiles(self):
+        if not self.log.exists():
+            return []
+        with open(self.log) as f:
+            compiles = [line.split() for line in f]
+        self.log.remove()
+        return compiles
+
+    def testImports(self):
+        src = self.write('A.hs',
+            'module A (f) where\n'
+            'import qualified Data.Map as M\n'
+            '{- import Hidden -}\n'
+            'import {-# SOURCE #-} B\n'
+            '-- import Commented\n'
+            'import "base" Data.List (sort)\n')
+
+        self.assertEquals(self.ghc.imports(src),
+            ('A', ('Data.Map', 'Data.List'), ('B',)))
+
+    def testLiterateImports(self):
+        src = self.write('A.lhs',
+            'The imports of a literate source are in its code.\n'
+            'import Text\n'
+            '\n'
+            '> module A where\n'
+            '> import qualified Data.Map as M\n'
+            '> import B\n')
+
+        self.assertEquals(self.ghc.imports(src),
+            ('A', ('Data.Map', 'B'), ()))
+
+        src = self.write('B.lhs',
+            'import Text\n'
+            '\\begin{code}\n'
+            'module B where\n'
+            'import C\n'
+            '\\end{code}\n'
+            '\\begin{code}\n'
+            'import D\n'
+            '\\end{code}\n')
+
+        self.assertEquals(self.ghc.imports(src), ('B', ('C', 'D'), ()))
+
+    def testBuildObjects(self):
+        a = self.write('A.hs', 'module A where\nimport B\nimport Data.List\n')
+        b = self.write('B.hs', 'module B where\nimport C\nexport f\n')
+        c = self.write('C.hs', 'module C where\nexport g\n')
+        main = self.write('Main.hs', 'import A\nimport C\n')
+        srcs = [main, a, b, c]
+
+        self.assertEquals(self.ghc.source_dependencies(main), [a, c])
+
+        # The modules are compiled after the modules they import.
+        objs = self.ghc.build_objects(srcs)
+        self.assertEquals([Path(obj).name for obj in objs],
+            ['C.o', 'B.o', 'A.o', 'Main.o'])
+        self.assertEquals(
+            [compile[0] for compile in self.compiles()], [c, b, a, main])
+
+        # Changing a module without changing its interface doesn't affect the
+        # modules that import it.
+        with open(c, 'a') as f:
+            f.write('g = 1\n')
+        self.ghc.build_objects(srcs)
+        self.assertEquals(self.compiles(), [[c]])
+
+        with open(c, 'a') as f:
+            f.write('export h\n')
+        self.ghc.build_objects(srcs)
+        self.assertEquals(sorted(self.compiles()), [[b], [c], [main]])
+
+    def testSourceImports(self):
+        a = self.write('A.hs',
+            'module A where\nimport {-# SOURCE #-} B\nexport f\n')
+        b = self.write('B.hs', 'module B where\nimport A\n')
+        boot = self.write('B.hs-boot', 'module B where\nexport g\n')
+        srcs = [a, b]
+
+        self.assertEquals(self.ghc.source_dependencies(a), [boot])
+        self.assertEquals(self.ghc.source_dependencies(b), [boot, a])
+
+        # The boot file is compiled first, but its object isn't returned.
+        objs = self.ghc.build_objects(srcs)
+        self.assertEquals([Path(obj).name for obj in objs], ['A.o', 'B.o'])
+        self.assertEquals(
+            [compile[0] for compile in self.compiles()], [boot, a, b])
+
+        # A depends on B's boot interface rather than on B.
+        with open(b, 'a') as f:
+            f.write('export h\n')
+        self.ghc.build_objects(srcs)
+        self.assertEquals(self.compiles(), [[b]])
+
+        with open(boot, 'a') as f:
+            f.write('export h\n')
+        self.ghc.build_objects(srcs)
+        self.assertEquals(self.compiles(), [[boot], [a], [b]])
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    return unittest.TestLoader().loadTestsFromTestCase(TestGhc)
+
+if __name__ == "__main__":
+    unittest.main()
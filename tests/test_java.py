@@ -0,0 +1,407 @@
+#!/usr/bin/env python3.1
+
+import os
+import sys
+import unittest
+import zipfile
+
+import fbuild.builders.java
+from fbuild.path import Path
+
+from helpers import make_context, make_tempdir
+
+import test_classfile
+
+# -----------------------------------------------------------------------------
+
+# A stand in for javac that logs the srcs it compiled, and writes a class and
+# an inner class for each of them, in the package the src names on a package
+# line. Like javac, it doesn't record the name of the src with -g:none.
+fake_javac = '''\
+#!%s
+import os, sys
+sys.path.insert(0, %r)
+import test_classfile
+args = sys.argv[1:]
+srcs = [a for a in args if a.endswith('.java')]
+with open(%r, 'a') as f:
+    f.write(' '.join(srcs) + '\\n')
+if '-d' in args:
+    dst = args[args.index('-d') + 1]
+    for src in srcs:
+        words = open(src).read().split()
+        package = words[1] if words[0] == 'package' else ''
+        name = os.path.splitext(os.path.basename(src))[0]
+        for cls in (name, name + '$1'):
+            path = os.path.join(dst, package, cls + '.class')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(test_classfile.make_class(
+                    package + '/' + cls if package else cls,
+                    source=None if '-g:none' in args else
+                        os.path.basename(src)))
+            print('[wrote %%s]' %% path, file=sys.stderr)
+'''
+
+# A stand in for javac that writes real class files. Each src has a class line
+# naming the class, and then lines of the members, of the int constants and of
+# the classes it uses.
+fake_abi_javac = '''\
+#!%s
+import os, sys
+sys.path.insert(0, %r)
+import test_classfile
+args = sys.argv[1:]
+srcs = [a for a in args if a.endswith('.java')]
+with open(%r, 'a') as f:
+    f.write(' '.join(srcs) + '\\n')
+for src in srcs:
+    name = None
+    methods = []
+    fields = []
+    uses = []
+    for line in open(src):
+        words = line.split()
+        if not words:
+            continue
+        elif words[0] == 'class':
+            name = words[1]
+        elif words[0] == 'uses':
+            uses.append(words[1])
+        elif words[0] == 'const':
+            fields.append((0x19, words[1], 'I', int(words[2])))
+        else:
+            access = 1 if words[0] == 'public' else 2
+            methods.append((access, words[1], words[2]))
+    if name is not None and '-d' in args:
+        path = os.path.join(args[args.index('-d') + 1], name + '.class')
+        with open(path, 'wb') as f:
+            f.write(test_classfile.make_class(name,
+                fields=fields, methods=methods, uses=uses,
+                source=os.path.basename(src)))
+        print('[wrote %%s]' %% path, file=sys.stderr)
+'''
+
+class TestJava(unittest.TestCase):
+    def setUp(self):
+        self.buildroot = make_tempdir(self)
+
+        self.log = self.buildroot / 'javac.log'
+        self.javac = self.write_script('javac', fake_javac % (
+            sys.executable,
+            os.path.dirname(os.path.abspath(__file__)),
+            str(self.log)))
+
+        self.srcdir = make_tempdir(self)
+        self.srcs = []
+        for name in 'A', 'B', 'C':
+            src = self.srcdir / name + '.java'
+            with open(src, 'w') as f:
+                f.write('class %s {}\n' % name)
+            self.srcs.append(src)
+
+        self.ctx = make_context(self, self.buildroot, '-j2')
+
+        self.java = fbuild.builders.java.Builder(self.ctx,
+            jar=self.javac,
+            java=self.javac,
+            javac=self.javac)
+
+    def write_script(self, name, text):
+        path = self.buildroot / name
+        with open(path, 'w') as f:
+            f.write(text)
+        os.chmod(path, 0o755)
+        return path
+
+    def compiles(self):
+        if not self.log.exists():
+            return []
+        with open(self.log) as f:
+            return [line.split() for line in f if line.strip()]
+
+    def testBatch(self):
+        dst = self.buildroot / 'classes'
+        dst.makedirs()
+
+        self.log.remove()
+        dsts = self.java.build_objects(self.srcs, dst=dst, batch=True)
+
+        # All the srcs were compiled at once.
+        self.assertEquals(self.compiles(), [self.srcs])
+        self.assertEquals(sorted(dsts), sorted(
+            dst / name for name in os.listdir(dst) if name.endswith('.class')))
+
+        # Each src's classes were cached on their own.
+        for src in self.srcs:
+            name = src.name.replaceext('')
+            self.assertEquals(self.java.compile(src, dst=dst), [
+                dst / name + '.class', dst / name + '$1.class'])
+        self.assertEquals(len(self.compiles()), 1)
+
+        # Only the changed srcs get compiled again, in chunks.
+        for src in self.srcs[1:]:
+            with open(src, 'a') as f:
+                f.write('class D {}\n')
+
+        self.log.remove()
+        self.java.build_objects(self.srcs, dst=dst, batch=True, batch_size=1)
+        self.assertEquals(sorted(self.compiles()),
+            [[src] for src in self.srcs[1:]])
+
+    def abi_java(self):
+        javac = self.write_script('abi-javac', fake_abi_javac % (
+            sys.executable,
+            os.path.dirname(os.path.abspath(__file__)),
+            str(self.log)))
+        return fbuild.builders.java.Builder(self.ctx,
+            jar=javac,
+            java=javac,
+            javac=javac)
+
+    def testApi(self):
+        java = self.abi_java()
+
+        dst = self.buildroot / 'classes'
+        dst.makedirs()
+
+        a, b = self.srcdir / 'A.java', self.srcdir / 'B.java'
+        def write(src, text):
+            with open(src, 'w') as f:
+                f.write(text)
+
+        write(a, 'class A\npublic f ()V\n')
+        write(b, 'class B\nuses A\n')
+
+        def build():
+            if self.log.exists():
+                self.log.remove()
+            java.compile(a, dst=dst)
+            java.compile(b, dst=dst)
+            return self.compiles()
+
+        self.assertEquals(build(), [[a], [b]])
+        self.assertEquals(build(), [])
+
+        # A's API didn't change, so B doesn't need compiling again.
+        write(a, 'class A\npublic f ()V\nprivate g ()V\n')
+        self.assertEquals(build(), [[a]])
+
+        write(a, 'class A\npublic f ()V\npublic g ()V\n')
+        self.assertEquals(build(), [[a], [b]])
+
+    def check_build_objects_api(self, **kwargs):
+        java = self.abi_java()
+
+        dst = self.buildroot / 'classes'
+        dst.makedirs()
+
+        a, b, c = self.srcs
+        def write(src, text):
+            with open(src, 'w') as f:
+                f.write(text)
+
+        write(a, 'class A\npublic f ()V\n')
+        write(b, 'class B\nuses A\n')
+        write(c, 'class C\nuses B\n')
+
+        def build():
+            if self.log.exists():
+                self.log.remove()
+            java.build_objects([c, b, a], dst=dst, **kwargs)
+            return sorted(src for srcs in self.compiles() for src in srcs)
+
+        self.assertEquals(build(), [a, b, c])
+        self.assertEquals(build(), [])
+
+        # B comes before A, so it's up to date until A is compiled, but it's
+        # checked again and compiled in the same build. C doesn't need
+        # compiling since B's API is the same.
+        write(a, 'class A\npublic f ()V\npublic g ()V\n')
+        self.assertEquals(build(), [a, b])
+        self.assertEquals(build(), [])
+
+    def testBuildObjectsApi(self):
+        self.check_build_objects_api()
+
+    def testBuildObjectsApiBatch(self):
+        self.check_build_objects_api(batch=True)
+
+    def check_constants(self, **kwargs):
+        java = self.abi_java()
+
+        dst = self.buildroot / 'classes'
+        dst.makedirs()
+
+        a, b, c = self.srcs
+        def write(src, text):
+            with open(src, 'w') as f:
+                f.write(text)
+
+        # B only uses a constant of A, which javac copies into B.
+        write(a, 'class A\nconst X 1\n')
+        write(b, 'class B\n')
+        write(c, 'class C\nuses A\n')
+
+        def build():
+            if self.log.exists():
+                self.log.remove()
+            java.build_objects([b, c, a], dst=dst, **kwargs)
+            return sorted(src for srcs in self.compiles() for src in srcs)
+
+        self.assertEquals(build(), [a, b, c])
+        self.assertEquals(build(), [])
+
+        write(a, 'class A\nconst X 1\nprivate g ()V\n')
+        self.assertEquals(build(), [a])
+
+        # Changing the constant compiles everything again.
+        write(a, 'class A\nconst X 2\nprivate g ()V\n')
+        self.assertEquals(build(), [a, b, c])
+        self.assertEquals(build(), [])
+
+    def testConstants(self):
+        self.check_constants()
+
+    def testConstantsBatch(self):
+        self.check_constants(batch=True)
+
+    def check_classpath_api(self, **kwargs):
+        java = self.abi_java()
+
+        lib = self.buildroot / 'lib'
+        classes = self.buildroot / 'classes'
+        lib.makedirs()
+        classes.makedirs()
+
+        a, b = self.srcs[:2]
+        def write(src, text):
+            with open(src, 'w') as f:
+                f.write(text)
+
+        write(a, 'class A\npublic f ()V\n')
+        write(b, 'class B\nuses A\n')
+
+        def build():
+            if self.log.exists():
+                self.log.remove()
+            java.build_objects([a], dst=lib, **kwargs)
+            java.build_objects([b], dst=classes, classpaths=[lib], **kwargs)
+            return self.compiles()
+
+        self.assertEquals(build(), [[a], [b]])
+        self.assertEquals(build(), [])
+
+        # B's build_objects depends on A's API through the classpath.
+        write(a, 'class A\npublic f ()V\nprivate g ()V\n')
+        self.assertEquals(build(), [[a]])
+
+        write(a, 'class A\npublic f ()V\npublic g ()V\n')
+        self.assertEquals(build(), [[a], [b]])
+
+    def testClasspathApi(self):
+        self.check_classpath_api()
+
+    def testClasspathApiBatch(self):
+        self.check_classpath_api(batch=True)
+
+    def testJar(self):
+        jar = fbuild.builders.java.Jar(self.ctx)
+
+        classes = self.buildroot / 'classes'
+        (classes / 'p').makedirs()
+        for name in 'A', 'B':
+            with open(classes / 'p' / name + '.class', 'wb') as f:
+                f.write(test_classfile.make_class('p/' + name))
+
+        manifest = self.srcdir / 'manifest.txt'
+        with open(manifest, 'w') as f:
+            f.write('Main-Class: p.A\n\n')
+
+        def create(dst):
+            return jar.uncached_create(dst, [classes / 'p'],
+                manifest=manifest,
+                cwd=classes,
+                quieter=1)
+
+        dst = create('a.jar')
+        with zipfile.ZipFile(dst) as f:
+            self.assertEquals(f.namelist(), [
+                'META-INF/', 'META-INF/MANIFEST.MF', 'p/A.class', 'p/B.class'])
+            self.assertEquals(f.read('META-INF/MANIFEST.MF'),
+                b'Manifest-Version: 1.0\r\n'
+                b'Created-By: fbuild\r\n'
+                b'Main-Class: p.A\r\n')
+
+        # The same files make the same jar, and an up to date jar isn't
+        # touched.
+        with open(dst, 'rb') as f:
+            data = f.read()
+        with open(create('b.jar'), 'rb') as f:
+            self.assertEquals(f.read(), data)
+
+        mtime = dst.getmtime() - 10
+        os.utime(dst, (mtime, mtime))
+        self.assertEquals(create('a.jar').getmtime(), mtime)
+
+        with open(classes / 'p' / 'B.class', 'ab') as f:
+            f.write(b'\0')
+        self.assertNotEquals(create('a.jar').getmtime(), mtime)
+        with open(dst, 'rb') as f:
+            self.assertNotEquals(f.read(), data)
+
+    def testAttribute(self):
+        dst = self.buildroot / 'classes'
+        dst.makedirs()
+
+        # The srcs named A.java can't be told apart by their classes, so
+        # they're compiled separately.
+        srcs = []
+        for package in 'p', 'q':
+            (self.srcdir / package).makedirs()
+            src = self.srcdir / package / 'A.java'
+            with open(src, 'w') as f:
+                f.write('package %s\n' % package)
+            srcs.append(src)
+        srcs.append(self.srcs[1])
+
+        self.log.remove()
+        self.java.build_objects(srcs, dst=dst, batch=True)
+        self.assertEquals(sorted(self.compiles()),
+            [[srcs[0], srcs[2]], [srcs[1]]])
+
+        for src, package in zip(srcs, ['p', 'q', '']):
+            name = src.name.replaceext('')
+            self.assertEquals(self.java.compile(src, dst=dst), [
+                dst / package / name + '.class',
+                dst / package / name + '$1.class'])
+        self.assertEquals(len(self.compiles()), 2)
+
+    def testAttributeFallback(self):
+        dst = self.buildroot / 'classes'
+        dst.makedirs()
+
+        # Without the names of the srcs in the classes, the srcs are compiled
+        # again one at a time.
+        self.log.remove()
+        dsts = self.java.build_objects(self.srcs, dst=dst, batch=True,
+            flags=['-g:none'])
+        self.assertEquals(self.compiles(),
+            [self.srcs] + [[src] for src in self.srcs])
+        self.assertEquals(sorted(dsts), sorted(
+            dst / name for name in os.listdir(dst) if name.endswith('.class')))
+
+        for src in self.srcs:
+            name = src.name.replaceext('')
+            self.assertEquals(self.java.compile(src, dst=dst,
+                flags=['-g:none']), [
+                    dst / name + '.class', dst / name + '$1.class'])
+        self.assertEquals(len(self.compiles()), 4)
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    return unittest.TestLoader().loadTestsFromTestCase(TestJava)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3.1
+
+import os
+import threading
+import time
+import unittest
+
+from fbuild.jobserver import Server, from_makeflags
+from fbuild.sched import Scheduler
+
+# -----------------------------------------------------------------------------
+
+class TestJobserver(unittest.TestCase):
+    def setUp(self):
+        self.old_makeflags = os.environ.get('MAKEFLAGS')
+
+        # Pretend to be the make that started us.
+        self.make = Server(2)
+        os.environ['MAKEFLAGS'] = self.make.makeflags('')
+
+    def tearDown(self):
+        if self.old_makeflags is None:
+            os.environ.pop('MAKEFLAGS', None)
+        else:
+            os.environ['MAKEFLAGS'] = self.old_makeflags
+
+        self.make.close()
+
+    def testTokens(self):
+        client = from_makeflags(os.environ['MAKEFLAGS'])
+        self.assertEquals(client.jobs, 2)
+
+        # We get the implicit token and the one in the pipe.
+        tokens = [client.acquire(), client.acquire()]
+        self.assertEquals(tokens, [None, b'+'])
+
+        # There aren't any more, so we don't wait for one if we're asked not
+        # to.
+        self.assertRaises(BlockingIOError, client.acquire, block=False)
+
+        for token in tokens:
+            client.release(token)
+
+        self.assertEquals(client.acquire(), None)
+        self.assertEquals(client.acquire(), b'+')
+
+    def testClient(self):
+        scheduler = Scheduler(4, jobserver=True)
+        try:
+            self.assertEquals(scheduler.jobserver.makeflags('x'), 'x')
+
+            lock = threading.Lock()
+            running = 0
+            max_running = 0
+
+            def f(x):
+                nonlocal running, max_running
+                with lock:
+                    running += 1
+                    max_running = max(max_running, running)
+                time.sleep(0.01)
+                with lock:
+                    running -= 1
+                return x
+
+            self.assertEquals(scheduler.map(f, range(10)), list(range(10)))
+
+            # make only gave us two job slots.
+            self.assertTrue(max_running <= 2)
+        finally:
+            scheduler.shutdown()
+
+    def testNestedMap(self):
+        scheduler = Scheduler(4, jobserver=True)
+
+        def inner(x):
+            time.sleep(0.01)
+            return x
+
+        def outer(x):
+            return scheduler.map(inner, range(x * 4, x * 4 + 4))
+
+        # The workers that don't have one of make's two tokens mustn't hold
+        # on to the nested tasks that the workers that do are waiting on.
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(scheduler.map(outer, range(4))))
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive(), 'the nested map deadlocked')
+
+        scheduler.shutdown()
+        self.assertEquals(results,
+            [[list(range(x * 4, x * 4 + 4)) for x in range(4)]])
+
+    def testServer(self):
+        del os.environ['MAKEFLAGS']
+
+        scheduler = Scheduler(4, jobserver=True)
+        try:
+            makeflags = scheduler.jobserver.makeflags(' -k -- FOO=bar')
+            self.assertEquals(makeflags,
+                '-k -j4 --jobserver-auth=%d,%d -- FOO=bar' % (
+                    scheduler.jobserver.read_fd,
+                    scheduler.jobserver.write_fd))
+
+            self.assertEquals(scheduler.map(lambda x: x + 1, range(10)),
+                list(range(1, 11)))
+        finally:
+            scheduler.shutdown()
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    return unittest.TestLoader().loadTestsFromTestCase(TestJobserver)
+
+if __name__ == "__main__":
+    unittest.main()
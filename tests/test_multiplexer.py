@@ -0,0 +1,148 @@
+#!/usr/bin/env python3.1
+
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from fbuild.subprocess.multiplexer import Multiplexer, OutputBuffer
+
+# -----------------------------------------------------------------------------
+
+class TestMultiplexer(unittest.TestCase):
+    def setUp(self):
+        self.multiplexer = Multiplexer()
+        self.multiplexer.start()
+
+    def tearDown(self):
+        self.multiplexer.shutdown()
+
+    def python(self, code, **kwargs):
+        return self.multiplexer.execute([sys.executable, '-c', code], **kwargs)
+
+    def testExecute(self):
+        self.assertEquals(
+            self.python('import sys; print("a"); print("b", file=sys.stderr)'),
+            (0, b'a\n', b'b\n', False))
+
+        self.assertEquals(
+            self.python('import sys; sys.exit(3)'),
+            (3, b'', b'', False))
+
+    def testInput(self):
+        data = b'x' * 1000000
+        returncode, stdout, stderr, timed_out = self.python(
+            'import sys; sys.stdout.write(sys.stdin.read())',
+            input=data)
+
+        self.assertEquals(returncode, 0)
+        self.assertEquals(stdout, data)
+
+    def testTimeout(self):
+        starttime = time.time()
+        returncode, stdout, stderr, timed_out = self.python(
+            'import time; time.sleep(10)',
+            timeout=0.1)
+
+        self.assertTrue(timed_out)
+        self.assertTrue(returncode != 0)
+        self.assertTrue(time.time() - starttime < 5)
+
+    def testUsage(self):
+        result = self.python(
+            'import time\n'
+            't = time.process_time() + 0.2\n'
+            'while time.process_time() < t: pass\n')
+
+        self.assertEquals(result.returncode, 0)
+        self.assertTrue(result.usage.user_time + result.usage.system_time
+            >= 0.1)
+        self.assertTrue(result.usage.max_rss > 0)
+
+    def testHook(self):
+        lines = []
+        result = self.python(
+            'import sys, time\n'
+            'for i in range(3):\n'
+            '    print(i, end="" if i == 2 else "\\n", flush=True)\n'
+            '    time.sleep(0.01)\n',
+            stdout_buffer=OutputBuffer(hook=lines.append))
+
+        self.assertEquals(result.stdout, b'0\n1\n2')
+        self.assertEquals(lines, [b'0\n', b'1\n', b'2'])
+
+    def testHookThread(self):
+        # The hooks run in the thread that runs the command, not the event
+        # loop's.
+        threads = []
+        self.python('print(1)',
+            stdout_buffer=OutputBuffer(
+                hook=lambda line: threads.append(threading.current_thread())))
+
+        self.assertEquals(threads, [threading.current_thread()])
+
+    def testLongLine(self):
+        lines = []
+        buffer = OutputBuffer(hook=lines.append, limit=10)
+        for i in range(25):
+            buffer.feed(b'x')
+        buffer.feed(b'\nyy\nz')
+
+        # A line longer than the limit is passed on in pieces.
+        self.assertEquals(buffer.close(), b'xxxxx\nyy\nz')
+        self.assertEquals(lines,
+            [b'x' * 11, b'x' * 11, b'xxx\n', b'yy\n', b'z'])
+
+    def testHookError(self):
+        def hook(line):
+            raise ValueError(line)
+
+        self.assertRaises(ValueError, self.python,
+            'import time; print(1, flush=True); time.sleep(10)',
+            stdout_buffer=OutputBuffer(hook=hook))
+
+    def testOutputLimit(self):
+        spill_dir = tempfile.mkdtemp()
+        try:
+            buffer = OutputBuffer(limit=1000, spill_dir=spill_dir)
+            result = self.python(
+                'import sys\n'
+                'for i in range(10000): print(i)\n',
+                stdout_buffer=buffer)
+
+            data = ''.join('%d\n' % i for i in range(10000)).encode()
+
+            self.assertEquals(result.stdout, data[-1000:])
+            with open(buffer.spill_file, 'rb') as f:
+                self.assertEquals(f.read(), data)
+        finally:
+            shutil.rmtree(spill_dir)
+
+    def testConcurrent(self):
+        results = []
+        lock = threading.Lock()
+
+        def f(i):
+            result = self.python('print(%d)' % i)
+            with lock:
+                results.append(result)
+
+        threads = [threading.Thread(target=f, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(
+            sorted(results),
+            sorted((0, ('%d\n' % i).encode(), b'', False) for i in range(20)))
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    return unittest.TestLoader().loadTestsFromTestCase(TestMultiplexer)
+
+if __name__ == "__main__":
+    unittest.main()
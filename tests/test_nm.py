@@ -0,0 +1,97 @@
+#!/usr/bin/env python3.1
+
+import os
+import sys
+import unittest
+
+import fbuild.builders.nm
+from fbuild.path import Path
+
+from helpers import make_context, make_tempdir
+from test_elf import make_elf
+
+# -----------------------------------------------------------------------------
+
+# A stand in for nm -gP that logs the objects it was run on. Each object lists
+# the symbols it defines, and the ones it uses prefixed with a "-".
+fake_nm = '''\
+#!%s
+import sys
+obj = sys.argv[-1]
+with open(%r, 'a') as f:
+    f.write(obj + '\\n')
+for symbol in open(obj).read().split():
+    if symbol.startswith('-'):
+        print('%%s U' %% symbol[1:])
+    else:
+        print('%%s T 0 0' %% symbol)
+'''
+
+class TestNm(unittest.TestCase):
+    def setUp(self):
+        self.buildroot = make_tempdir(self)
+
+        self.log = self.buildroot / 'nm.log'
+        exe = self.buildroot / 'nm'
+        with open(exe, 'w') as f:
+            f.write(fake_nm % (sys.executable, str(self.log)))
+        os.chmod(exe, 0o755)
+
+        self.ctx = make_context(self, self.buildroot, '-j2')
+
+        self.nm = fbuild.builders.nm.Nm(self.ctx, exe)
+
+    def write(self, name, text):
+        path = self.buildroot / name
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def runs(self):
+        if not self.log.exists():
+            return []
+        with open(self.log) as f:
+            runs = sorted(Path(line.strip()).name for line in f)
+        self.log.remove()
+        return runs
+
+    def testObjectDependencies(self):
+        objs = [
+            self.write('main.o', 'main -f -printf'),
+            self.write('f.o', 'f -g'),
+            self.write('g.o', 'g'),
+        ]
+
+        self.assertEqual(self.nm.object_dependencies(objs), objs)
+        self.assertEqual(self.runs(), ['f.o', 'g.o', 'main.o'])
+
+        # The objects don't need to be in order.
+        self.assertEqual(self.nm.object_dependencies(objs[::-1]), objs)
+        self.assertEqual(self.runs(), [])
+
+        # Only the object that changed is read again, and the objects can
+        # depend on each other.
+        self.write('g.o', 'g -f')
+        self.assertEqual(self.nm.object_dependencies(objs), objs)
+        self.assertEqual(self.runs(), ['g.o'])
+
+    def testReadElf(self):
+        nm = fbuild.builders.nm.Nm(self.ctx, self.nm.exe, read_elf=True)
+
+        main = self.buildroot / 'main.o'
+        with open(main, 'wb') as f:
+            f.write(make_elf([(b'main', 1, 2, 1), (b'f', 1, 0, 0)]))
+
+        objs = [main, self.write('f.o', 'f')]
+        self.assertEqual(nm.object_dependencies(objs), objs)
+
+        # Only the object that isn't ELF needed nm.
+        self.assertEqual(self.runs(), ['f.o'])
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    return unittest.TestLoader().loadTestsFromTestCase(TestNm)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3.1
+
+import os
+import sys
+import unittest
+
+import fbuild
+import fbuild.builders.ocaml
+from fbuild.path import Path
+
+from helpers import make_context, make_tempdir
+
+# -----------------------------------------------------------------------------
+
+# A stand in for ocamldep -modules that logs the srcs it was run on. Each src
+# lists the modules it uses as capitalized words, like B or B.x, and a src
+# that says "error" fails.
+fake_ocamldep = '''\
+#!%s
+import sys
+srcs = sys.argv[2:]
+with open(%r, 'a') as f:
+    f.write(' '.join(srcs) + '\\n')
+for src in srcs:
+    words = open(src).read().split()
+    if 'error' in words:
+        print('syntax error in ' + src, file=sys.stderr)
+        sys.exit(2)
+    modules = [w.partition('.')[0] for w in words if w[0].isupper()]
+    print('%%s:%%s' %% (src, ''.join(' ' + m for m in modules)))
+'''
+
+# A stand in for ocamlc and ocamlopt that logs the srcs it compiled, along with
+# when it started and finished. If there's a file named delay next to it, each
+# compile takes that many seconds. The
+# interface of a module is the lines of its source that start with "val", and
+# linking makes a script that prints 5, which is what the configuration checks
+# expect.
+fake_ocamlc = '''\
+#!%s
+import os
+import sys
+import time
+args = sys.argv[1:]
+if '-version' in args:
+    print('4.14.0')
+    sys.exit(0)
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+dst = args[args.index('-o') + 1]
+if '-c' in args:
+    src = args[-1]
+    start = time.time()
+    delay = os.path.join(os.path.dirname(sys.argv[0]), 'delay')
+    if os.path.exists(delay):
+        time.sleep(float(open(delay).read()))
+
+    text = open(src).read()
+    interface = ''.join(line for line in text.splitlines(True)
+        if line.startswith('val'))
+
+    if src.endswith('.mli'):
+        write(dst, interface)
+    else:
+        write(dst, text)
+        base = os.path.splitext(dst)[0]
+        if dst.endswith('.cmx'):
+            write(base + '.o', text)
+        if not os.path.exists(src[:-3] + '.mli'):
+            write(base + '.cmi', interface)
+
+    with open(%r, 'a') as f:
+        f.write('%%s %%s %%f %%f\\n' %% (
+            os.path.basename(sys.argv[0]), src, start, time.time()))
+else:
+    write(dst, '#!/bin/sh\\nprintf 5\\n')
+    os.chmod(dst, 0o755)
+    if dst.endswith('.cmxa'):
+        write(dst[:-5] + '.a', '')
+'''
+
+def write_script(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+    os.chmod(path, 0o755)
+
+class OcamlTestCase(unittest.TestCase):
+    """Builds the srcs written to a temporary srcdir into a temporary
+    buildroot, with I{jobs} jobs."""
+
+    jobs = 2
+
+    def setUp(self):
+        self.buildroot = make_tempdir(self)
+        self.srcdir = make_tempdir(self)
+
+        self.ctx = make_context(self, self.buildroot, '-j%d' % self.jobs)
+
+    def write(self, name, text):
+        path = self.srcdir / name
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+# -----------------------------------------------------------------------------
+
+class TestOcamldep(OcamlTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.log = self.buildroot / 'ocamldep.log'
+        exe = self.buildroot / 'ocamldep'
+        write_script(exe, fake_ocamldep % (sys.executable, str(self.log)))
+
+        self.ocamldep = fbuild.builders.ocaml.Ocamldep(self.ctx, exe)
+
+        self.srcs = [self.write('a.ml', 'B C'), self.write('b.ml', ''),
+            self.write('c.mli', 'List')]
+
+    def runs(self):
+        if not self.log.exists():
+            return []
+        with open(self.log) as f:
+            runs = [line.split() for line in f]
+        self.log.remove()
+        return runs
+
+    def testBatch(self):
+        modules = [('B', 'C'), (), ('List',)]
+
+        self.assertEquals(self.ocamldep.modules_batch(self.srcs), modules)
+        self.assertEquals(self.runs(), [self.srcs])
+
+        # The results were cached for each src.
+        for src, m in zip(self.srcs, modules):
+            self.assertEquals(self.ocamldep.modules(src), m)
+        self.assertEquals(self.runs(), [])
+
+        # Only the srcs that changed are run again.
+        self.write('b.ml', 'A')
+        self.write('c.mli', 'Array')
+        self.assertEquals(self.ocamldep.modules_batch(self.srcs),
+            [('B', 'C'), ('A',), ('Array',)])
+        self.assertEquals(self.runs(), [self.srcs[1:]])
+
+        self.assertEquals(self.ocamldep.modules_batch(self.srcs),
+            [('B', 'C'), ('A',), ('Array',)])
+        self.assertEquals(self.runs(), [])
+
+    def testBatchError(self):
+        self.write('b.ml', 'error')
+
+        # The batch failed, so each src was run on its own to find the one
+        # with the error.
+        self.assertRaises(fbuild.ExecutionError,
+            self.ocamldep.modules_batch, self.srcs)
+        self.assertEquals(self.runs(),
+            [self.srcs, self.srcs[:1], self.srcs[1:2]])
+
+        # Once the error is fixed, the srcs are batched again.
+        self.write('b.ml', 'C')
+        self.assertEquals(self.ocamldep.modules_batch(self.srcs),
+            [('B', 'C'), ('C',), ('List',)])
+        self.assertEquals(self.runs(), [self.srcs])
+
+    def testSourceDependencies(self):
+        includes = self.buildroot / 'include'
+        includes.makedirs()
+        with open(includes / 'C.ml', 'w') as f:
+            f.write('')
+
+        self.assertEquals(
+            set(self.ocamldep.source_dependencies(self.srcs[0],
+                includes=[self.srcdir, includes])),
+            {includes / 'C.ml', self.srcdir / 'b.ml', self.srcdir / 'c.mli'})
+
+    def testListdir(self):
+        listdir = self.ocamldep._listdir
+        self.assertEquals(listdir(self.srcdir), {'a.ml', 'b.ml', 'c.mli'})
+        self.assertEquals(listdir(self.srcdir / 'missing'), None)
+
+        # The directory was just changed, so it might change again without
+        # its modification time changing.
+        self.assertTrue(listdir(self.srcdir) is not listdir(self.srcdir))
+
+        # Once it's old enough, the listing is reused until the directory
+        # changes.
+        self.age(self.srcdir)
+        self.assertTrue(listdir(self.srcdir) is listdir(self.srcdir))
+
+        self.write('d.ml', '')
+        self.assertEquals(listdir(self.srcdir),
+            {'a.ml', 'b.ml', 'c.mli', 'd.ml'})
+
+        # The directory is listed again even if its modification time looks
+        # the same.
+        st = self.age(self.srcdir)
+        listdir(self.srcdir)
+        self.write('e.ml', '')
+        os.utime(self.srcdir, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEquals(listdir(self.srcdir),
+            {'a.ml', 'b.ml', 'c.mli', 'd.ml', 'e.ml'})
+
+    def age(self, path):
+        """Make the path look like it was last modified a while ago."""
+        st = os.stat(path)
+        os.utime(path, (st.st_atime - 10, st.st_mtime - 10))
+        return os.stat(path)
+
+# -----------------------------------------------------------------------------
+
+class TestOcamlc(OcamlTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.log = self.buildroot / 'ocamlc.log'
+        ocamldep = self.buildroot / 'ocamldep'
+        write_script(ocamldep, fake_ocamldep % (sys.executable,
+            str(self.buildroot / 'ocamldep.log')))
+        ocamlc = self.buildroot / 'ocamlc'
+        write_script(ocamlc, fake_ocamlc % (sys.executable, str(self.log)))
+
+        self.ocamlc = fbuild.builders.ocaml.Ocamlc(self.ctx, ocamlc,
+            ocamldep=fbuild.builders.ocaml.Ocamldep(self.ctx, ocamldep))
+
+        if self.log.exists():
+            self.log.remove()
+
+    def compiled(self):
+        if not self.log.exists():
+            return []
+        with open(self.log) as f:
+            compiled = sorted(Path(line.split()[1]).name for line in f)
+        self.log.remove()
+        return compiled
+
+    def testInterfaceCutoff(self):
+        srcs = [
+            self.write('a.ml', 'let y = B.x\n'),
+            self.write('b.ml', 'val x\nlet x = 1\n'),
+            self.write('c.mli', 'val z\n'),
+            self.write('c.ml', 'let z = 1\n'),
+            self.write('d.ml', 'let w = C.z\n'),
+        ]
+
+        self.ocamlc.build_objects(srcs)
+        self.assertEquals(self.compiled(),
+            ['a.ml', 'b.ml', 'c.ml', 'c.mli', 'd.ml'])
+
+        # Changing just the implementations doesn't recompile the modules
+        # that use them.
+        self.write('b.ml', 'val x\nlet x = 2\n')
+        self.write('c.ml', 'let z = 2\n')
+        self.ocamlc.build_objects(srcs)
+        self.assertEquals(self.compiled(), ['b.ml', 'c.ml'])
+
+        # But changing their interfaces does.
+        self.write('b.ml', 'val x\nval x2\nlet x = 2\nlet x2 = 3\n')
+        self.write('c.mli', 'val z\nval z2\n')
+        self.ocamlc.build_objects(srcs)
+        self.assertEquals(self.compiled(),
+            ['a.ml', 'b.ml', 'c.ml', 'c.mli', 'd.ml'])
+
+# -----------------------------------------------------------------------------
+
+class TestOcaml(OcamlTestCase):
+    jobs = 4
+
+    def setUp(self):
+        super().setUp()
+
+        self.log = self.buildroot / 'ocaml.log'
+        ocamldep = self.buildroot / 'ocamldep'
+        write_script(ocamldep, fake_ocamldep % (sys.executable,
+            str(self.buildroot / 'ocamldep.log')))
+
+        exes = {}
+        for name in 'ocamlc', 'ocamlcp', 'ocamlopt':
+            exes[name] = self.buildroot / name
+            write_script(exes[name], fake_ocamlc % (sys.executable,
+                str(self.log)))
+
+        self.ocaml = fbuild.builders.ocaml.Ocaml(self.ctx,
+            ocamldep=fbuild.builders.ocaml.Ocamldep(self.ctx, ocamldep),
+            **exes)
+
+        if self.log.exists():
+            self.log.remove()
+
+        with open(self.buildroot / 'delay', 'w') as f:
+            f.write('0.3')
+
+    def compiles(self):
+        compiles = {}
+        with open(self.log) as f:
+            for line in f:
+                exe, src, start, end = line.split()
+                compiles[exe, Path(src).name] = (float(start), float(end))
+        return compiles
+
+    def testBuildObjects(self):
+        srcs = [
+            self.write('a.mli', 'val y\n'),
+            self.write('a.ml', 'let y = B.x\n'),
+            self.write('b.ml', 'val x\nlet x = 1\n'),
+        ]
+
+        objs = self.ocaml.build_objects(srcs)
+        self.assertEquals([obj.name for obj in objs],
+            ['a.cmi', 'b.cmo', 'a.cmo', 'a.cmi', 'b.cmx', 'a.cmx'])
+
+        compiles = self.compiles()
+        self.assertEquals(sorted(compiles), [
+            ('ocamlc', 'a.ml'),
+            ('ocamlc', 'a.mli'),
+            ('ocamlc', 'b.ml'),
+            ('ocamlopt', 'a.ml'),
+            ('ocamlopt', 'b.ml'),
+        ])
+
+        # The interface was compiled once, and both compilers used it to
+        # compile its implementation at the same time.
+        bstart, bend = compiles['ocamlc', 'a.ml']
+        nstart, nend = compiles['ocamlopt', 'a.ml']
+        self.assertTrue(nstart < bend and bstart < nend)
+
+        # Both compilers write the .cmi of an implementation without an
+        # interface, so they took turns.
+        bstart, bend = compiles['ocamlc', 'b.ml']
+        nstart, nend = compiles['ocamlopt', 'b.ml']
+        self.assertTrue(bend <= nstart or nend <= bstart)
+
+        # And a.ml waited for both of them.
+        self.assertTrue(max(bend, nend) <=
+            min(compiles['ocamlc', 'a.ml'][0], compiles['ocamlopt', 'a.ml'][0]))
+
+    def testBuildLib(self):
+        lib = self.ocaml.build_lib('lib', [
+            self.write('a.ml', 'let y = B.x\n'),
+            self.write('b.ml', 'val x\nlet x = 1\n'),
+        ])
+
+        self.assertEquals(lib, (
+            self.buildroot / 'lib.byte.cma',
+            self.buildroot / 'lib.native.cmxa'))
+        self.assertTrue(all(path.exists() for path in lib))
+
+# -----------------------------------------------------------------------------
+
+class TestDependencyGraph(unittest.TestCase):
+    def setUp(self):
+        self.lookups = []
+
+    def graph(self, edges):
+        def f(src):
+            self.lookups.append(src)
+            return edges.get(src, ())
+        return fbuild.builders.ocaml.DependencyGraph(f)
+
+    def testClosure(self):
+        graph = self.graph({
+            'a': ['b', 'c'],
+            'b': ['d'],
+            'c': ['d'],
+            'd': ['e'],
+        })
+
+        self.assertEquals(graph.closure('a'), set('bcde'))
+        self.assertEquals(graph.closure('c'), set('de'))
+        self.assertEquals(graph.closure('e'), set())
+
+        # Each file was only looked up once.
+        self.assertEquals(sorted(self.lookups), list('abcde'))
+
+    def testCycle(self):
+        graph = self.graph({
+            'a': ['b'],
+            'b': ['c'],
+            'c': ['b', 'd'],
+        })
+
+        self.assertEquals(graph.closure('a'), set('bcd'))
+        self.assertEquals(graph.closure('b'), set('bcd'))
+        self.assertEquals(graph.closure('c'), set('bcd'))
+        self.assertEquals(graph.closure('d'), set())
+
+    def testDeep(self):
+        # The walk doesn't recurse, so long chains are fine.
+        n = 5000
+        graph = self.graph({i: [i + 1] for i in range(n)})
+
+        self.assertEquals(len(graph.closure(0)), n)
+        self.assertEquals(len(graph.closure(n // 2)), n - n // 2)
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestOcamldep))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestOcamlc))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestOcaml))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+        TestDependencyGraph))
+    return suite
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3.1
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import fbuild.builders.c.gcc
+from fbuild.path import Path
+from fbuild.remote import Pool, Worker, digest_bytes
+
+from helpers import make_context
+
+# -----------------------------------------------------------------------------
+
+class RemoteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+
+        self.workers = []
+        self.address = self.start_worker(Worker, 'worker')
+        self.pool = Pool([self.address], secret=b'secret')
+
+    def start_worker(self, cls, name, secret=b'secret'):
+        """Start a worker of the class I{cls} in the background, and return
+        its address."""
+        worker = cls(
+            secret=secret,
+            jobs=2,
+            root=os.path.join(self.tmpdir, name))
+        thread = threading.Thread(target=worker.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.workers.append(worker)
+        return '%s:%d' % worker.server_address
+
+    def tearDown(self):
+        self.pool.close()
+        for worker in self.workers:
+            worker.shutdown()
+            worker.server_close()
+        os.chdir(self.cwd)
+        Path(self.tmpdir).rmtree()
+
+
+class TestRemote(RemoteTestCase):
+    def testSlots(self):
+        self.assertEquals(self.pool.slots, 2)
+
+    def testWrongSecret(self):
+        pool = Pool([self.address], secret=b'wrong')
+        try:
+            self.assertEquals(pool.slots, 0)
+            self.assertFalse(pool.idle())
+        finally:
+            pool.close()
+
+    def testExecute(self):
+        with open('input.txt', 'w') as f:
+            f.write('hello')
+
+        code = ';'.join((
+            'import sys',
+            'data = open("input.txt").read()',
+            'open("out/output.txt", "w").write(data.upper())',
+            'print(data)',
+            'sys.exit(3)'))
+
+        result = self.pool.execute([sys.executable, '-c', code],
+            inputs=['input.txt'],
+            outputs=['out/output.txt'])
+
+        self.assertEquals(result, (3, b'hello\n', b'', False))
+        with open('out/output.txt') as f:
+            self.assertEquals(f.read(), 'HELLO')
+
+    def testNoFreeSlots(self):
+        # Take all the slots so that there's nothing left for us to use.
+        connections = [self.pool._idle.get() for i in range(self.pool.slots)]
+        try:
+            self.assertEquals(
+                self.pool.execute([sys.executable, '-c', 'pass'],
+                    inputs=[],
+                    outputs=[]),
+                None)
+        finally:
+            for connection in connections:
+                self.pool._idle.put(connection)
+
+    def testImpostorWorker(self):
+        # A worker that doesn't know the secret can't get us to trust it,
+        # even if it lets anyone in.
+        class ImpostorWorker(Worker):
+            def verify(self, signature, role, *challenges):
+                return True
+
+        pool = Pool([self.start_worker(ImpostorWorker, 'impostor',
+            secret=b'wrong')], secret=b'secret')
+        try:
+            self.assertEquals(pool.slots, 0)
+        finally:
+            pool.close()
+
+    def check_bad_worker(self, cls):
+        """Make sure nothing is written when the worker of the class I{cls}
+        sends back outputs we didn't ask for."""
+        pool = Pool([self.start_worker(cls, 'bad')], secret=b'secret')
+        try:
+            self.assertEquals(pool.execute([sys.executable, '-c', 'pass'],
+                inputs=[],
+                outputs=['out/output.txt']), None)
+        finally:
+            pool.close()
+
+        self.assertFalse(Path('out/output.txt').exists())
+        self.assertFalse(Path('../evil.txt').exists())
+
+    def testUnexpectedOutput(self):
+        class BadWorker(Worker):
+            def run_command(self, msg):
+                self.save_blob(digest_bytes(b'evil'), b'evil')
+                result = super().run_command(msg)
+                result['outputs']['../evil.txt'] = digest_bytes(b'evil')
+                return result
+
+        self.check_bad_worker(BadWorker)
+
+    def testCorruptOutput(self):
+        class BadWorker(Worker):
+            def run_command(self, msg):
+                self.save_blob(digest_bytes(b'good'), b'evil')
+                result = super().run_command(msg)
+                result['outputs']['out/output.txt'] = digest_bytes(b'good')
+                return result
+
+        self.check_bad_worker(BadWorker)
+
+# -----------------------------------------------------------------------------
+
+@unittest.skipUnless(shutil.which('gcc'), 'gcc is not installed')
+class TestRemoteGcc(RemoteTestCase):
+    """Compile through a context that's connected to the worker."""
+
+    def setUp(self):
+        super().setUp()
+
+        with open('secret', 'w') as f:
+            f.write('secret')
+
+        self.ctx = make_context(self, 'build', '-j1',
+            '--remote', self.address,
+            '--remote-secret-file', 'secret')
+        self.gcc = fbuild.builders.c.gcc.static(self.ctx)
+
+        with open('main.c', 'w') as f:
+            f.write('int main(void) { return 0; }\n')
+
+        # Record the commands each side runs.
+        self.remote_cmds = []
+        run_command = self.workers[0].run_command
+        def remote_run_command(msg):
+            self.remote_cmds.append(msg['cmd'])
+            return run_command(msg)
+        self.workers[0].run_command = remote_run_command
+
+        self.cmds = []
+        execute = self.ctx.execute
+        def ctx_execute(cmd, *args, **kwargs):
+            self.cmds.append(cmd)
+            return execute(cmd, *args, **kwargs)
+        self.ctx.execute = ctx_execute
+
+    def tearDown(self):
+        # The context's paths are relative to the temporary directory.
+        self.ctx.shutdown()
+        super().tearDown()
+
+    def testSlots(self):
+        self.assertEquals(self.ctx.remote.slots, 2)
+
+    def testRemoteCompile(self):
+        obj = self.gcc.uncached_compile('main.c', quieter=1)
+        self.assertTrue(obj.exists())
+
+        # The source is preprocessed locally, and compiled remotely.
+        self.assertEquals(len(self.cmds), 2)
+        self.assertEquals(len(self.remote_cmds), 1)
+        self.assertIn('-c', self.remote_cmds[0])
+
+    def testNoFreeSlots(self):
+        # Without a free slot, the source is compiled locally in one step.
+        connections = [self.ctx.remote._idle.get()
+            for i in range(self.ctx.remote.slots)]
+        try:
+            obj = self.gcc.uncached_compile('main.c', quieter=1)
+        finally:
+            for connection in connections:
+                self.ctx.remote._idle.put(connection)
+
+        self.assertTrue(obj.exists())
+        self.assertEquals(len(self.cmds), 1)
+        self.assertEquals(self.remote_cmds, [])
+
+    def testShutdown(self):
+        self.gcc.uncached_compile('main.c', quieter=1)
+
+        connections = [self.ctx.remote._idle.get()
+            for i in range(self.ctx.remote.slots)]
+        for connection in connections:
+            self.ctx.remote._idle.put(connection)
+        self.assertTrue(any(connection.socket is not None
+            for connection in connections))
+
+        self.ctx.shutdown()
+        self.assertTrue(all(connection.socket is None
+            for connection in connections))
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestRemote))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestRemoteGcc))
+    return suite
+
+if __name__ == "__main__":
+    unittest.main()
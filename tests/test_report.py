@@ -0,0 +1,120 @@
+#!/usr/bin/env python3.1
+
+import sys
+import unittest
+
+import fbuild.db
+import fbuild.report
+
+from helpers import make_context, make_tempdir
+
+# -----------------------------------------------------------------------------
+
+@fbuild.db.caches
+def run(ctx, code):
+    stdout, stderr = ctx.execute([sys.executable, '-c', code], 'python')
+    return stdout
+
+
+@fbuild.db.caches
+def run_nested(ctx, code, nested_code):
+    """Run a command, then run another one in a nested task."""
+    stdout, stderr = ctx.execute([sys.executable, '-c', code], 'python')
+    ctx.scheduler.map(
+        lambda code: ctx.execute([sys.executable, '-c', code], 'nested'),
+        [nested_code])
+    return stdout
+
+
+class TestReport(unittest.TestCase):
+    def setUp(self):
+        self.buildroot = make_tempdir(self)
+
+    def make_context(self, engine):
+        return make_context(self, self.buildroot, '--database-engine', engine)
+
+    def testRecordCommands(self):
+        for engine in 'pickle', 'sqlite':
+            ctx = self.make_context(engine)
+            try:
+                self.assertEquals(run(ctx, 'print(1)'), b'1\n')
+                self.assertEquals(run(ctx, 'print(2)'), b'2\n')
+            finally:
+                ctx.shutdown()
+
+            # The commands should be saved along with the calls.
+            ctx = self.make_context(engine)
+            try:
+                commands = ctx.db.find_commands()
+            finally:
+                ctx.shutdown()
+
+            self.assertEquals(len(commands), 2, engine)
+            for fun_name, command in commands:
+                self.assertEquals(fun_name, 'test_report.run')
+                self.assertEquals(command.builder, 'python')
+                self.assertEquals(command.returncode, 0)
+                self.assertTrue(command.seconds > 0)
+                if ctx.multiplexer is not None:
+                    self.assertTrue(command.max_rss > 0)
+
+            self.assertEquals(fbuild.report.summarize(commands)[0][:2],
+                ('python', 2))
+
+            self.buildroot.rmtree()
+            self.buildroot.makedirs()
+
+    def testThisBuild(self):
+        ctx = self.make_context('pickle')
+        try:
+            run(ctx, 'print(1)')
+        finally:
+            ctx.shutdown()
+
+        ctx = self.make_context('pickle')
+        try:
+            run(ctx, 'print(1)')
+            run(ctx, 'print(2)')
+
+            # The first call was cached, so only the second ran a command in
+            # this build.
+            commands = ctx.db.find_commands(this_build=True)
+            self.assertEquals([c.cmd for f, c in commands],
+                [sys.executable + ' -c print(2)'])
+            self.assertEquals(len(ctx.db.find_commands()), 2)
+        finally:
+            ctx.shutdown()
+
+    def testNestedTask(self):
+        # With one thread, the thread running the cached call also runs the
+        # nested task while it waits for it. The nested task's command isn't
+        # part of the cached call.
+        ctx = make_context(self, self.buildroot, '-j1')
+        ctx.scheduler.map(lambda code: run_nested(ctx, code, 'print(2)'),
+            ['print(1)'])
+
+        commands = ctx.db.find_commands(this_build=True)
+        self.assertEquals(
+            [(f, c.builder, c.cmd) for f, c in commands],
+            [('test_report.run_nested', 'python',
+                sys.executable + ' -c print(1)')])
+
+    def testSummarize(self):
+        commands = [
+            ('f', fbuild.db.Command('a 1', 'a', 0, 1.0, 0.5, 0.25, 100)),
+            ('f', fbuild.db.Command('a 2', 'a', 0, 2.0, 1.5, 0.5, 300)),
+            ('g', fbuild.db.Command('b 1', 'b', 1, 5.0, None, None, None)),
+        ]
+
+        self.assertEquals(fbuild.report.summarize(commands), [
+            ('b', 1, 5.0, 0.0, 0.0, 0),
+            ('a', 2, 3.0, 2.0, 0.75, 300),
+        ])
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    return unittest.TestLoader().loadTestsFromTestCase(TestReport)
+
+if __name__ == "__main__":
+    unittest.main()
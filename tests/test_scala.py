@@ -0,0 +1,100 @@
+#!/usr/bin/env python3.1
+
+import os
+import sys
+import unittest
+
+import fbuild.builders.scala
+
+from helpers import make_context, make_tempdir
+
+# -----------------------------------------------------------------------------
+
+# A stand in for fsc that logs how it was called, and pretends to start a
+# server if the server file doesn't exist.
+fake_fsc = '''\
+#!%s
+import os, sys
+log, server = %r, %r
+with open(log, 'a') as f:
+    f.write(' '.join(sys.argv[1:]) + '\\n')
+if '-shutdown' in sys.argv:
+    os.remove(server)
+elif not os.path.exists(server):
+    open(server, 'w').close()
+    if '-verbose' in sys.argv:
+        print('[Executing command: java scala.tools.nsc.CompileServer]')
+'''
+
+class TestFsc(unittest.TestCase):
+    def setUp(self):
+        self.buildroot = make_tempdir(self)
+
+        self.log = self.buildroot / 'fsc.log'
+        self.server = self.buildroot / 'server'
+        self.fsc = self.buildroot / 'fsc'
+        with open(self.fsc, 'w') as f:
+            f.write(fake_fsc % (sys.executable, str(self.log),
+                str(self.server)))
+        os.chmod(self.fsc, 0o755)
+
+        self.ctx = make_context(self, self.buildroot, '-j1')
+
+    def calls(self):
+        with open(self.log) as f:
+            return [line.split() for line in f]
+
+    def testCompileServer(self):
+        fsc = fbuild.builders.scala.Fsc(self.ctx, self.fsc,
+            server_flags=['-max-idle', '5'])
+
+        src = self.buildroot / 'a.scala'
+        with open(src, 'w') as f:
+            f.write('object A\n')
+
+        fsc('a', [src])
+        fsc('b', [src])
+
+        # The server was started once, and every call went to it.
+        calls = self.calls()
+        self.assertEquals(calls[0], ['-max-idle', '5', '-verbose', '-reset'])
+        self.assertEquals([c for c in calls if c[-1] == '-reset'], [calls[0]])
+        self.assertTrue(all('-max-idle' in c for c in calls))
+        self.assertEquals(calls[-1][-1], src)
+
+        # Another compiler with the same fsc shares the server.
+        fbuild.builders.scala.Fsc(self.ctx, self.fsc,
+            server_flags=['-max-idle', '5'], debug=True)
+        self.assertEquals(len([c for c in self.calls() if c[-1] == '-reset']),
+            1)
+
+        # The server is stopped when the build is done.
+        self.ctx.cleanup()
+        self.assertEquals(self.calls()[-1], ['-max-idle', '5', '-shutdown'])
+        self.assertFalse(self.server.exists())
+
+    def testRunningCompileServer(self):
+        # Someone else already started the server.
+        open(self.server, 'w').close()
+
+        fsc = fbuild.builders.scala.Fsc(self.ctx, self.fsc)
+
+        src = self.buildroot / 'a.scala'
+        with open(src, 'w') as f:
+            f.write('object A\n')
+
+        fsc('a', [src])
+        self.assertEquals(self.calls()[0], ['-verbose', '-reset'])
+
+        # So we leave it running when the build is done.
+        self.ctx.cleanup()
+        self.assertFalse(any('-shutdown' in c for c in self.calls()))
+        self.assertTrue(self.server.exists())
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    return unittest.TestLoader().loadTestsFromTestCase(TestFsc)
+
+if __name__ == "__main__":
+    unittest.main()
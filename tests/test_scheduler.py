@@ -6,7 +6,7 @@ import unittest
 import gc
 
 from fbuild.console import Log
-from fbuild.sched import Scheduler
+from fbuild.sched import DependencyLoop, Scheduler, TasksFailed
 
 import threading
 
@@ -51,6 +51,127 @@ class TestScheduler(unittest.TestCase):
             self.scheduler.map(g, [[0,1,2],[3,4,5],[6,7,8]]),
             [[1,2,3],[4,5,6],[7,8,9]])
 
+    def testImapUnordered(self):
+        def f(x):
+            time.sleep(random.random() * 0.01)
+            return x + 1
+
+        self.assertEquals(
+            sorted(self.scheduler.imap_unordered(f, [0,1,2,3,4,5,6,7,8,9])),
+            [1,2,3,4,5,6,7,8,9,10])
+
+        # now test if we can handle recursive scheduling
+        def g(x):
+            time.sleep(random.random() * 0.01)
+            return sorted(self.scheduler.imap_unordered(f, x))
+
+        self.assertEquals(
+            sorted(self.scheduler.imap_unordered(g,
+                [[0,1,2],[3,4,5],[6,7,8]])),
+            [[1,2,3],[4,5,6],[7,8,9]])
+
+    def testSubmit(self):
+        def f(x):
+            time.sleep(random.random() * 0.01)
+            return x + 1
+
+        futures = [self.scheduler.submit(f, x) for x in range(10)]
+        self.assertEquals(
+            [future.result() for future in futures],
+            [1,2,3,4,5,6,7,8,9,10])
+        self.assertTrue(all(future.done() for future in futures))
+
+        # now test if we can handle recursive scheduling
+        def g(x):
+            return self.scheduler.submit(f, x).result()
+
+        futures = [self.scheduler.submit(g, x) for x in range(10)]
+        self.assertEquals(
+            sorted(future.result() for future in
+                self.scheduler.as_completed(futures)),
+            [1,2,3,4,5,6,7,8,9,10])
+
+    def testSubmitError(self):
+        def f(x):
+            raise ValueError(x)
+
+        future = self.scheduler.submit(f, 5)
+        self.assertRaises(ValueError, future.result)
+        self.assertTrue(isinstance(future.exception(), ValueError))
+
+    def testMapWithDependencies(self):
+        def deps(x):
+            return {'a': ['b', 'c'], 'b': ['c'], 'c': [], 'd': ['d']}[x]
+
+        def f(x):
+            time.sleep(random.random() * 0.01)
+            return x
+
+        self.assertEquals(
+            self.scheduler.map_with_dependencies(deps, f, ['a', 'b', 'c']),
+            ['c', 'b', 'a'])
+
+        self.assertRaises(DependencyLoop,
+            self.scheduler.map_with_dependencies, deps, f, ['c', 'd'])
+
+        # A source's function should be able to run while the dependencies of
+        # the other sources are still being calculated.
+        if self.scheduler.threadcount < 2:
+            return
+
+        fast_done = threading.Event()
+        overlapped = []
+
+        def slow_deps(x):
+            if x == 'slow':
+                overlapped.append(fast_done.wait(5))
+            return []
+
+        def g(x):
+            if x == 'fast':
+                fast_done.set()
+            return x
+
+        self.scheduler.map_with_dependencies(slow_deps, g, ['slow', 'fast'])
+        self.assertEquals(overlapped, [True])
+
+    def testKeepGoing(self):
+        self.scheduler.keep_going = True
+
+        ran = set()
+        lock = threading.Lock()
+
+        def deps(x):
+            return {'a': ['b'], 'b': [], 'c': [], 'd': ['a']}[x]
+
+        def f(x):
+            time.sleep(random.random() * 0.01)
+            if x == 'b':
+                raise ValueError(x)
+
+            with lock:
+                ran.add(x)
+            return x
+
+        self.assertRaises(ValueError, self.scheduler.map_with_dependencies,
+            deps, f, ['a', 'b', 'c', 'd'])
+        self.assertEquals(ran, {'c'})
+
+        def g(x):
+            time.sleep(random.random() * 0.01)
+            if x % 2:
+                raise ValueError(x)
+            return x
+
+        try:
+            self.scheduler.map(g, range(10))
+        except TasksFailed as e:
+            self.assertEquals(
+                sorted(err.args[0] for err in e.errors),
+                [1, 3, 5, 7, 9])
+        else:
+            self.fail('TasksFailed not raised')
+
     def run(self, *args, **kwargs):
         for i in range(10):
             self.threads = i
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3.1
+
+import json
+import os
+import tempfile
+import unittest
+
+from fbuild.sched import Scheduler
+from fbuild.trace import Tracer
+
+# -----------------------------------------------------------------------------
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        self.tracer = Tracer()
+
+    def load(self):
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            self.tracer.save(filename)
+            with open(filename) as f:
+                return json.load(f)['traceEvents']
+        finally:
+            os.remove(filename)
+
+    def testSpan(self):
+        with self.tracer.span('outer', 'test', x=1) as args:
+            with self.tracer.span('inner', 'test'):
+                pass
+            args['y'] = 2
+
+        events = {e['name']: e for e in self.load() if e['ph'] == 'X'}
+        outer = events['outer']
+        inner = events['inner']
+
+        self.assertEquals(outer['args'], {'x': '1', 'y': '2'})
+        self.assertEquals(outer['tid'], inner['tid'])
+        self.assertTrue(outer['ts'] <= inner['ts'])
+        self.assertTrue(
+            inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur'])
+
+    def testScheduler(self):
+        def f(x):
+            return x + 1
+
+        scheduler = Scheduler(4, tracer=self.tracer)
+        try:
+            self.assertEquals(scheduler.map(f, range(10)), list(range(1, 11)))
+        finally:
+            scheduler.shutdown()
+
+        events = self.load()
+        self.assertEquals(
+            sorted(int(e['args']['src'])
+                for e in events if e['ph'] == 'X' and e['name'] == 'f'),
+            list(range(10)))
+
+        # Every thread that ran a span should be named.
+        tids = {e['tid'] for e in events if e['ph'] == 'X'}
+        names = {e['tid'] for e in events if e['ph'] == 'M'}
+        self.assertEquals(tids, names)
+
+# -----------------------------------------------------------------------------
+
+def suite(*args, **kwargs):
+    return unittest.TestLoader().loadTestsFromTestCase(TestTrace)
+
+if __name__ == "__main__":
+    unittest.main()